@@ -3,6 +3,7 @@ from kmuhelper.modules.api import admin as apiadmin
 from kmuhelper.modules.app import admin as appadmin
 from kmuhelper.modules.emails import admin as emailadmin
 from kmuhelper.modules.integrations.paymentimport import admin as paymentimportadmin
+from kmuhelper.modules.integrations.woocommerce import admin as woocommerceadmin
 from kmuhelper.modules.log import admin as logadmin
 from kmuhelper.modules.main import admin as mainadmin
 from kmuhelper.modules.settings import admin as settingsadmin
@@ -23,5 +24,6 @@ for adminclass in [
     appadmin,
     settingsadmin,
     paymentimportadmin,
+    woocommerceadmin,
 ]:
     modeladmins.extend(adminclass.modeladmins)
@@ -34,6 +34,36 @@ PAYMENTMETHODS = [
     ("paypal", _("PayPal")),
 ]
 
+STOCK_MOVEMENT_REASONS = [
+    ("order", _("Bestellung")),
+    ("supply", _("Lieferung")),
+    ("reset", _("Zurückgesetzt")),
+    ("manual", _("Manuelle Änderung")),
+    ("import", _("Import")),
+]
+
+WEBHOOK_DELIVERY_STATUSES = [
+    ("pending", _("Ausstehend")),
+    ("processing", _("In Verarbeitung")),
+    ("done", _("Verarbeitet")),
+    ("coalesced", _("Zusammengefasst")),
+    ("failed", _("Fehlgeschlagen")),
+]
+
+IMPORT_JOB_RESOURCES = [
+    ("products", _("Produkte")),
+    ("customers", _("Kunden")),
+    ("categories", _("Produktkategorien")),
+    ("orders", _("Bestellungen")),
+]
+
+IMPORT_JOB_STATUSES = [
+    ("pending", _("Wartend")),
+    ("running", _("Läuft")),
+    ("done", _("Abgeschlossen")),
+    ("failed", _("Fehlgeschlagen")),
+]
+
 COUNTRIES = [("CH", _("Schweiz")), ("LI", _("Liechtenstein"))]
 
 LANGUAGES = [
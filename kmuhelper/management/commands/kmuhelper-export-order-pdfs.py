@@ -0,0 +1,90 @@
+"""
+Renders the PDFs (e.g. invoices or delivery notes) of many orders into one PDF or a ZIP file
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kmuhelper import constants
+from kmuhelper.modules.main.models import Order
+from kmuhelper.modules.pdfgeneration.order.batch import export_order_pdfs
+from kmuhelper.modules.pdfgeneration.order.generator import PDFOrder
+
+
+class Command(BaseCommand):
+    help = "Renders the PDFs of many orders in parallel into one merged PDF or a ZIP file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the PDF or ZIP file to create")
+        parser.add_argument(
+            "--preset",
+            choices=PDFOrder.PRESETS,
+            default="invoice",
+            help="Template of the documents (default: invoice)",
+        )
+        parser.add_argument(
+            "--ids",
+            type=int,
+            nargs="+",
+            help="Only the orders with these ids",
+        )
+        parser.add_argument(
+            "--from",
+            dest="date_from",
+            type=date.fromisoformat,
+            help="Only orders created on or after this date (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--to",
+            dest="date_to",
+            type=date.fromisoformat,
+            help="Only orders created on or before this date (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--language",
+            choices=dict(constants.LANGUAGES),
+            help="Language of the documents (default: language of each order)",
+        )
+        parser.add_argument(
+            "--zip",
+            action="store_true",
+            help="Create a ZIP file with one PDF per order instead of one merged PDF",
+        )
+        parser.add_argument(
+            "--with-cut-lines",
+            action="store_true",
+            help="Add cut lines to the QR invoices (not for printing on perforated paper)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of worker processes (default: number of CPUs, 0 for no subprocesses)",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] is not None and options["workers"] < 0:
+            raise CommandError("--workers must not be negative")
+
+        queryset = Order.objects.all()
+        if options["ids"]:
+            queryset = queryset.filter(pk__in=options["ids"])
+        if options["date_from"]:
+            queryset = queryset.filter(date__date__gte=options["date_from"])
+        if options["date_to"]:
+            queryset = queryset.filter(date__date__lte=options["date_to"])
+
+        order_ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+        if not order_ids:
+            raise CommandError("No orders found!")
+
+        count = export_order_pdfs(
+            order_ids,
+            options["output"],
+            preset=options["preset"],
+            lang=options["language"],
+            is_print_version=not options["with_cut_lines"],
+            as_zip=options["zip"],
+            workers=options["workers"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} documents to {options['output']}."))
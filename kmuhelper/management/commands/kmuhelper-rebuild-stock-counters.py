@@ -0,0 +1,15 @@
+"""
+Recalculates the reserved and incoming stock of all products from open orders and supplies
+"""
+
+from django.core.management.base import BaseCommand
+
+from kmuhelper.modules.main.utils import StockUtils
+
+
+class Command(BaseCommand):
+    help = "Recalculates the reserved and incoming stock counters of all products."
+
+    def handle(self, *args, **options):
+        count = StockUtils.rebuild_stock_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock counters of {count} products."))
@@ -0,0 +1,82 @@
+"""
+Recalculates the cached sum of orders and reports orders whose cached sum was wrong
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kmuhelper.modules.main.models import Order
+from kmuhelper.modules.main.utils import OrderSumUtils
+
+
+class Command(BaseCommand):
+    help = "Recalculates Order.cached_sum in chunks and reports orders with a differing sum."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="date_from",
+            type=date.fromisoformat,
+            help="Only orders created on or after this date (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--to",
+            dest="date_to",
+            type=date.fromisoformat,
+            help="Only orders created on or before this date (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of orders per chunk (default: 1000)",
+        )
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            help="Resume after the order with this id (printed after every chunk)",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report differing sums, don't save anything",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        queryset = Order.objects.all()
+        if options["date_from"]:
+            queryset = queryset.filter(date__date__gte=options["date_from"])
+        if options["date_to"]:
+            queryset = queryset.filter(date__date__lte=options["date_to"])
+
+        checked = 0
+        drifted = 0
+        for result in OrderSumUtils.iter_recalculate(
+            queryset,
+            chunk_size=options["chunk_size"],
+            start_after=options["start_after"],
+            save=not options["check"],
+        ):
+            checked += result.checked
+            drifted += len(result.drifts)
+            for drift in result.drifts:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"Order {drift.order_id}: cached {drift.cached_sum:.2f}, "
+                        f"calculated {drift.calculated_sum:.2f}"
+                    )
+                )
+            self.stdout.write(
+                f"{checked} orders checked (resume with --start-after {result.last_id})"
+            )
+
+        action = "found" if options["check"] else "fixed"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done! {checked} orders checked, {drifted} differing sums {action}."
+            )
+        )
@@ -0,0 +1,15 @@
+"""
+Saves the current stock of all products as a snapshot (should be run periodically, e.g. daily)
+"""
+
+from django.core.management.base import BaseCommand
+
+from kmuhelper.modules.main.utils import StockUtils
+
+
+class Command(BaseCommand):
+    help = "Saves the current stock of all products as a snapshot."
+
+    def handle(self, *args, **options):
+        count = StockUtils.create_stock_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Saved stock snapshots for {count} products."))
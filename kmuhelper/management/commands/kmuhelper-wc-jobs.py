@@ -0,0 +1,42 @@
+"""
+Resumes interrupted WooCommerce import jobs (e.g. after a restart, as a cronjob)
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kmuhelper.modules.integrations.woocommerce.jobs import run_waiting_import_jobs
+from kmuhelper.modules.integrations.woocommerce.utils import is_connected
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the WooCommerce import jobs which have been interrupted (e.g. by a restart of the "
+        "server) or have never been started. Already imported objects are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and check for interrupted jobs periodically",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="Seconds between the checks with --loop (default: 60)",
+        )
+
+    def handle(self, *args, **options):
+        if not is_connected():
+            raise CommandError("WooCommerce is not connected.")
+
+        while True:
+            count = run_waiting_import_jobs()
+            if count or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Import jobs run: {count}"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
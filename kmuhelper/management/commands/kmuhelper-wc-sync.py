@@ -0,0 +1,54 @@
+"""
+Imports new and updates changed objects from WooCommerce (e.g. as a nightly job)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kmuhelper.modules.integrations.woocommerce.api import (
+    WCCustomersAPI,
+    WCOrdersAPI,
+    WCProductCategoriesAPI,
+    WCProductsAPI,
+)
+from kmuhelper.modules.integrations.woocommerce.utils import is_connected
+
+# In order of their dependencies
+RESOURCES = {
+    "categories": WCProductCategoriesAPI,
+    "products": WCProductsAPI,
+    "customers": WCCustomersAPI,
+    "orders": WCOrdersAPI,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports new and updates changed objects from WooCommerce. Products and orders are only "
+        "downloaded if they have been modified since the last sync."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "resources",
+            nargs="*",
+            choices=RESOURCES,
+            help="Resources to sync (default: all)",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Download all objects instead of only the ones modified since the last sync",
+        )
+
+    def handle(self, *args, **options):
+        if not is_connected():
+            raise CommandError("WooCommerce is not connected.")
+
+        for name, api_class in RESOURCES.items():
+            if options["resources"] and name not in options["resources"]:
+                continue
+
+            created, updated = api_class().sync_objects_from_api(full=options["full"])
+            self.stdout.write(
+                self.style.SUCCESS(f"Synced {name}: {created} created, {updated} updated.")
+            )
@@ -0,0 +1,55 @@
+"""
+Processes the received WooCommerce webhooks (e.g. every minute or as a long-running worker)
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kmuhelper.modules.integrations.woocommerce.utils import is_connected
+from kmuhelper.modules.integrations.woocommerce.webhooks import process_webhook_inbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Processes the received WooCommerce webhooks. Webhooks of different objects are "
+        "processed in parallel, failed ones are retried later. Multiple workers can run at the "
+        "same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Maximum number of webhooks processed in parallel (default: "
+            "KMUHELPER_WC_CONCURRENCY)",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and check for new webhooks periodically",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds between the checks with --loop (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        if not is_connected():
+            raise CommandError("WooCommerce is not connected.")
+
+        while True:
+            counts = process_webhook_inbox(concurrency=options["concurrency"])
+            if any(counts.values()) or not options["loop"]:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Processed webhooks: {counts['done']} done, "
+                        f"{counts['coalesced']} coalesced, {counts['retrying']} retrying, "
+                        f"{counts['failed']} failed."
+                    )
+                )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,113 @@
+# Generated by Django 6.1.2 on 2026-10-18 12:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0118_proper_settings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockMovement",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Datum"),
+                ),
+                ("difference", models.IntegerField(verbose_name="Veränderung")),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("order", "Bestellung"),
+                            ("supply", "Lieferung"),
+                            ("reset", "Zurückgesetzt"),
+                            ("manual", "Manuelle Änderung"),
+                            ("import", "Import"),
+                        ],
+                        max_length=10,
+                        verbose_name="Grund",
+                    ),
+                ),
+                (
+                    "linked_order",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="kmuhelper.order",
+                        verbose_name="Bestellung",
+                    ),
+                ),
+                (
+                    "linked_supply",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="kmuhelper.supply",
+                        verbose_name="Lieferung",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stock_movements",
+                        to="kmuhelper.product",
+                        verbose_name="Produkt",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Lagerbewegung",
+                "verbose_name_plural": "Lagerbewegungen",
+                "indexes": [
+                    models.Index(fields=["product", "date"], name="kmuhelper_s_product_1a2f16_idx")
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="StockSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Datum"),
+                ),
+                ("stock", models.IntegerField(verbose_name="Lagerbestand")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stock_snapshots",
+                        to="kmuhelper.product",
+                        verbose_name="Produkt",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Lagerbestand-Snapshot",
+                "verbose_name_plural": "Lagerbestand-Snapshots",
+                "indexes": [
+                    models.Index(fields=["product", "date"], name="kmuhelper_s_product_421467_idx")
+                ],
+            },
+        ),
+    ]
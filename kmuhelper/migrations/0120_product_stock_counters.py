@@ -0,0 +1,67 @@
+# Generated by Django 6.1.2 on 2026-10-18 12:53
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calculate_stock_counters(apps, schema_editor):
+    Product = apps.get_model("kmuhelper", "Product")
+    OrderItem = apps.get_model("kmuhelper", "OrderItem")
+    SupplyItem = apps.get_model("kmuhelper", "SupplyItem")
+
+    Product.objects.update(
+        stock_reserved=Coalesce(
+            Subquery(
+                OrderItem.objects.filter(
+                    order__is_removed_from_stock=False, linked_product_id=OuterRef("pk")
+                )
+                .values("linked_product_id")
+                .annotate(total=Sum("quantity"))
+                .values("total")
+            ),
+            Value(0),
+        ),
+        stock_incoming=Coalesce(
+            Subquery(
+                SupplyItem.objects.filter(
+                    supply__is_added_to_stock=False, product_id=OuterRef("pk")
+                )
+                .values("product_id")
+                .annotate(total=Sum("quantity"))
+                .values("total")
+            ),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0119_stock_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="stock_incoming",
+            field=models.IntegerField(
+                default=0,
+                editable=False,
+                help_text="Menge in noch nicht eingelagerten Lieferungen",
+                verbose_name="Eingehender Lagerbestand",
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stock_reserved",
+            field=models.IntegerField(
+                default=0,
+                editable=False,
+                help_text="Menge in noch nicht versendeten Bestellungen",
+                verbose_name="Reservierter Lagerbestand",
+            ),
+        ),
+        migrations.RunPython(calculate_stock_counters, migrations.RunPython.noop),
+    ]
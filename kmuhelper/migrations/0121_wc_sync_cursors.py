@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def forwards_func(apps, schema_editor):
+    SettingHidden = apps.get_model("kmuhelper", "SettingHidden")
+    db_alias = schema_editor.connection.alias
+
+    SettingHidden.objects.using(db_alias).update_or_create(
+        id="wc-sync-cursors", defaults={"typ": "json"}
+    )
+
+
+def reverse_func(apps, schema_editor):
+    SettingHidden = apps.get_model("kmuhelper", "SettingHidden")
+    db_alias = schema_editor.connection.alias
+
+    SettingHidden.objects.using(db_alias).filter(id="wc-sync-cursors").delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("kmuhelper", "0120_product_stock_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_code=reverse_func),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 6.1.2 on 2026-10-18 13:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0121_wc_sync_cursors"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookDelivery",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "delivery_id",
+                    models.CharField(max_length=64, unique=True, verbose_name="Zustellungs-ID"),
+                ),
+                ("topic", models.CharField(max_length=50, verbose_name="Thema")),
+                ("object_id", models.PositiveBigIntegerField(verbose_name="WooCommerce ID")),
+                ("payload", models.JSONField(verbose_name="Daten")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Ausstehend"),
+                            ("done", "Verarbeitet"),
+                            ("failed", "Fehlgeschlagen"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="Status",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Versuche")),
+                ("error", models.TextField(blank=True, default="", verbose_name="Fehler")),
+                (
+                    "received_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Empfangen am"
+                    ),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Nächster Versuch am"
+                    ),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="Verarbeitet am"),
+                ),
+            ],
+            options={
+                "verbose_name": "Webhook",
+                "verbose_name_plural": "Webhooks",
+                "indexes": [
+                    models.Index(
+                        fields=["status", "received_at"], name="kmuhelper_w_status_e1fa76_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0122_wc_webhook_inbox"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webhookdelivery",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ausstehend"),
+                    ("done", "Verarbeitet"),
+                    ("coalesced", "Zusammengefasst"),
+                    ("failed", "Fehlgeschlagen"),
+                ],
+                default="pending",
+                max_length=10,
+                verbose_name="Status",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.1.2 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0123_wc_webhook_coalescing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="woocommerce_fingerprint",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                max_length=64,
+                verbose_name="WooCommerce fingerprint",
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="woocommerce_fingerprint",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                max_length=64,
+                verbose_name="WooCommerce fingerprint",
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="woocommerce_fingerprint",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                max_length=64,
+                verbose_name="WooCommerce fingerprint",
+            ),
+        ),
+        migrations.AddField(
+            model_name="productcategory",
+            name="woocommerce_fingerprint",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                max_length=64,
+                verbose_name="WooCommerce fingerprint",
+            ),
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 6.1.2 on 2026-10-18 14:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0124_woocommerce_fingerprint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "resource",
+                    models.CharField(
+                        choices=[
+                            ("products", "Produkte"),
+                            ("customers", "Kunden"),
+                            ("categories", "Produktkategorien"),
+                            ("orders", "Bestellungen"),
+                        ],
+                        max_length=20,
+                        verbose_name="Objekte",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Wartend"),
+                            ("running", "Läuft"),
+                            ("done", "Abgeschlossen"),
+                            ("failed", "Fehlgeschlagen"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="Status",
+                    ),
+                ),
+                (
+                    "total",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        help_text="Anzahl der zu importierenden Objekte im aktuellen Durchlauf",
+                        null=True,
+                        verbose_name="Anzahl Objekte",
+                    ),
+                ),
+                (
+                    "done",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Anzahl der verarbeiteten Objekte im aktuellen Durchlauf",
+                        verbose_name="Verarbeitet",
+                    ),
+                ),
+                (
+                    "imported",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Anzahl der importierten Objekte in allen Durchläufen",
+                        verbose_name="Importiert",
+                    ),
+                ),
+                ("runs", models.PositiveIntegerField(default=0, verbose_name="Durchläufe")),
+                ("error", models.TextField(blank=True, default="", verbose_name="Fehler")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Erstellt am"
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Start des aktuellen Durchlaufs",
+                        null=True,
+                        verbose_name="Gestartet am",
+                    ),
+                ),
+                (
+                    "heartbeat_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Letztes Lebenszeichen"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="Beendet am"),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Gestartet von",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Import",
+                "verbose_name_plural": "Importe",
+            },
+        ),
+    ]
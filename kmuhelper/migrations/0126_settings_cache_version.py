@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def forwards_func(apps, schema_editor):
+    SettingHidden = apps.get_model("kmuhelper", "SettingHidden")
+    db_alias = schema_editor.connection.alias
+
+    SettingHidden.objects.using(db_alias).update_or_create(
+        id="settings-cache-version", defaults={"typ": "char"}
+    )
+
+
+def reverse_func(apps, schema_editor):
+    SettingHidden = apps.get_model("kmuhelper", "SettingHidden")
+    db_alias = schema_editor.connection.alias
+
+    SettingHidden.objects.using(db_alias).filter(id="settings-cache-version").delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("kmuhelper", "0125_woocommerce_importjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_code=reverse_func),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.1.2 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kmuhelper", "0127_order_defaults_cache_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookdelivery",
+            name="claimed_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Zeitpunkt, an dem die Verarbeitung zuletzt begonnen wurde",
+                null=True,
+                verbose_name="Übernommen am",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="webhookdelivery",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ausstehend"),
+                    ("processing", "In Verarbeitung"),
+                    ("done", "Verarbeitet"),
+                    ("coalesced", "Zusammengefasst"),
+                    ("failed", "Fehlgeschlagen"),
+                ],
+                default="pending",
+                max_length=10,
+                verbose_name="Status",
+            ),
+        ),
+    ]
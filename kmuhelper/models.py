@@ -5,3 +5,4 @@ import kmuhelper.modules.api.models
 import kmuhelper.modules.settings.models
 
 import kmuhelper.modules.integrations.paymentimport.models
+import kmuhelper.modules.integrations.woocommerce.models
@@ -24,9 +24,12 @@ MODULES = {
             "Supply",
             "Note",
             "Product",
+            "StockMovement",
             "ProductCategory",
             "PaymentReceiver",
             "PaymentImport",
+            "WebhookDelivery",
+            "ImportJob",
         ],
     },
     "emails": {
@@ -0,0 +1,130 @@
+from django.contrib import admin, messages
+from django.utils import timezone
+from django.utils.translation import gettext_lazy, ngettext
+
+from kmuhelper.modules.integrations.woocommerce import jobs
+from kmuhelper.modules.integrations.woocommerce.models import ImportJob, WebhookDelivery
+from kmuhelper.overrides import CustomModelAdmin
+
+_ = gettext_lazy
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(CustomModelAdmin):
+    fieldsets = [
+        (None, {"fields": ["delivery_id", "topic", "object_id", "received_at"]}),
+        (
+            _("Verarbeitung"),
+            {"fields": ["status", "attempts", "next_attempt_at", "claimed_at", "processed_at"]},
+        ),
+        (_("Fehler"), {"fields": ["error"]}),
+        (_("Daten"), {"fields": ["payload"]}),
+    ]
+
+    list_display = (
+        "pkfill",
+        "received_at",
+        "topic",
+        "object_id",
+        "status",
+        "attempts",
+        "processed_at",
+    )
+    list_filter = ("status", "topic")
+    search_fields = ["delivery_id", "object_id"]
+
+    ordering = ("-received_at", "-pk")
+
+    date_hierarchy = "received_at"
+
+    actions = ["retry"]
+
+    @admin.action(description=_("Erneut verarbeiten"), permissions=["change"])
+    def retry(self, request, queryset):
+        count = queryset.exclude(status__in=["pending", "processing"]).update(
+            status="pending", attempts=0, next_attempt_at=timezone.now()
+        )
+        messages.success(
+            request,
+            ngettext(
+                "%d Webhook wird erneut verarbeitet.",
+                "%d Webhooks werden erneut verarbeitet.",
+                count,
+            )
+            % count,
+        )
+
+    # Permissions
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(CustomModelAdmin):
+    fieldsets = [
+        (None, {"fields": ["resource", "status", "created_by", "created_at"]}),
+        (_("Fortschritt"), {"fields": ["done", "total", "imported", "runs"]}),
+        (_("Zeiten"), {"fields": ["started_at", "heartbeat_at", "finished_at"]}),
+        (_("Fehler"), {"fields": ["error"]}),
+    ]
+
+    list_display = (
+        "pkfill",
+        "created_at",
+        "resource",
+        "status",
+        "display_progress",
+        "imported",
+        "finished_at",
+    )
+    list_filter = ("status", "resource")
+
+    ordering = ("-created_at", "-pk")
+
+    actions = ["resume"]
+
+    @admin.display(description=_("Fortschritt"))
+    def display_progress(self, obj):
+        if obj.is_interrupted:
+            return _("Unterbrochen")
+        if obj.total is None:
+            return "-"
+        return f"{obj.done} / {obj.total}"
+
+    @admin.action(description=_("Fortsetzen"), permissions=["change"])
+    def resume(self, request, queryset):
+        count = 0
+        for job in queryset.filter(status__in=["pending", "running", "failed"]):
+            if job.status == "failed" or job.is_interrupted:
+                jobs.start_thread(job.pk)
+                count += 1
+        messages.success(
+            request,
+            ngettext(
+                "%d Import wird fortgesetzt.",
+                "%d Importe werden fortgesetzt.",
+                count,
+            )
+            % count,
+        )
+
+    # Permissions
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None
+
+
+#
+
+
+modeladmins = [
+    (WebhookDelivery, WebhookDeliveryAdmin),
+    (ImportJob, ImportJobAdmin),
+]
@@ -1,6 +1,12 @@
 import abc
+import hashlib
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 from django.contrib import messages
+from django.db import transaction
 from django.http import HttpRequest
 from django.utils.translation import ngettext
 from rich import print
@@ -8,14 +14,53 @@ from rich.progress import Progress
 from woocommerce import API as WCAPI
 
 from kmuhelper import settings
+from kmuhelper.modules.integrations.woocommerce.api._transport import (
+    WCSessionAPI,
+    get_concurrency,
+)
+from kmuhelper.modules.settings.models import SettingHidden
+
+# Hidden setting with the high-water marks of the incremental sync, per resource (WC_API_BASEURL)
+SYNC_CURSORS_SETTING = "wc-sync-cursors"
+
+
+def get_sync_cursors():
+    """Get the high-water marks of the incremental sync (not cached)"""
+
+    content = (
+        SettingHidden.objects.filter(id=SYNC_CURSORS_SETTING)
+        .values_list("content_json", flat=True)
+        .first()
+    )
+    return content or {}
+
+
+def set_sync_cursor(resource, cursor):
+    """Store the high-water mark of the incremental sync of a resource
+
+    The row is updated directly, as saving it would invalidate the settings cache of every
+    process on every sync run.
+    """
+
+    with transaction.atomic():
+        content = (
+            SettingHidden.objects.select_for_update()
+            .filter(id=SYNC_CURSORS_SETTING)
+            .values_list("content_json", flat=True)
+            .first()
+        )
+        cursors = content or {}
+        cursors[resource] = cursor
+        SettingHidden.objects.filter(id=SYNC_CURSORS_SETTING).update(content_json=cursors)
 
 
 def create_wc_api_object():
     """Create a API object from data stored in settings"""
-    return WCAPI(
+    return WCSessionAPI(
         url=settings.get_secret_db_setting("wc-url"),
         consumer_key=settings.get_secret_db_setting("wc-consumer_key"),
         consumer_secret=settings.get_secret_db_setting("wc-consumer_secret"),
+        timeout=settings.get_file_setting("KMUHELPER_WC_TIMEOUT", 30),
     )
 
 
@@ -37,6 +82,13 @@ class WC_BaseObjectAPI(WC_BaseAPI, abc.ABC):
     MODEL = NotImplemented
     WC_OBJ_DOES_NOT_EXIST_CODE = NotImplemented
     WC_API_BASEURL = NotImplemented
+    # Whether the list endpoint supports the 'modified_after' filter (used by the sync)
+    WC_API_SUPPORTS_MODIFIED_AFTER = False
+    # Default page size for lists (maximum allowed by the WooCommerce REST API)
+    WC_API_PER_PAGE = 100
+    # Keys of the WooCommerce data which change without a relevant change of the object
+    # (e.g. saving an object in WordPress always updates its modification date)
+    FINGERPRINT_IGNORED_KEYS = {"date_modified", "date_modified_gmt", "_links"}
 
     # Object methods
 
@@ -61,6 +113,62 @@ class WC_BaseObjectAPI(WC_BaseAPI, abc.ABC):
 
         raise NotImplementedError()
 
+    # Change detection
+
+    def get_fingerprint(self, wc_obj: dict) -> str:
+        """Hash of the relevant WooCommerce data of an object"""
+
+        data = {k: v for k, v in wc_obj.items() if k not in self.FINGERPRINT_IGNORED_KEYS}
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def is_unchanged(self, db_obj, wc_obj: dict) -> bool:
+        """Whether the data has already been applied to the object"""
+
+        return (
+            not db_obj.woocommerce_deleted
+            and db_obj.woocommerce_fingerprint == self.get_fingerprint(wc_obj)
+        )
+
+    def update_object_if_changed(self, db_obj, wc_obj: dict, **kwargs) -> bool:
+        """Update an existing object unless the data has already been applied to it
+
+        Returns: whether the object was updated"""
+
+        if self.is_unchanged(db_obj, wc_obj):
+            return False
+        self.update_object_from_data(db_obj, wc_obj, **kwargs)
+        return True
+
+    @staticmethod
+    def _get_field_values(db_obj) -> dict:
+        """Values of the concrete fields, to be passed to _save_changes() after updating"""
+
+        return {
+            field.attname: getattr(db_obj, field.attname) for field in db_obj._meta.concrete_fields
+        }
+
+    def _save_changes(self, db_obj, original_values: dict, wc_obj: dict) -> list[str]:
+        """Store the fingerprint and save only the fields which differ from the original values
+
+        Returns: names of the saved fields"""
+
+        db_obj.woocommerce_fingerprint = self.get_fingerprint(wc_obj)
+
+        changed_fields = []
+        for field in db_obj._meta.concrete_fields:
+            if field.attname not in original_values:
+                continue
+            # Compare the Python values, as e.g. dates are assigned as strings
+            value = field.to_python(getattr(db_obj, field.attname))
+            if value != field.to_python(original_values[field.attname]):
+                changed_fields.append(field.attname)
+
+        if changed_fields:
+            db_obj.save(update_fields=changed_fields)
+        return changed_fields
+
     def delete_object_from_data(self, db_obj, wc_obj: dict):
         """Mark an existing object as deleted
 
@@ -92,34 +200,126 @@ class WC_BaseObjectAPI(WC_BaseAPI, abc.ABC):
             return False
 
         try:
-            self.update_object_from_data(db_object, wc_obj)
+            self.update_object_if_changed(db_object, wc_obj)
         except Exception as e:
             self.log("[red]Object update failed with exception {}".format(e))
             return False
         return True
 
+    def _get_page(self, params: dict, page: int, endpoint: str = None) -> list[dict]:
+        r = self.wcapi.get(endpoint or self.WC_API_BASEURL, params={**params, "page": page})
+        r.raise_for_status()
+        return r.json()
+
+    def _download_batches(self, wc_ids: list[int]):
+        """Download objects by id with concurrent 'include' list requests
+
+        Yields: (batch of ids, list of objects or None if the request failed)"""
+
+        batches = [
+            wc_ids[i : i + self.WC_API_PER_PAGE]
+            for i in range(0, len(wc_ids), self.WC_API_PER_PAGE)
+        ]
+
+        def download(batch):
+            try:
+                return self._get_page(
+                    {"include": ",".join(map(str, batch)), "per_page": len(batch)}, 1
+                )
+            except Exception as e:
+                self.log("[red]Object download failed with exception {}".format(e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=get_concurrency()) as executor:
+            yield from zip(batches, executor.map(download, batches))
+
+    def download_objects_by_id(self, wc_ids) -> dict[int, dict]:
+        """Download objects by id in batches
+
+        Objects that are not returned by the list endpoint (e.g. variations) are downloaded
+        one by one (concurrently). Objects that don't exist are missing in the result."""
+
+        wc_objects = {}
+        for batch, batch_objects in self._download_batches(list(wc_ids)):
+            for wc_obj in batch_objects or []:
+                wc_objects[wc_obj["id"]] = wc_obj
+
+        def download(wc_id):
+            r = self.wcapi.get(f"{self.WC_API_BASEURL}/{wc_id}")
+            return r.json() if r.status_code == 200 else None
+
+        remaining = [wc_id for wc_id in wc_ids if wc_id not in wc_objects]
+        if remaining:
+            with ThreadPoolExecutor(max_workers=get_concurrency()) as executor:
+                for wc_obj in executor.map(download, remaining):
+                    if wc_obj is not None:
+                        wc_objects[wc_obj["id"]] = wc_obj
+        return wc_objects
+
+    def _can_update_in_batch(self, db_obj) -> bool:
+        """Whether the object is returned by the list endpoint (e.g. not for variations)"""
+
+        return True
+
     def bulk_update_objects_from_api(self, db_queryset, request=None) -> (int, int, int):
-        """Update every object in a queryset"""
+        """Update every object in a queryset
+
+        The objects are downloaded in batches of up to WC_API_PER_PAGE with 'include' list
+        requests. Objects missing in the response (e.g. because the list doesn't show them) are
+        downloaded one by one and only marked as deleted if they don't exist."""
 
         success_count = 0
         warning_count = 0
         error_count = 0
 
+        db_objects = defaultdict(list)
+        single_objects = []
+        for db_obj in db_queryset:
+            if not db_obj.woocommerceid:
+                warning_count += 1
+            elif self._can_update_in_batch(db_obj):
+                db_objects[db_obj.woocommerceid].append(db_obj)
+            else:
+                single_objects.append(db_obj)
+
         with Progress() as progress:
             task = progress.add_task(
                 self.LOG_PREFIX + " [orange_red1]Updating objects...",
-                total=db_queryset.count(),
+                total=sum(len(objs) for objs in db_objects.values()) + len(single_objects),
             )
-            for db_obj in db_queryset:
-                if db_obj.woocommerceid:
-                    try:
-                        self.update_object_from_api(db_obj)
+
+            for batch, wc_objects in self._download_batches(list(db_objects)):
+                if wc_objects is None:
+                    count = sum(len(db_objects[wc_id]) for wc_id in batch)
+                    error_count += count
+                    progress.update(task, advance=count)
+                    continue
+
+                wc_objects_by_id = {wc_obj["id"]: wc_obj for wc_obj in wc_objects}
+                for wc_id in batch:
+                    wc_obj = wc_objects_by_id.get(wc_id)
+                    if wc_obj is None:
+                        # Checked with the object endpoint, which tells whether it was deleted
+                        single_objects += db_objects[wc_id]
+                        continue
+                    for db_obj in db_objects[wc_id]:
+                        try:
+                            self.update_object_if_changed(db_obj, wc_obj)
+                            success_count += 1
+                        except Exception as e:
+                            self.log("[red]Object update failed with exception {}".format(e))
+                            error_count += 1
+                        progress.update(task, advance=1)
+
+            for db_obj in single_objects:
+                try:
+                    if self.update_object_from_api(db_obj):
                         success_count += 1
-                    except Exception as e:
-                        self.log("[red]Object update failed with exception {}".format(e))
+                    else:
                         error_count += 1
-                else:
-                    warning_count += 1
+                except Exception as e:
+                    self.log("[red]Object update failed with exception {}".format(e))
+                    error_count += 1
                 progress.update(task, advance=1)
             progress.stop_task(task)
 
@@ -130,60 +330,157 @@ class WC_BaseObjectAPI(WC_BaseAPI, abc.ABC):
 
         return success_count, warning_count, error_count
 
+    def prepare_import(self, wc_objects: list[dict]):
+        """Prepare the import of multiple objects before any of them is created
+
+        Can be overridden by subclasses, e.g. to load dependencies in bulk."""
+        ...
+
+    def prepare_update(self, wc_obj: dict, is_create_event: bool = False):
+        """Download everything needed to create or update an object from the data in advance
+
+        Used by the webhooks, so that the changes can then be written in a short transaction
+        without waiting for WooCommerce. Can be overridden by subclasses."""
+        ...
+
     def _post_process_imported_objects(
         self, db_obj__wc_obj_list: list[tuple[object, dict]], request: HttpRequest = None
     ):
         """Post-process imported objects after all objects have been imported"""
         ...
 
-    def import_all_objects_from_api(self, request: HttpRequest = None) -> int:
+    def _download_objects(
+        self, progress: Progress = None, params: dict = None, endpoint: str = None
+    ) -> list[dict]:
+        """Download all pages of an object list (default: WC_API_BASEURL)
+
+        The first page tells the number of pages, the others are then downloaded concurrently
+        (see KMUHELPER_WC_CONCURRENCY)."""
+
+        endpoint = endpoint or self.WC_API_BASEURL
+        per_page = settings.get_file_setting("KMUHELPER_WC_PER_PAGE", self.WC_API_PER_PAGE)
+        params = {"per_page": per_page, **(params or {})}
+        # Without a progress display, e.g. within the import of another object
+        progress = progress or Progress(disable=True)
+        task_download = progress.add_task(self.LOG_PREFIX + " [green]Downloading objects...")
+
+        r = self.wcapi.get(endpoint, params=params)
+        r.raise_for_status()
+        wc_objects = r.json()
+        total_pages = int(r.headers.get("X-WP-TotalPages", 1))
+
+        progress.update(task_download, advance=1, total=total_pages)
+
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=get_concurrency()) as executor:
+                # map() returns the pages in order
+                for page_objects in executor.map(
+                    lambda page: self._get_page(params, page, endpoint),
+                    range(2, total_pages + 1),
+                ):
+                    wc_objects += page_objects
+                    progress.update(task_download, advance=1)
+
+        progress.stop_task(task_download)
+        return wc_objects
+
+    def _download_modified_objects(
+        self, progress: Progress, modified_after: str = None
+    ) -> list[dict]:
+        """Download all objects modified after a date (all if None), oldest changes first
+
+        Instead of page numbers, each request asks for the objects modified after the last date
+        of the previous page (keyset paging). An object modified during the download moves to
+        the end of the list and is downloaded again, whereas with page numbers, the objects after
+        it would move up by one and one of them would be skipped. Objects are only returned once,
+        in their latest state."""
+
+        per_page = settings.get_file_setting("KMUHELPER_WC_PER_PAGE", self.WC_API_PER_PAGE)
+        params = {
+            "per_page": per_page,
+            "orderby": "modified",
+            "order": "asc",
+            "dates_are_gmt": "true",
+        }
+        task_download = progress.add_task(self.LOG_PREFIX + " [green]Downloading objects...")
+
+        wc_objects = {}
+        # Already downloaded objects of the second the next page starts with
+        seen_ids = set()
+        while True:
+            page_params = dict(params)
+            if modified_after:
+                page_params["modified_after"] = modified_after
+            if seen_ids:
+                page_params["exclude"] = ",".join(map(str, sorted(seen_ids)))
+            r = self.wcapi.get(self.WC_API_BASEURL, params=page_params)
+            r.raise_for_status()
+            page_objects = r.json()
+            for wc_obj in page_objects:
+                # Keep the latest state, in the order of the changes
+                wc_objects.pop(wc_obj["id"], None)
+                wc_objects[wc_obj["id"]] = wc_obj
+            progress.update(task_download, advance=1)
+
+            if int(r.headers.get("X-WP-TotalPages", 1)) <= 1:
+                break
+            # The dates only have seconds, so the next page starts with the second of the last
+            # object. The objects of this second which have already been downloaded are excluded.
+            last_modified = page_objects[-1]["date_modified_gmt"]
+            next_modified_after = (
+                datetime.fromisoformat(last_modified) - timedelta(seconds=1)
+            ).isoformat()
+            if next_modified_after != modified_after:
+                modified_after = next_modified_after
+                seen_ids = set()
+            seen_ids.update(
+                wc_obj["id"]
+                for wc_obj in page_objects
+                if wc_obj["date_modified_gmt"] == last_modified
+            )
+
+        progress.stop_task(task_download)
+        return list(wc_objects.values())
+
+    def import_all_objects_from_api(self, request: HttpRequest = None, on_progress=None) -> int:
         """Import new products from WooCommerce
 
+        Objects are created one after the other, so an interrupted import can be continued by
+        running it again. on_progress(done, total) is called after the download and after every
+        processed object (e.g. by background import jobs).
+
         Returns: number of imported products
         """
 
         with Progress() as progress:
-            task_prepare = progress.add_task(
-                self.LOG_PREFIX + " [orange_red1]Preparing object download...", total=1
-            )
-
-            excludeids = ",".join(
-                [
-                    str(obj.woocommerceid)
-                    for obj in self.MODEL.objects.all().exclude(woocommerceid=0)
-                ]
+            # Known objects are skipped locally, as an 'exclude' parameter with all their ids
+            # would exceed the URL length limit of the server at some point
+            known_ids = set(
+                self.MODEL.objects.exclude(woocommerceid=0).values_list("woocommerceid", flat=True)
             )
-            wc_objects = []
-
-            progress.update(task_prepare, advance=1)
-            progress.stop_task(task_prepare)
-
-            task_download = progress.add_task(self.LOG_PREFIX + " [green]Downloading objects...")
-
-            r = self.wcapi.get(f"{self.WC_API_BASEURL}?exclude={excludeids}")
-            wc_objects += r.json()
-
-            progress.update(task_download, advance=1, total=int(r.headers["X-WP-TotalPages"]))
+            wc_objects = [
+                wc_obj
+                for wc_obj in self._download_objects(progress)
+                if wc_obj["id"] not in known_ids
+            ]
 
-            for page in range(2, int(r.headers["X-WP-TotalPages"]) + 1):
-                wc_objects += self.wcapi.get(
-                    f"{self.WC_API_BASEURL}?exclude={excludeids}&page={page}"
-                ).json()
-                progress.update(task_download, advance=1)
-
-            progress.stop_task(task_download)
+            if on_progress is not None:
+                on_progress(0, len(wc_objects))
 
             if wc_objects:
+                self.prepare_import(wc_objects)
                 db_wc_object_list = []
 
                 task_process = progress.add_task(
                     self.LOG_PREFIX + " [cyan]Processing objects...",
                     total=len(wc_objects),
                 )
-                for wc_obj in wc_objects:
+                for i, wc_obj in enumerate(wc_objects, start=1):
                     db_obj = self.create_object_from_data(wc_obj)
                     db_wc_object_list.append((db_obj, wc_obj))
                     progress.update(task_process, advance=1)
+                    if on_progress is not None:
+                        on_progress(i, len(wc_objects))
                 progress.stop_task(task_process)
 
                 self._post_process_imported_objects(db_wc_object_list, request=request)
@@ -192,6 +489,72 @@ class WC_BaseObjectAPI(WC_BaseAPI, abc.ABC):
             self._add_request_messages_from_import_counts(request, len(wc_objects))
         return len(wc_objects)
 
+    def sync_objects_from_api(self, request: HttpRequest = None, full=False) -> (int, int):
+        """Import new and update changed objects from WooCommerce
+
+        If the resource supports it, only objects modified since the last sync are downloaded.
+        The high-water mark (the most recent 'date_modified_gmt') is only stored after all
+        objects have been processed. Use full=True to ignore it.
+
+        Returns: number of created and updated (i.e. changed) objects
+        """
+
+        cursor = None if full else get_sync_cursors().get(self.WC_API_BASEURL)
+
+        created_list = []
+        updated_count = 0
+
+        with Progress() as progress:
+            if self.WC_API_SUPPORTS_MODIFIED_AFTER:
+                modified_after = None
+                if cursor:
+                    # Overlap by a second, as multiple objects can be modified within the same
+                    # second
+                    modified_after = (
+                        datetime.fromisoformat(cursor) - timedelta(seconds=1)
+                    ).isoformat()
+                wc_objects = self._download_modified_objects(progress, modified_after)
+            else:
+                wc_objects = self._download_objects(progress)
+
+            db_objects = {
+                db_obj.woocommerceid: db_obj
+                for db_obj in self.MODEL.objects.filter(
+                    woocommerceid__in=[wc_obj["id"] for wc_obj in wc_objects]
+                )
+            }
+
+            self.prepare_import([wc_obj for wc_obj in wc_objects if wc_obj["id"] not in db_objects])
+
+            task_process = progress.add_task(
+                self.LOG_PREFIX + " [cyan]Processing objects...",
+                total=len(wc_objects),
+            )
+            for wc_obj in wc_objects:
+                db_obj = db_objects.get(wc_obj["id"])
+                if db_obj is None:
+                    db_obj = self.create_object_from_data(wc_obj)
+                    if db_obj is not None:
+                        created_list.append((db_obj, wc_obj))
+                elif self.update_object_if_changed(db_obj, wc_obj):
+                    updated_count += 1
+                progress.update(task_process, advance=1)
+            progress.stop_task(task_process)
+
+            if created_list:
+                self._post_process_imported_objects(created_list, request=request)
+
+        if self.WC_API_SUPPORTS_MODIFIED_AFTER and wc_objects:
+            new_cursor = max(wc_obj["date_modified_gmt"] for wc_obj in wc_objects)
+            if cursor is None or new_cursor > cursor:
+                set_sync_cursor(self.WC_API_BASEURL, new_cursor)
+
+        if request is not None:
+            self._add_request_messages_from_import_counts(request, len(created_list))
+            if updated_count:
+                self._add_request_messages_from_update_counts(request, updated_count, 0, 0)
+        return len(created_list), updated_count
+
     # Messages
 
     def _add_request_messages_from_update_counts(
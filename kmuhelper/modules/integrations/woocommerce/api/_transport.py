@@ -0,0 +1,138 @@
+"""HTTP transport for the WooCommerce REST API
+
+The API client of the woocommerce package opens a new connection for every request. This
+client has the same interface but sends all requests over a shared keep-alive session and
+retries them with exponential backoff if the server is overloaded (429) or fails (5xx).
+
+File settings:
+- KMUHELPER_WC_TIMEOUT: Seconds to wait for a response (default: 30)
+- KMUHELPER_WC_RETRIES: Number of retries of a failed request (default: 3)
+- KMUHELPER_WC_RETRY_BACKOFF: Backoff factor for the retries in seconds (default: 0.5,
+  i.e. retries after 0.5, 1, 2, ... seconds, or as requested by a Retry-After header)
+- KMUHELPER_WC_CONCURRENCY: Maximum number of concurrent requests, e.g. when downloading
+  the pages of an object list (default: 4)
+"""
+
+import threading
+from json import dumps as jsonencode
+from time import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+from woocommerce import API as WCAPI
+from woocommerce.oauth import OAuth
+
+from kmuhelper import settings
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_session = None
+
+
+def get_concurrency() -> int:
+    return max(settings.get_file_setting("KMUHELPER_WC_CONCURRENCY", 4), 1)
+
+
+def get_session() -> requests.Session:
+    """Get the session shared by all API clients of this process"""
+
+    global _session
+
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=settings.get_file_setting("KMUHELPER_WC_RETRIES", 3),
+                backoff_factor=settings.get_file_setting("KMUHELPER_WC_RETRY_BACKOFF", 0.5),
+                status_forcelist=RETRY_STATUS_CODES,
+                # Only idempotent methods (not POST) are retried
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                # Return the last response instead of raising, as the callers check the status
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_maxsize=get_concurrency(), max_retries=retry)
+
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def close_session():
+    """Close the shared session, e.g. to apply changed settings"""
+
+    global _session
+
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+
+class WCSessionAPI(WCAPI):
+    """WooCommerce API client using the shared session"""
+
+    def _get_url(self, endpoint: str) -> str:
+        api = "wp-json" if self.wp_api else "wc-api"
+        return f"{self.url.rstrip('/')}/{api}/{self.version}/{endpoint}"
+
+    def _request(self, method, endpoint, data, params=None, **kwargs):
+        # Same authentication as in the woocommerce package
+        params = dict(params or {})
+        url = self._get_url(endpoint)
+        auth = None
+        headers = {
+            "user-agent": self.user_agent,
+            "accept": "application/json",
+        }
+
+        if self.is_ssl and not self.query_string_auth:
+            auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+        elif self.is_ssl:
+            params.update(
+                {"consumer_key": self.consumer_key, "consumer_secret": self.consumer_secret}
+            )
+        else:
+            url = OAuth(
+                url=f"{url}?{urlencode(params)}",
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret,
+                version=self.version,
+                method=method,
+                oauth_timestamp=int(time()),
+            ).get_oauth_url()
+            params = {}
+
+        if data is not None:
+            data = jsonencode(data, ensure_ascii=False).encode("utf-8")
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        return get_session().request(
+            method=method,
+            url=url,
+            verify=self.verify_ssl,
+            auth=auth,
+            params=params,
+            data=data,
+            timeout=self.timeout,
+            headers=headers,
+            **kwargs,
+        )
+
+    def get(self, endpoint, **kwargs):
+        return self._request("GET", endpoint, None, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._request("POST", endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._request("PUT", endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._request("DELETE", endpoint, None, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._request("OPTIONS", endpoint, None, **kwargs)
@@ -10,6 +10,8 @@ class WCCustomersAPI(WC_BaseObjectAPI):
     WC_API_BASEURL = "customers"
 
     def update_object_from_data(self, db_obj, wc_obj: dict):
+        original_values = self._get_field_values(db_obj)
+
         db_obj.woocommerce_deleted = False
 
         db_obj.email = wc_obj["email"]
@@ -42,13 +44,14 @@ class WCCustomersAPI(WC_BaseObjectAPI):
         db_obj.addr_shipping_state = wc_obj["shipping"]["state"]
         db_obj.addr_shipping_postcode = wc_obj["shipping"]["postcode"]
         db_obj.addr_shipping_country = wc_obj["shipping"]["country"]
-        db_obj.save()
 
-        self.log("Customer updated:", str(db_obj))
+        if self._save_changes(db_obj, original_values, wc_obj):
+            self.log("Customer updated:", str(db_obj))
 
     def create_object_from_data(self, wc_obj: dict):
         db_obj = models.Customer.objects.create(
             woocommerceid=wc_obj["id"],
+            woocommerce_fingerprint=self.get_fingerprint(wc_obj),
             email=wc_obj["email"],
             first_name=wc_obj["first_name"],
             last_name=wc_obj["last_name"],
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.utils.translation import gettext
 
 import kmuhelper.modules.main.models as models
@@ -16,8 +17,85 @@ class WCOrdersAPI(WC_BaseObjectAPI):
     MODEL = models.Order
     WC_OBJ_DOES_NOT_EXIST_CODE = "woocommerce_rest_shop_order_invalid_id"
     WC_API_BASEURL = "orders"
+    WC_API_SUPPORTS_MODIFIED_AFTER = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Linked objects by WooCommerce ID, loaded by prepare_import
+        self._products = {}
+        self._customers = {}
+
+    def prepare_import(self, wc_objects: list[dict]):
+        """Load or import all products and customers referenced by the orders
+
+        Known objects are loaded with one query each, unknown ones are downloaded in batches
+        and created before any order is created."""
+
+        product_ids = set()
+        customer_ids = set()
+        for wc_obj in wc_objects:
+            if wc_obj["customer_id"]:
+                customer_ids.add(int(wc_obj["customer_id"]))
+            for item in wc_obj["line_items"]:
+                product_id = int(item.get("variation_id") or item["product_id"])
+                if product_id:
+                    product_ids.add(product_id)
+
+        self._products.update(self._load_or_import(products.WCProductsAPI, product_ids))
+        self._customers.update(self._load_or_import(customers.WCCustomersAPI, customer_ids))
+
+    def prepare_update(self, wc_obj: dict, is_create_event: bool = False):
+        # Only the creation of an order needs the products and the customer
+        if not models.Order.objects.filter(woocommerceid=wc_obj["id"]).exists():
+            self.prepare_import([wc_obj])
+
+    def _load_or_import(self, api_class, wc_ids: set[int]) -> dict:
+        model = api_class.MODEL
+
+        db_objects = {
+            db_obj.woocommerceid: db_obj
+            for db_obj in model.objects.filter(woocommerceid__in=wc_ids)
+        }
+        missing_ids = sorted(wc_ids - db_objects.keys())
+        if not missing_ids:
+            return db_objects
+
+        api = api_class(self.wcapi)
+        wc_objects = api.download_objects_by_id(missing_ids)
+        # Variations last, as creating their parent might already create them
+        for wc_obj in sorted(wc_objects.values(), key=lambda o: o.get("type") == "variation"):
+            if wc_obj["id"] in db_objects:
+                continue
+            if wc_obj.get("type") == "variation":
+                existing = model.objects.filter(woocommerceid=wc_obj["id"]).first()
+                if existing is not None:
+                    db_objects[wc_obj["id"]] = existing
+                    continue
+            db_objects[wc_obj["id"]] = api.create_object_from_data(wc_obj)
+        return db_objects
+
+    def _get_product(self, wc_id: int) -> models.Product:
+        product = self._products.get(wc_id)
+        if product is None:
+            product, created = models.Product.objects.get_or_create(woocommerceid=wc_id)
+            if created:
+                products.WCProductsAPI(self.wcapi).update_object_from_api(product)
+            self._products[wc_id] = product
+        return product
+
+    def _get_customer(self, wc_id: int) -> models.Customer:
+        customer = self._customers.get(wc_id)
+        if customer is None:
+            customer, created = models.Customer.objects.get_or_create(woocommerceid=wc_id)
+            if created:
+                customers.WCCustomersAPI(self.wcapi).update_object_from_api(customer)
+            self._customers[wc_id] = customer
+        return customer
 
     def update_object_from_data(self, db_obj, wc_obj: dict):
+        original_values = self._get_field_values(db_obj)
+
         db_obj.woocommerce_deleted = False
 
         if wc_obj["date_paid"]:
@@ -46,8 +124,9 @@ class WCOrdersAPI(WC_BaseObjectAPI):
         db_obj.addr_shipping_state = wc_obj["shipping"]["state"]
         db_obj.addr_shipping_postcode = wc_obj["shipping"]["postcode"]
         db_obj.addr_shipping_country = wc_obj["shipping"]["country"]
-        db_obj.save()
-        self.log("Order updated: ", str(db_obj))
+
+        if self._save_changes(db_obj, original_values, wc_obj):
+            self.log("Order updated: ", str(db_obj))
 
     def create_object_from_data(self, wc_obj: dict, send_stock_warning=False):
         if wc_obj["status"] == "checkout-draft":
@@ -56,6 +135,7 @@ class WCOrdersAPI(WC_BaseObjectAPI):
 
         db_obj = models.Order.objects.create(
             woocommerceid=wc_obj["id"],
+            woocommerce_fingerprint=self.get_fingerprint(wc_obj),
             status=wc_obj["status"],
             is_shipped=(True if wc_obj["status"] == "completed" else False),
             is_removed_from_stock=(True if wc_obj["status"] == "completed" else False),
@@ -86,16 +166,14 @@ class WCOrdersAPI(WC_BaseObjectAPI):
         )
         db_obj.date = wc_obj["date_created_gmt"] + "+00:00"
         if wc_obj["customer_id"]:
-            customer, created = models.Customer.objects.get_or_create(
-                woocommerceid=int(wc_obj["customer_id"])
-            )
-            if created:
-                customers.WCCustomersAPI(self.wcapi).update_object_from_api(customer)
-
+            customer = self._get_customer(int(wc_obj["customer_id"]))
             db_obj.customer = customer
             db_obj.addr_shipping_email = customer.addr_shipping_email
             db_obj.addr_shipping_phone = customer.addr_shipping_phone
 
+        items = []
+        fees = []
+
         for item in wc_obj["line_items"]:
             # Use variation id if available and != 0
             if "variation_id" in item and item["variation_id"]:
@@ -108,55 +186,56 @@ class WCOrdersAPI(WC_BaseObjectAPI):
             # subtotal/quantity is used instead of price to exclude discounts => handled under "coupon_lines"
 
             if product_id != 0:
-                product, created = models.Product.objects.get_or_create(
-                    woocommerceid=int(product_id)
-                )
-                if created:
-                    products.WCProductsAPI(self.wcapi).update_object_from_api(product)
-
-                db_obj.products.through.objects.create(
-                    order=db_obj,
-                    linked_product=product,
-                    quantity=quantity,
-                    product_price=product_price,
+                product = self._get_product(int(product_id))
+                items.append(
+                    models.OrderItem(
+                        linked_product=product,
+                        quantity=quantity,
+                        product_price=product_price,
+                    )
                 )
             else:
                 self.log("Product ID in a line item was 0!")
-                db_obj.products.through.objects.create(
-                    order=db_obj,
-                    linked_product=None,
-                    quantity=quantity,
-                    product_price=product_price,
-                    name=item["name"],
-                    article_number=str(item["sku"]),
+                items.append(
+                    models.OrderItem(
+                        linked_product=None,
+                        quantity=quantity,
+                        product_price=product_price,
+                        name=item["name"],
+                        article_number=str(item["sku"]),
+                    )
                 )
 
         for item in wc_obj["shipping_lines"]:
-            db_obj.fees.through.objects.create(
-                order=db_obj,
-                name=item["method_title"],
-                price=float(item["total"]),
-                vat_rate=(constants.VAT_RATE_DEFAULT if float(item["total_tax"]) > 0 else 0),
+            fees.append(
+                models.OrderFee(
+                    name=item["method_title"],
+                    price=float(item["total"]),
+                    vat_rate=(constants.VAT_RATE_DEFAULT if float(item["total_tax"]) > 0 else 0),
+                )
             )
 
         for item in wc_obj["fee_lines"]:
-            db_obj.fees.through.objects.create(
-                order=db_obj,
-                name=item["name"],
-                price=float(item["total"]),
-                vat_rate=(constants.VAT_RATE_DEFAULT if float(item["total_tax"]) > 0 else 0),
+            fees.append(
+                models.OrderFee(
+                    name=item["name"],
+                    price=float(item["total"]),
+                    vat_rate=(constants.VAT_RATE_DEFAULT if float(item["total_tax"]) > 0 else 0),
+                )
             )
 
         for item in wc_obj["coupon_lines"]:
-            db_obj.fees.through.objects.create(
-                order=db_obj,
-                name=_("Coupon: %(code)s") % {"code": item["code"]},
-                price=-float(item["discount"]),
-                vat_rate=(constants.VAT_RATE_DEFAULT if float(item["discount_tax"]) > 0 else 0),
+            fees.append(
+                models.OrderFee(
+                    name=_("Coupon: %(code)s") % {"code": item["code"]},
+                    price=-float(item["discount"]),
+                    vat_rate=(constants.VAT_RATE_DEFAULT if float(item["discount_tax"]) > 0 else 0),
+                )
             )
 
-        db_obj.save()
-        db_obj.second_save()
+        with transaction.atomic():
+            totals = db_obj.bulk_create_lines(items, fees)
+            db_obj.second_save(totals=totals)
         self.log("Order created:", str(db_obj))
 
         if send_stock_warning:
@@ -1,4 +1,6 @@
+from django.db import transaction
 from django.http import HttpRequest
+from rich.progress import Progress
 
 import kmuhelper.modules.main.models as models
 from kmuhelper.modules.integrations.woocommerce.api._base import WC_BaseObjectAPI
@@ -12,12 +14,21 @@ class WCProductCategoriesAPI(WC_BaseObjectAPI):
     WC_OBJ_DOES_NOT_EXIST_CODE = "woocommerce_rest_term_invalid"
     WC_API_BASEURL = "products/categories"
 
-    def update_object_from_data(self, db_obj, wc_obj: dict):
+    # Fields set by _apply_data()
+    DATA_FIELDS = ["woocommerce_deleted", "name", "description", "image_url"]
+    BULK_BATCH_SIZE = 500
+
+    def _apply_data(self, db_obj, wc_obj: dict):
         db_obj.woocommerce_deleted = False
 
         db_obj.name = preparestring(wc_obj["name"])
         db_obj.description = preparestring(wc_obj["description"])
         db_obj.image_url = (wc_obj["image"]["src"]) if wc_obj["image"] else ""
+
+    def update_object_from_data(self, db_obj, wc_obj: dict):
+        original_values = self._get_field_values(db_obj)
+
+        self._apply_data(db_obj, wc_obj)
         if wc_obj["parent"]:
             obj, created = models.ProductCategory.objects.get_or_create(
                 woocommerceid=wc_obj["parent"]
@@ -25,9 +36,9 @@ class WCProductCategoriesAPI(WC_BaseObjectAPI):
             if created:
                 self.update_object_from_api(obj)
             db_obj.parent_category = obj
-        db_obj.save()
 
-        self.log("Category updated:", str(db_obj))
+        if self._save_changes(db_obj, original_values, wc_obj):
+            self.log("Category updated:", str(db_obj))
 
     def create_object_from_data(self, wc_obj: dict):
         db_obj = models.ProductCategory.objects.create(
@@ -35,17 +46,123 @@ class WCProductCategoriesAPI(WC_BaseObjectAPI):
             description=preparestring(wc_obj["description"]),
             image_url=(wc_obj["image"]["src"]) if wc_obj["image"] else "",
             woocommerceid=wc_obj["id"],
+            woocommerce_fingerprint=self.get_fingerprint(wc_obj),
         )
 
         self.log("Category created:", wc_obj["name"])
         return db_obj
 
-    def _post_process_imported_objects(
-        self, db_obj__wc_obj_list: list[tuple[object, dict]], request: HttpRequest = None
-    ):
-        for db_obj, wc_obj in db_obj__wc_obj_list:
-            if wc_obj["parent"]:
-                db_obj.parent_category = models.ProductCategory.objects.get(
-                    woocommerceid=wc_obj["parent"]
+    # Bulk import
+
+    @staticmethod
+    def _sort_topologically(wc_objects: list[dict]) -> list[dict]:
+        """Sort the categories so that every parent comes before its children"""
+
+        by_id = {wc_obj["id"]: wc_obj for wc_obj in wc_objects}
+        result = []
+        visited = set()
+        for wc_obj in wc_objects:
+            # Collect the ancestors which haven't been added yet (stops at a cycle)
+            path = []
+            node = wc_obj
+            while node is not None and node["id"] not in visited:
+                visited.add(node["id"])
+                path.append(node)
+                node = by_id.get(node["parent"])
+            result += reversed(path)
+        return result
+
+    def save_objects_in_bulk(self, wc_objects: list[dict]) -> (list, list):
+        """Create and update the categories of a downloaded term list with a constant number of
+        queries and without further API requests
+
+        Parents which are neither in the list nor in the database are left empty. Categories
+        whose data has already been applied are skipped.
+
+        Returns: lists of the created and updated categories
+        """
+
+        wc_objects = self._sort_topologically(wc_objects)
+        wc_ids = {wc_obj["id"] for wc_obj in wc_objects}
+        parent_ids = {wc_obj["parent"] for wc_obj in wc_objects if wc_obj["parent"]}
+
+        db_objects = {
+            db_obj.woocommerceid: db_obj
+            for db_obj in self.MODEL.objects.filter(woocommerceid__in=wc_ids | parent_ids)
+        }
+
+        created, updated = [], []
+        for wc_obj in wc_objects:
+            db_obj = db_objects.get(wc_obj["id"])
+            if db_obj is None:
+                db_obj = self.MODEL(woocommerceid=wc_obj["id"])
+                created.append(db_obj)
+            elif self.is_unchanged(db_obj, wc_obj):
+                continue
+            else:
+                updated.append(db_obj)
+            self._apply_data(db_obj, wc_obj)
+            db_obj.woocommerce_fingerprint = self.get_fingerprint(wc_obj)
+
+        with transaction.atomic():
+            self.MODEL.objects.bulk_create(created, batch_size=self.BULK_BATCH_SIZE)
+            if created and created[0].pk is None:
+                # The database backend doesn't return the primary keys of bulk inserts
+                created = list(
+                    self.MODEL.objects.filter(
+                        woocommerceid__in=[db_obj.woocommerceid for db_obj in created]
+                    )
                 )
-                db_obj.save()
+            db_objects.update({db_obj.woocommerceid: db_obj for db_obj in created})
+
+            # The parents are linked afterwards, as new ones only have a primary key now. The
+            # links of unchanged categories are unchanged too, as the parent is part of the data.
+            parent_ids = {wc_obj["id"]: wc_obj["parent"] for wc_obj in wc_objects}
+            linked = []
+            for db_obj in created:
+                if parent_ids[db_obj.woocommerceid]:
+                    db_obj.parent_category = db_objects.get(parent_ids[db_obj.woocommerceid])
+                    linked.append(db_obj)
+            for db_obj in updated:
+                db_obj.parent_category = db_objects.get(parent_ids[db_obj.woocommerceid])
+
+            self.MODEL.objects.bulk_update(
+                updated + linked,
+                self.DATA_FIELDS + ["woocommerce_fingerprint", "parent_category"],
+                batch_size=self.BULK_BATCH_SIZE,
+            )
+
+        self.log(f"{len(created)} categories created, {len(updated)} updated.")
+        return created, updated
+
+    def import_all_objects_from_api(self, request: HttpRequest = None, on_progress=None) -> int:
+        with Progress() as progress:
+            wc_objects = self._download_objects(progress)
+
+        known_ids = set(
+            self.MODEL.objects.exclude(woocommerceid=0).values_list("woocommerceid", flat=True)
+        )
+        wc_objects = [wc_obj for wc_obj in wc_objects if wc_obj["id"] not in known_ids]
+        if on_progress is not None:
+            on_progress(0, len(wc_objects))
+
+        created, _ = self.save_objects_in_bulk(wc_objects)
+        if on_progress is not None:
+            on_progress(len(wc_objects), len(wc_objects))
+
+        if request is not None:
+            self._add_request_messages_from_import_counts(request, len(created))
+        return len(created)
+
+    def sync_objects_from_api(self, request: HttpRequest = None, full=False) -> (int, int):
+        # The term list has no modification dates, so it is always downloaded completely
+        with Progress() as progress:
+            wc_objects = self._download_objects(progress)
+
+        created, updated = self.save_objects_in_bulk(wc_objects)
+
+        if request is not None:
+            self._add_request_messages_from_import_counts(request, len(created))
+            if updated:
+                self._add_request_messages_from_update_counts(request, len(updated), 0, 0)
+        return len(created), len(updated)
@@ -1,7 +1,11 @@
+from django.db import transaction
+from django.db.models import Q
+
 import kmuhelper.modules.main.models as models
 from kmuhelper.modules.integrations.woocommerce.api import product_categories
 from kmuhelper.modules.integrations.woocommerce.api._base import WC_BaseObjectAPI
 from kmuhelper.modules.integrations.woocommerce.api._utils import preparestring
+from kmuhelper.modules.main.utils import StockUtils
 
 
 def parse_product_name(wc_obj):
@@ -36,10 +40,35 @@ class WCProductsAPI(WC_BaseObjectAPI):
     MODEL = models.Product
     WC_OBJ_DOES_NOT_EXIST_CODE = "woocommerce_rest_product_invalid_id"
     WC_API_BASEURL = "products"
+    WC_API_SUPPORTS_MODIFIED_AFTER = True
 
-    def update_object_from_data(
-        self, db_obj: models.Product, wc_obj: dict, is_create_event: bool = False
-    ):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Downloaded variations (and the requested ids) by WooCommerce ID of the parent, loaded
+        # by prepare_update
+        self._variations = {}
+
+    def _can_update_in_batch(self, db_obj) -> bool:
+        # Variations are only listed under their parent product
+        return db_obj.parent_id is None
+
+    # Fields set by _apply_data()
+    DATA_FIELDS = [
+        "woocommerce_deleted",
+        "selling_price",
+        "article_number",
+        "name",
+        "short_description",
+        "description",
+        "image_url",
+        "sale_from",
+        "sale_to",
+        "sale_price",
+    ]
+    BULK_BATCH_SIZE = 500
+
+    def _apply_data(self, db_obj: models.Product, wc_obj: dict):
         db_obj.woocommerce_deleted = False
 
         try:
@@ -69,11 +98,18 @@ class WCProductsAPI(WC_BaseObjectAPI):
         else:
             db_obj.sale_price = None
 
+    def update_object_from_data(
+        self, db_obj: models.Product, wc_obj: dict, is_create_event: bool = False
+    ):
+        original_values = self._get_field_values(db_obj)
+
+        self._apply_data(db_obj, wc_obj)
+
         # Update dependencies
         self._update_dependencies(db_obj, wc_obj, force_update_variations=is_create_event)
 
-        db_obj.save()
-        self.log("Product updated:", str(db_obj))
+        if self._save_changes(db_obj, original_values, wc_obj):
+            self.log("Product updated:", str(db_obj))
 
     def create_object_from_data(self, wc_obj: dict):
         try:
@@ -83,6 +119,7 @@ class WCProductsAPI(WC_BaseObjectAPI):
 
         db_obj = models.Product.objects.create(
             woocommerceid=wc_obj["id"],
+            woocommerce_fingerprint=self.get_fingerprint(wc_obj),
             article_number=wc_obj["sku"],
             name=parse_product_name(wc_obj),
             short_description=preparestring(wc_obj["short_description"]),
@@ -104,9 +141,49 @@ class WCProductsAPI(WC_BaseObjectAPI):
         self._update_dependencies(db_obj, wc_obj)
 
         db_obj.save()
+        StockUtils.record_stock_movements({db_obj.pk: db_obj.stock_current}, "import")
         self.log("Product created:", str(db_obj))
         return db_obj
 
+    def prepare_update(self, wc_obj: dict, is_create_event: bool = False):
+        db_obj = models.Product.objects.filter(woocommerceid=wc_obj["id"]).first()
+        if db_obj is not None and self.is_unchanged(db_obj, wc_obj):
+            return
+
+        if (
+            wc_obj["type"] == "variation"
+            and not models.Product.objects.filter(woocommerceid=wc_obj["parent_id"]).exists()
+        ):
+            self.log("Importing parent...")
+            db_parent = models.Product.objects.create(woocommerceid=wc_obj["parent_id"])
+            self.update_object_from_api(db_parent)
+
+        category_ids = {wc_category["id"] for wc_category in wc_obj["categories"]}
+        known_ids = set(
+            models.ProductCategory.objects.filter(woocommerceid__in=category_ids).values_list(
+                "woocommerceid", flat=True
+            )
+        )
+        for category_id in category_ids - known_ids:
+            self.log("Importing linked category...")
+            db_category = models.ProductCategory.objects.create(woocommerceid=category_id)
+            product_categories.WCProductCategoriesAPI(self.wcapi).update_object_from_api(
+                db_category
+            )
+
+        if wc_obj["type"] == "variable" and "variations" in wc_obj:
+            wc_ids = set(wc_obj["variations"])
+            download_ids = self._get_variation_ids_to_download(
+                wc_ids,
+                self._get_variations(db_obj, wc_ids),
+                force=(db_obj is not None and is_create_event),
+            )
+            if download_ids:
+                self._variations[wc_obj["id"]] = (
+                    download_ids,
+                    self._download_variations(wc_obj, download_ids),
+                )
+
     def _update_dependencies(
         self,
         db_obj: models.Product,
@@ -114,7 +191,8 @@ class WCProductsAPI(WC_BaseObjectAPI):
         force_update_variations: bool = False,
     ):
         # Save before updating dependencies
-        db_obj.save()
+        if db_obj.pk is None:
+            db_obj.save()
 
         # If product is a variation of a parent product
         if wc_obj["type"] == "variation":
@@ -128,34 +206,151 @@ class WCProductsAPI(WC_BaseObjectAPI):
 
         # If product is variable (has variations), also update variations
         if wc_obj["type"] == "variable" and "variations" in wc_obj:
-            # Update variations
-            for variation_id in wc_obj["variations"]:
-                db_variation, created = models.Product.objects.get_or_create(
-                    woocommerceid=variation_id
-                )
-                if created or db_variation.woocommerce_deleted or force_update_variations:
-                    self.log("Updating variation...")
-                    self.update_object_from_api(db_variation)
-            # Delete orphan variations
-            for db_orphan in db_obj.children.exclude(
-                woocommerceid__in=wc_obj["variations"]
-            ).exclude(woocommerce_deleted=True):
-                self.log("Marked orphan variation as deleted:", str(db_orphan))
-                db_orphan.woocommerce_deleted = True
-                db_orphan.save()
-
-        # Categories
-        db_obj.categories.clear()
-        for wc_category in wc_obj["categories"]:
-            db_category, created = models.ProductCategory.objects.get_or_create(
-                woocommerceid=wc_category["id"]
-            )
-            if created:
+            self.sync_variations(db_obj, wc_obj, force=force_update_variations)
+
+        # Categories (only the differences are written)
+        category_ids = [wc_category["id"] for wc_category in wc_obj["categories"]]
+        db_categories = {
+            db_category.woocommerceid: db_category
+            for db_category in models.ProductCategory.objects.filter(woocommerceid__in=category_ids)
+        }
+        for category_id in category_ids:
+            if category_id not in db_categories:
                 self.log("Created linked category! Updating...")
+                db_category = models.ProductCategory.objects.create(woocommerceid=category_id)
                 product_categories.WCProductCategoriesAPI(self.wcapi).update_object_from_api(
                     db_category
                 )
-            db_obj.categories.add(db_category, through_defaults=None)
+                db_categories[category_id] = db_category
+        db_obj.categories.set(db_categories.values(), through_defaults=None)
+
+    # Variations
+
+    @staticmethod
+    def _complete_variation_data(wc_variation: dict, wc_parent: dict) -> dict:
+        """Add the fields which are missing in the variations endpoint (depending on the
+        WooCommerce version) compared to the products endpoint"""
+
+        wc_variation = dict(wc_variation)
+        wc_variation.setdefault("type", "variation")
+        wc_variation.setdefault("parent_id", wc_parent["id"])
+        wc_variation.setdefault("short_description", "")
+        if "images" not in wc_variation:
+            image = wc_variation.get("image")
+            wc_variation["images"] = [image] if image else []
+        if not wc_variation.get("name"):
+            options = ", ".join(a["option"] for a in wc_variation["attributes"])
+            wc_variation["name"] = (
+                f"{wc_parent['name']} - {options}" if options else wc_parent["name"]
+            )
+        return wc_variation
+
+    @staticmethod
+    def _get_variations(db_parent: models.Product | None, wc_ids: set[int]) -> dict:
+        """Known variations of a product by WooCommerce ID (also ones no longer belonging to it)"""
+
+        condition = Q(woocommerceid__in=wc_ids)
+        if db_parent is not None and db_parent.pk is not None:
+            condition |= Q(parent=db_parent)
+        return {db_obj.woocommerceid: db_obj for db_obj in models.Product.objects.filter(condition)}
+
+    @staticmethod
+    def _get_variation_ids_to_download(
+        wc_ids: set[int], db_variations: dict, force: bool = False
+    ) -> set[int]:
+        """New variations and ones marked as deleted (all if force is set)"""
+
+        if force:
+            return wc_ids
+        return {
+            wc_id
+            for wc_id in wc_ids
+            if wc_id not in db_variations or db_variations[wc_id].woocommerce_deleted
+        }
+
+    def _download_variations(self, wc_parent: dict, download_ids: set[int]) -> list[dict]:
+        params = {"orderby": "id", "order": "asc"}
+        if download_ids != set(wc_parent["variations"]):
+            params["include"] = ",".join(map(str, sorted(download_ids)))
+        return [
+            self._complete_variation_data(wc_variation, wc_parent)
+            for wc_variation in self._download_objects(
+                params=params, endpoint=f"{self.WC_API_BASEURL}/{wc_parent['id']}/variations"
+            )
+            if wc_variation["id"] in download_ids
+        ]
+
+    def sync_variations(self, db_parent: models.Product, wc_parent: dict, force: bool = False):
+        """Create, update and mark deleted variations of a variable product in bulk
+
+        Only new variations and ones marked as deleted are downloaded, unless force is set.
+        They are downloaded with the paginated variations endpoint of the parent instead of one
+        request per variation. Categories are not linked to variations.
+        """
+
+        wc_ids = set(wc_parent["variations"])
+        db_variations = self._get_variations(db_parent, wc_ids)
+
+        # Orphans: variations which no longer belong to the product
+        orphan_ids = [
+            db_obj.pk
+            for wc_id, db_obj in db_variations.items()
+            if wc_id not in wc_ids and not db_obj.woocommerce_deleted
+        ]
+        if orphan_ids:
+            models.Product.objects.filter(pk__in=orphan_ids).update(woocommerce_deleted=True)
+            self.log(f"Marked {len(orphan_ids)} orphan variation(s) as deleted.")
+
+        download_ids = self._get_variation_ids_to_download(wc_ids, db_variations, force)
+        if not download_ids:
+            return
+
+        # Already downloaded by prepare_update (e.g. before the transaction of a webhook)
+        prepared_ids, wc_variations = self._variations.pop(wc_parent["id"], (set(), []))
+        if download_ids <= prepared_ids:
+            wc_variations = [v for v in wc_variations if v["id"] in download_ids]
+        else:
+            wc_variations = self._download_variations(wc_parent, download_ids)
+
+        created, updated = [], []
+        for wc_variation in wc_variations:
+            db_obj = db_variations.get(wc_variation["id"])
+            if db_obj is None:
+                db_obj = models.Product(woocommerceid=wc_variation["id"])
+                if wc_variation.get("manage_stock"):
+                    db_obj.stock_current = wc_variation["stock_quantity"] or 0
+                created.append(db_obj)
+            elif self.is_unchanged(db_obj, wc_variation) and db_obj.parent_id == db_parent.pk:
+                continue
+            else:
+                updated.append(db_obj)
+            self._apply_data(db_obj, wc_variation)
+            db_obj.woocommerce_fingerprint = self.get_fingerprint(wc_variation)
+            db_obj.parent = db_parent
+
+        with transaction.atomic():
+            models.Product.objects.bulk_create(created, batch_size=self.BULK_BATCH_SIZE)
+            if created and created[0].pk is None:
+                # The database backend doesn't return the primary keys of bulk inserts
+                created = list(
+                    models.Product.objects.filter(
+                        woocommerceid__in=[db_obj.woocommerceid for db_obj in created]
+                    )
+                )
+            models.Product.objects.bulk_update(
+                updated,
+                self.DATA_FIELDS + ["woocommerce_fingerprint", "parent"],
+                batch_size=self.BULK_BATCH_SIZE,
+            )
+            StockUtils.record_stock_movements(
+                {db_obj.pk: db_obj.stock_current for db_obj in created}, "import"
+            )
+
+        missing = len(download_ids) - len(wc_variations)
+        self.log(
+            f"Variations of {db_parent}: {len(created)} created, {len(updated)} updated"
+            + (f", {missing} not found" if missing else "")
+        )
 
     def delete_object_from_data(self, db_obj, wc_obj: dict):
         """Mark an existing object as deleted
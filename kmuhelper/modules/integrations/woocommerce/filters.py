@@ -16,6 +16,7 @@ class WooCommerceStateFilter(admin.SimpleListFilter):
 
     def __init__(self, request, params, model, model_admin):
         super(WooCommerceStateFilter, self).__init__(request, params, model, model_admin)
+        self.request = request
 
     def lookups(self, request, model_admin):
         return [
@@ -64,4 +65,4 @@ class WooCommerceStateFilter(admin.SimpleListFilter):
             }
 
     def has_output(self):
-        return is_connected() and super().has_output()
+        return is_connected(self.request) and super().has_output()
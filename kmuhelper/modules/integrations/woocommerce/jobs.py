@@ -0,0 +1,159 @@
+"""Background jobs for the import of WooCommerce objects
+
+The import views only create an ImportJob and run it in a thread of the web process after the
+request, so that large imports neither run into proxy timeouts nor block a worker of the web
+server. The progress of a job is stored in the database and polled by its admin page.
+
+A job is claimed with an atomic update before it runs, so that it runs only once even if it is
+started by multiple processes. While running, it regularly stores a sign of life. Unfinished jobs
+without one for KMUHELPER_WC_IMPORT_JOB_TIMEOUT seconds (default: 120) count as interrupted (e.g.
+by a restart of the server) and can be resumed in the admin or by the command
+`kmuhelper-wc-jobs`. As the import skips already imported objects, a resumed job continues where
+it stopped.
+"""
+
+import threading
+import time
+
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rich import print
+
+from kmuhelper.modules.integrations.woocommerce.api import (
+    WCCustomersAPI,
+    WCOrdersAPI,
+    WCProductCategoriesAPI,
+    WCProductsAPI,
+)
+from kmuhelper.modules.integrations.woocommerce.models import ImportJob
+
+APIS = {
+    "products": WCProductsAPI,
+    "customers": WCCustomersAPI,
+    "categories": WCProductCategoriesAPI,
+    "orders": WCOrdersAPI,
+}
+
+# Minimum seconds between two progress updates in the database
+PROGRESS_INTERVAL = 1
+# Seconds between two signs of life of a running job (see ImportJob.get_timeout)
+HEARTBEAT_INTERVAL = 10
+
+
+def log(string, *args):
+    print("[deep_pink4][KMUHelper WooCommerce Jobs][/] -", string, *args)
+
+
+def get_active_job(resource: str) -> ImportJob | None:
+    """Get the unfinished and not interrupted job of a resource, if there is one"""
+
+    for job in ImportJob.objects.filter(resource=resource, status__in=["pending", "running"]):
+        if not job.is_interrupted:
+            return job
+    return None
+
+
+def start_import_job(resource: str, user=None) -> ImportJob:
+    """Create a job and run it in a background thread after the current transaction"""
+
+    job = ImportJob.objects.create(resource=resource, created_by=user)
+    transaction.on_commit(lambda: start_thread(job.pk))
+    return job
+
+
+def start_thread(job_pk: int):
+    threading.Thread(target=_run_import_job_in_thread, args=(job_pk,), daemon=True).start()
+
+
+def _run_import_job_in_thread(job_pk: int):
+    try:
+        run_import_job(job_pk)
+    finally:
+        # Database connections are per thread and would stay open otherwise
+        connections.close_all()
+
+
+def _claim(job_pk: int) -> bool:
+    """Mark a pending, interrupted or failed job as running. Returns False if it runs elsewhere."""
+
+    now = timezone.now()
+    claimable = Q(status__in=["pending", "failed"]) | Q(
+        status="running", heartbeat_at__lt=now - ImportJob.get_timeout()
+    )
+    return bool(
+        ImportJob.objects.filter(claimable, pk=job_pk).update(
+            status="running",
+            runs=F("runs") + 1,
+            started_at=now,
+            heartbeat_at=now,
+            finished_at=None,
+            total=None,
+            done=0,
+            error="",
+        )
+    )
+
+
+def _send_heartbeats(job_pk: int, stop: threading.Event):
+    """Store a sign of life regularly, also while the objects are being downloaded"""
+
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            ImportJob.objects.filter(pk=job_pk, status="running").update(
+                heartbeat_at=timezone.now()
+            )
+    finally:
+        connections.close_all()
+
+
+def run_import_job(job_pk: int, wcapi=None) -> bool:
+    """Run (or resume) a job in the current thread. Returns False if it could not be claimed."""
+
+    if not _claim(job_pk):
+        log(f"Job {job_pk} is already running or finished.")
+        return False
+
+    job = ImportJob.objects.get(pk=job_pk)
+    log(f"Running job {job_pk} ({job.resource})...")
+
+    last_update = 0
+
+    def on_progress(done: int, total: int):
+        nonlocal last_update
+
+        if done == total or time.monotonic() - last_update >= PROGRESS_INTERVAL:
+            last_update = time.monotonic()
+            ImportJob.objects.filter(pk=job_pk).update(
+                done=done, total=total, heartbeat_at=timezone.now()
+            )
+
+    stop_heartbeats = threading.Event()
+    threading.Thread(target=_send_heartbeats, args=(job_pk, stop_heartbeats), daemon=True).start()
+    try:
+        imported = APIS[job.resource](wcapi).import_all_objects_from_api(on_progress=on_progress)
+    except Exception as e:
+        log(f"[red]Job {job_pk} failed:[/]", e)
+        ImportJob.objects.filter(pk=job_pk).update(
+            status="failed", error=f"{type(e).__name__}: {e}", finished_at=timezone.now()
+        )
+    else:
+        log(f"[green]Job {job_pk} finished:[/] {imported} object(s) imported.")
+        ImportJob.objects.filter(pk=job_pk).update(
+            status="done", imported=F("imported") + imported, finished_at=timezone.now()
+        )
+    finally:
+        stop_heartbeats.set()
+    return True
+
+
+def run_waiting_import_jobs(wcapi=None) -> int:
+    """Run all jobs which have not been started or have been interrupted, one after the other
+
+    Returns the number of jobs run."""
+
+    count = 0
+    for job in ImportJob.objects.filter(status__in=["pending", "running"]).order_by("created_at"):
+        if job.is_interrupted and run_import_job(job.pk, wcapi):
+            count += 1
+    return count
@@ -27,6 +27,14 @@ class WooCommerceModelMixin(models.Model):
         blank=True,
         null=False,
     )
+    # Hash of the last applied WooCommerce data, to skip updates without changes
+    woocommerce_fingerprint = models.CharField(
+        verbose_name=_("WooCommerce fingerprint"),
+        max_length=64,
+        default="",
+        blank=True,
+        editable=False,
+    )
 
     def get_woocommerce_url(self):
         return self.WOOCOMMERCE_URL_FORMAT.format(
@@ -0,0 +1,208 @@
+from datetime import timedelta
+
+from django.contrib import admin
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+
+from kmuhelper import constants, settings
+from kmuhelper.overrides import CustomModel
+
+_ = gettext_lazy
+
+
+class WebhookDelivery(CustomModel):
+    """Model representing a received WooCommerce webhook which is processed in the background"""
+
+    PKFILL_WIDTH = 8
+
+    delivery_id = models.CharField(
+        verbose_name=_("Zustellungs-ID"),
+        max_length=64,
+        unique=True,
+    )
+    topic = models.CharField(
+        verbose_name=_("Thema"),
+        max_length=50,
+    )
+    object_id = models.PositiveBigIntegerField(
+        verbose_name=_("WooCommerce ID"),
+    )
+    payload = models.JSONField(
+        verbose_name=_("Daten"),
+    )
+
+    status = models.CharField(
+        verbose_name=_("Status"),
+        max_length=10,
+        choices=constants.WEBHOOK_DELIVERY_STATUSES,
+        default="pending",
+    )
+    attempts = models.PositiveIntegerField(
+        verbose_name=_("Versuche"),
+        default=0,
+    )
+    error = models.TextField(
+        verbose_name=_("Fehler"),
+        blank=True,
+        default="",
+    )
+
+    received_at = models.DateTimeField(
+        verbose_name=_("Empfangen am"),
+        default=timezone.now,
+    )
+    next_attempt_at = models.DateTimeField(
+        verbose_name=_("Nächster Versuch am"),
+        default=timezone.now,
+    )
+    processed_at = models.DateTimeField(
+        verbose_name=_("Verarbeitet am"),
+        blank=True,
+        null=True,
+    )
+    claimed_at = models.DateTimeField(
+        verbose_name=_("Übernommen am"),
+        help_text=_("Zeitpunkt, an dem die Verarbeitung zuletzt begonnen wurde"),
+        blank=True,
+        null=True,
+    )
+
+    @property
+    def resource(self) -> str:
+        return self.topic.split(".")[0]
+
+    @admin.display(description=_("Webhook"))
+    def __str__(self):
+        return f"[{self.pk}] {self.topic} #{self.object_id}"
+
+    class Meta:
+        verbose_name = _("Webhook")
+        verbose_name_plural = _("Webhooks")
+        indexes = [models.Index(fields=["status", "received_at"])]
+
+    objects = models.Manager()
+
+    ADMIN_ICON = "fa-solid fa-inbox"
+
+
+class ImportJob(CustomModel):
+    """Model representing an import of WooCommerce objects running in the background"""
+
+    resource = models.CharField(
+        verbose_name=_("Objekte"),
+        max_length=20,
+        choices=constants.IMPORT_JOB_RESOURCES,
+    )
+    status = models.CharField(
+        verbose_name=_("Status"),
+        max_length=10,
+        choices=constants.IMPORT_JOB_STATUSES,
+        default="pending",
+    )
+    created_by = models.ForeignKey(
+        verbose_name=_("Gestartet von"),
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+
+    total = models.PositiveIntegerField(
+        verbose_name=_("Anzahl Objekte"),
+        help_text=_("Anzahl der zu importierenden Objekte im aktuellen Durchlauf"),
+        blank=True,
+        null=True,
+    )
+    done = models.PositiveIntegerField(
+        verbose_name=_("Verarbeitet"),
+        help_text=_("Anzahl der verarbeiteten Objekte im aktuellen Durchlauf"),
+        default=0,
+    )
+    imported = models.PositiveIntegerField(
+        verbose_name=_("Importiert"),
+        help_text=_("Anzahl der importierten Objekte in allen Durchläufen"),
+        default=0,
+    )
+    runs = models.PositiveIntegerField(
+        verbose_name=_("Durchläufe"),
+        default=0,
+    )
+    error = models.TextField(
+        verbose_name=_("Fehler"),
+        blank=True,
+        default="",
+    )
+
+    created_at = models.DateTimeField(
+        verbose_name=_("Erstellt am"),
+        default=timezone.now,
+    )
+    started_at = models.DateTimeField(
+        verbose_name=_("Gestartet am"),
+        help_text=_("Start des aktuellen Durchlaufs"),
+        blank=True,
+        null=True,
+    )
+    heartbeat_at = models.DateTimeField(
+        verbose_name=_("Letztes Lebenszeichen"),
+        blank=True,
+        null=True,
+    )
+    finished_at = models.DateTimeField(
+        verbose_name=_("Beendet am"),
+        blank=True,
+        null=True,
+    )
+
+    @staticmethod
+    def get_timeout() -> timedelta:
+        """Time without a sign of life after which an unfinished job counts as interrupted"""
+
+        return timedelta(seconds=settings.get_file_setting("KMUHELPER_WC_IMPORT_JOB_TIMEOUT", 120))
+
+    @property
+    def is_interrupted(self) -> bool:
+        """Whether the job is not finished, but its process has stopped (e.g. by a restart)"""
+
+        if self.status not in ("pending", "running"):
+            return False
+        return (self.heartbeat_at or self.created_at) < timezone.now() - self.get_timeout()
+
+    def get_progress(self) -> dict:
+        """Progress of the current run, with the rate in objects per second and the ETA in
+        seconds (None if unknown)"""
+
+        rate = eta = None
+        if self.status == "running" and self.started_at and self.done:
+            elapsed = (timezone.now() - self.started_at).total_seconds()
+            if elapsed > 0:
+                rate = self.done / elapsed
+                if self.total is not None:
+                    eta = max(self.total - self.done, 0) / rate
+
+        return {
+            "id": self.pk,
+            "resource": self.resource,
+            "status": self.status,
+            "status_display": str(self.get_status_display()),
+            "is_interrupted": self.is_interrupted,
+            "done": self.done,
+            "total": self.total,
+            "imported": self.imported,
+            "rate": rate,
+            "eta": eta,
+            "error": self.error,
+        }
+
+    @admin.display(description=_("Import"))
+    def __str__(self):
+        return f"[{self.pkfill()}] {self.get_resource_display()}"
+
+    class Meta:
+        verbose_name = _("Import")
+        verbose_name_plural = _("Importe")
+
+    objects = models.Manager()
+
+    ADMIN_ICON = "fa-solid fa-cloud-arrow-down"
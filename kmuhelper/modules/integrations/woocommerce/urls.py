@@ -13,6 +13,11 @@ urlpatterns = [
     path("import/customers", views.wc_import_customers, name="wc-import-customers"),
     path("import/categories", views.wc_import_categories, name="wc-import-categories"),
     path("import/orders", views.wc_import_orders, name="wc-import-orders"),
+    path(
+        "import/jobs/<int:object_id>/progress",
+        views.wc_import_job_progress,
+        name="wc-import-job-progress",
+    ),
     path(
         "update/product/<int:object_id>",
         views.wc_update_product,
@@ -7,10 +7,24 @@ import requests
 from kmuhelper import settings
 
 
-def is_connected() -> bool:
+def get_url(request=None) -> str | None:
+    """Get the URL of the connected WooCommerce store (None if not connected)
+
+    If a request is given, the URL is only looked up once per request, as e.g. the admin
+    changelist needs it in multiple places (list display, actions, filters, templates)."""
+
+    if request is None:
+        return settings.get_secret_db_setting("wc-url") or None
+
+    if not hasattr(request, "_kmuhelper_wc_url"):
+        request._kmuhelper_wc_url = get_url()
+    return request._kmuhelper_wc_url
+
+
+def is_connected(request=None) -> bool:
     """Check if WooCommerce has been connected"""
 
-    return bool(settings.get_secret_db_setting("wc-url", False))
+    return get_url(request) is not None
 
 
 def base64_hmac_sha256(key: bytes, message: bytes) -> bytes:
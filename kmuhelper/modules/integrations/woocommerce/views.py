@@ -8,6 +8,7 @@ from django.core.mail import mail_admins
 from django.http import JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy, gettext
 from django.views.decorators.csrf import csrf_exempt
@@ -20,6 +21,7 @@ from kmuhelper.decorators import (
     require_any_kmuhelper_perms,
     confirm_action,
 )
+from kmuhelper.modules.api.decorators import require_object as api_require_object
 from kmuhelper.modules.integrations.woocommerce.api import (
     WCGeneralAPI,
     WCCustomersAPI,
@@ -27,7 +29,10 @@ from kmuhelper.modules.integrations.woocommerce.api import (
     WCProductsAPI,
     WCProductCategoriesAPI,
 )
+from kmuhelper.modules.integrations.woocommerce.api._base import SYNC_CURSORS_SETTING
+from kmuhelper.modules.integrations.woocommerce import jobs, webhooks
 from kmuhelper.modules.integrations.woocommerce.forms import WooCommerceSettingsForm
+from kmuhelper.modules.integrations.woocommerce.models import ImportJob, WebhookDelivery
 from kmuhelper.modules.integrations.woocommerce.utils import (
     is_connected,
     base64_hmac_sha256,
@@ -130,6 +135,7 @@ def wc_auth_clear(request):
         settings.set_secret_db_setting("wc-url", "")
         settings.set_secret_db_setting("wc-consumer_key", "")
         settings.set_secret_db_setting("wc-consumer_secret", "")
+        settings.set_secret_db_setting(SYNC_CURSORS_SETTING, {})
 
         messages.success(
             request,
@@ -190,44 +196,57 @@ def wc_webhooks_status(request):
     return redirect(reverse("kmuhelper:wc-settings"))
 
 
-@login_required(login_url=reverse_lazy("kmuhelper:login"))
-@require_all_kmuhelper_perms(["add_product"])
-def wc_import_products(request):
+def _start_import_job(request, resource: str, changelist_url: str):
+    """Start a background import job (or show the already running one)"""
+
     if not is_connected():
         messages.error(request, NOT_CONNECTED_ERRMSG)
+        return redirect(changelist_url)
+
+    job = jobs.get_active_job(resource)
+    if job is not None:
+        messages.info(request, gettext("Dieser Import läuft bereits."))
     else:
-        WCProductsAPI().import_all_objects_from_api(request=request)
-    return redirect(reverse("admin:kmuhelper_product_changelist"))
+        job = jobs.start_import_job(resource, user=request.user)
+        messages.success(
+            request, gettext("Der Import wurde gestartet und läuft im Hintergrund weiter.")
+        )
+    return redirect(reverse("admin:kmuhelper_importjob_change", args=[job.pk]))
+
+
+@login_required(login_url=reverse_lazy("kmuhelper:login"))
+@require_all_kmuhelper_perms(["add_product"])
+def wc_import_products(request):
+    return _start_import_job(request, "products", reverse("admin:kmuhelper_product_changelist"))
 
 
 @login_required(login_url=reverse_lazy("kmuhelper:login"))
 @require_all_kmuhelper_perms(["add_customer"])
 def wc_import_customers(request):
-    if not is_connected():
-        messages.error(request, NOT_CONNECTED_ERRMSG)
-    else:
-        WCCustomersAPI().import_all_objects_from_api(request=request)
-    return redirect(reverse("admin:kmuhelper_customer_changelist"))
+    return _start_import_job(request, "customers", reverse("admin:kmuhelper_customer_changelist"))
 
 
 @login_required(login_url=reverse_lazy("kmuhelper:login"))
 @require_all_kmuhelper_perms(["add_productcategory"])
 def wc_import_categories(request):
-    if not is_connected():
-        messages.error(request, NOT_CONNECTED_ERRMSG)
-    else:
-        WCProductCategoriesAPI().import_all_objects_from_api(request=request)
-    return redirect(reverse("admin:kmuhelper_productcategory_changelist"))
+    return _start_import_job(
+        request, "categories", reverse("admin:kmuhelper_productcategory_changelist")
+    )
 
 
 @login_required(login_url=reverse_lazy("kmuhelper:login"))
 @require_all_kmuhelper_perms(["add_order"])
 def wc_import_orders(request):
-    if not is_connected():
-        messages.error(request, NOT_CONNECTED_ERRMSG)
-    else:
-        WCOrdersAPI().import_all_objects_from_api(request=request)
-    return redirect(reverse("admin:kmuhelper_order_changelist"))
+    return _start_import_job(request, "orders", reverse("admin:kmuhelper_order_changelist"))
+
+
+@login_required(login_url=reverse_lazy("kmuhelper:login"))
+@require_all_kmuhelper_perms(["view_importjob"])
+@api_require_object(ImportJob)
+def wc_import_job_progress(request, obj):
+    """Progress of an import job as JSON (polled by its admin page)"""
+
+    return JsonResponse(obj.get_progress())
 
 
 @login_required(login_url=reverse_lazy("kmuhelper:login"))
@@ -405,11 +424,9 @@ def wc_webhooks(request):
     else:
         log("[orange_red1]Skipped WooCommerce Webhook signature check (no secret available)![/]")
 
-    # Do stuff
-
-    log("WooCommerce Webhook is being processed...")
+    # Queue for processing
 
-    delivery_id = request.headers["x-wc-webhook-delivery-id"]
+    delivery_id = request.headers.get("x-wc-webhook-delivery-id")
     topic = request.headers["x-wc-webhook-topic"]
     wc_obj = json.loads(request.body)
     wc_obj_id = wc_obj.get("id")
@@ -418,6 +435,12 @@ def wc_webhooks(request):
     log("Topic: ", topic)
     log("Object ID: ", wc_obj_id)
 
+    if not delivery_id:
+        log("[orange_red1]WooCommerce Webhook rejected (no delivery ID)![/]")
+        return JsonResponse(
+            {"accepted": False, "reason": "Delivery ID was not provided!"}, status=400
+        )
+
     if not wc_obj_id:
         log("[orange_red1]Object ID was not provided - reporting to admins...[/]")
         mail_admins(
@@ -428,50 +451,30 @@ def wc_webhooks(request):
             {"accepted": False, "reason": "Object ID was not provided!"}, status=400
         )
 
-    match topic:
-        case "product.updated" | "product.created" | "product.restored":
-            if Product.objects.filter(woocommerceid=wc_obj_id).exists():
-                product = Product.objects.get(woocommerceid=wc_obj_id)
-                WCProductsAPI().update_object_from_data(
-                    product, wc_obj, is_create_event=(topic == "product.created")
-                )
-            else:
-                WCProductsAPI().create_object_from_data(wc_obj)
-        case "product.deleted":
-            if Product.objects.filter(woocommerceid=wc_obj_id).exists():
-                product = Product.objects.get(woocommerceid=wc_obj_id)
-                WCProductsAPI().delete_object_from_data(product, wc_obj)
-        case "customer.updated" | "customer.created" | "customer.restored":
-            if Customer.objects.filter(woocommerceid=wc_obj_id).exists():
-                customer = Customer.objects.get(woocommerceid=wc_obj_id)
-                customer.woocommerce_deleted = False
-                WCCustomersAPI().update_object_from_data(customer, wc_obj)
-            else:
-                WCCustomersAPI().create_object_from_data(wc_obj)
-        case "customer.deleted":
-            if Customer.objects.filter(woocommerceid=wc_obj_id).exists():
-                customer = Customer.objects.get(woocommerceid=wc_obj_id)
-                WCCustomersAPI().delete_object_from_data(customer, wc_obj)
-        case "order.updated" | "order.created" | "order.restored":
-            if Order.objects.filter(woocommerceid=wc_obj_id).exists():
-                order = Order.objects.get(woocommerceid=wc_obj_id)
-                order.woocommerce_deleted = False
-                WCOrdersAPI().update_object_from_data(order, wc_obj)
-            else:
-                WCOrdersAPI().create_object_from_data(wc_obj, send_stock_warning=True)
-        case "order.deleted":
-            if Order.objects.filter(woocommerceid=wc_obj_id).exists():
-                order = Order.objects.get(woocommerceid=wc_obj_id)
-                WCOrdersAPI().delete_object_from_data(order, wc_obj)
-        case _:
-            log(f"[orange_red1]Unknown topic: '{topic}' - reporting to admins...")
-            mail_admins(
-                "ERROR: WooCommerce Webhook with unknown topic received!",
-                f"Delivery ID: {delivery_id}\nTopic: {topic}\nObject: {str(wc_obj)}",
-            )
-            return JsonResponse({"accepted": False, "message": "Topic not supported!"}, status=400)
+    if topic not in webhooks.TOPICS:
+        log(f"[orange_red1]Unknown topic: '{topic}' - reporting to admins...")
+        mail_admins(
+            "ERROR: WooCommerce Webhook with unknown topic received!",
+            f"Delivery ID: {delivery_id}\nTopic: {topic}\nObject: {str(wc_obj)}",
+        )
+        return JsonResponse({"accepted": False, "message": "Topic not supported!"}, status=400)
+
+    # Redeliveries of WooCommerce have the same delivery ID and are only stored once
+    now = timezone.now()
+    _, created = WebhookDelivery.objects.get_or_create(
+        delivery_id=delivery_id,
+        defaults={
+            "topic": topic,
+            "object_id": wc_obj_id,
+            "payload": wc_obj,
+            "received_at": now,
+            # Wait for further deliveries of the same change
+            "next_attempt_at": now + webhooks.get_coalesce_window(),
+        },
+    )
 
-    return JsonResponse({"accepted": True, "message": "Successfully processed!"}, status=200)
+    log("WooCommerce Webhook queued for processing." if created else "Delivery already received.")
+    return JsonResponse({"accepted": True, "message": "Queued for processing!"}, status=202)
 
 
 # Settings
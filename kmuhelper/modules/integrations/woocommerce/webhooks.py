@@ -0,0 +1,316 @@
+"""Background processing of received WooCommerce webhooks
+
+The webhook endpoint only stores the received deliveries in an inbox (WebhookDelivery). They are
+processed by the command `kmuhelper-wc-webhooks`, with the deliveries of different objects in
+parallel and the deliveries of the same object one after the other in the order they were
+received. A failed delivery is retried later; the following deliveries of the same object wait
+until it has succeeded or finally failed.
+
+Multiple workers can run at the same time: a worker claims all pending deliveries of an object
+with an atomic update before processing them, and skips objects whose deliveries are being
+processed elsewhere. Claims of a worker which has stopped (e.g. killed during a deployment) are
+returned to the inbox after a timeout. Objects are downloaded from WooCommerce before the
+transaction in which the changes of a delivery are written, so that it doesn't wait for the shop.
+
+WooCommerce often sends several deliveries for the same change (e.g. one per saved field). New
+deliveries are therefore only processed after a short window, and consecutive deliveries with the
+same topic for the same object are coalesced into one, using the newest payload.
+
+File settings:
+- KMUHELPER_WC_WEBHOOK_RETRIES: Number of retries of a failed delivery (default: 5)
+- KMUHELPER_WC_WEBHOOK_RETRY_BACKOFF: Seconds until the first retry, doubled for every further
+  retry (default: 60)
+- KMUHELPER_WC_WEBHOOK_KEEP_DAYS: Days to keep processed deliveries (default: 7)
+- KMUHELPER_WC_WEBHOOK_COALESCE_WINDOW: Seconds to wait for further deliveries of the same object
+  before processing a new delivery (default: 5)
+- KMUHELPER_WC_WEBHOOK_CLAIM_TIMEOUT: Seconds after which deliveries which are still being
+  processed count as abandoned and are processed again (default: 600)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.mail import mail_admins
+from django.db import connections, transaction
+from django.utils import timezone
+from rich import print
+
+from kmuhelper import settings
+from kmuhelper.modules.integrations.woocommerce.api import (
+    WCCustomersAPI,
+    WCOrdersAPI,
+    WCProductsAPI,
+)
+from kmuhelper.modules.integrations.woocommerce.api._base import create_wc_api_object
+from kmuhelper.modules.integrations.woocommerce.api._transport import get_concurrency
+from kmuhelper.modules.integrations.woocommerce.models import WebhookDelivery
+from kmuhelper.modules.main.models import Customer, Order, Product
+
+TOPICS = (
+    "product.created",
+    "product.updated",
+    "product.restored",
+    "product.deleted",
+    "customer.created",
+    "customer.updated",
+    "customer.restored",
+    "customer.deleted",
+    "order.created",
+    "order.updated",
+    "order.restored",
+    "order.deleted",
+)
+
+APIS = {
+    "product": WCProductsAPI,
+    "customer": WCCustomersAPI,
+    "order": WCOrdersAPI,
+}
+
+
+def log(string, *args):
+    print("[deep_pink4][KMUHelper WooCommerce Webhooks][/] -", string, *args)
+
+
+def process_webhook(topic: str, wc_obj: dict, wcapi=None):
+    """Apply the data of a webhook to the database
+
+    Missing linked objects (e.g. the products of a new order) are downloaded and created first,
+    the changes of the object itself are then written in a transaction."""
+
+    if topic not in TOPICS:
+        raise ValueError(f"Topic not supported: {topic}")
+
+    api = APIS[topic.split(".")[0]](wcapi)
+    if not topic.endswith(".deleted"):
+        api.prepare_update(wc_obj, is_create_event=topic.endswith(".created"))
+
+    with transaction.atomic():
+        _apply_webhook(api, topic, wc_obj)
+
+
+def _apply_webhook(api, topic: str, wc_obj: dict):
+    wc_obj_id = wc_obj["id"]
+
+    match topic:
+        case "product.updated" | "product.created" | "product.restored":
+            if Product.objects.filter(woocommerceid=wc_obj_id).exists():
+                product = Product.objects.get(woocommerceid=wc_obj_id)
+                api.update_object_if_changed(
+                    product, wc_obj, is_create_event=(topic == "product.created")
+                )
+            else:
+                api.create_object_from_data(wc_obj)
+        case "product.deleted":
+            if Product.objects.filter(woocommerceid=wc_obj_id).exists():
+                product = Product.objects.get(woocommerceid=wc_obj_id)
+                api.delete_object_from_data(product, wc_obj)
+        case "customer.updated" | "customer.created" | "customer.restored":
+            if Customer.objects.filter(woocommerceid=wc_obj_id).exists():
+                customer = Customer.objects.get(woocommerceid=wc_obj_id)
+                api.update_object_if_changed(customer, wc_obj)
+            else:
+                api.create_object_from_data(wc_obj)
+        case "customer.deleted":
+            if Customer.objects.filter(woocommerceid=wc_obj_id).exists():
+                customer = Customer.objects.get(woocommerceid=wc_obj_id)
+                api.delete_object_from_data(customer, wc_obj)
+        case "order.updated" | "order.created" | "order.restored":
+            if Order.objects.filter(woocommerceid=wc_obj_id).exists():
+                order = Order.objects.get(woocommerceid=wc_obj_id)
+                api.update_object_if_changed(order, wc_obj)
+            else:
+                api.create_object_from_data(wc_obj, send_stock_warning=True)
+        case "order.deleted":
+            if Order.objects.filter(woocommerceid=wc_obj_id).exists():
+                order = Order.objects.get(woocommerceid=wc_obj_id)
+                api.delete_object_from_data(order, wc_obj)
+
+
+def get_coalesce_window() -> timedelta:
+    return timedelta(seconds=settings.get_file_setting("KMUHELPER_WC_WEBHOOK_COALESCE_WINDOW", 5))
+
+
+def get_claim_timeout() -> timedelta:
+    return timedelta(seconds=settings.get_file_setting("KMUHELPER_WC_WEBHOOK_CLAIM_TIMEOUT", 600))
+
+
+def _claim(deliveries: list[WebhookDelivery]) -> bool:
+    """Mark the deliveries of an object as processing. Returns False if one of them is no longer
+    pending (e.g. claimed by another worker), in which case none of them is claimed."""
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = WebhookDelivery.objects.filter(
+            pk__in=[delivery.pk for delivery in deliveries], status="pending"
+        ).update(status="processing", claimed_at=now)
+        if claimed != len(deliveries):
+            # Partial claims would break the order of the deliveries
+            transaction.set_rollback(True)
+            return False
+
+    for delivery in deliveries:
+        delivery.status = "processing"
+        delivery.claimed_at = now
+    return True
+
+
+def _release_stale_claims() -> int:
+    """Return the deliveries of stopped workers to the inbox. Returns their number."""
+
+    return WebhookDelivery.objects.filter(
+        status="processing", claimed_at__lt=timezone.now() - get_claim_timeout()
+    ).update(status="pending")
+
+
+def _coalesce(deliveries: list[WebhookDelivery]) -> (list[WebhookDelivery], list[WebhookDelivery]):
+    """Collapse consecutive deliveries with the same topic into the one with the newest payload
+
+    Returns the deliveries to process and the superseded ones.
+    """
+
+    def modified(delivery):
+        # Not all payloads contain the date (e.g. the ones of deleted objects)
+        return delivery.payload.get("date_modified_gmt") or ""
+
+    result, superseded = [], []
+    for delivery in deliveries:
+        if result and result[-1].topic == delivery.topic:
+            # Redeliveries may arrive out of order
+            if modified(delivery) >= modified(result[-1]):
+                superseded.append(result[-1])
+                result[-1] = delivery
+            else:
+                superseded.append(delivery)
+        else:
+            result.append(delivery)
+    return result, superseded
+
+
+def _fail(delivery: WebhookDelivery, error: Exception) -> bool:
+    """Schedule a retry of the delivery or mark it as failed. Returns whether it is retried."""
+
+    max_retries = settings.get_file_setting("KMUHELPER_WC_WEBHOOK_RETRIES", 5)
+    backoff = settings.get_file_setting("KMUHELPER_WC_WEBHOOK_RETRY_BACKOFF", 60)
+
+    delivery.attempts += 1
+    delivery.error = f"{type(error).__name__}: {error}"
+    retry = delivery.attempts <= max_retries
+    if retry:
+        delivery.status = "pending"
+        delivery.next_attempt_at = timezone.now() + timedelta(
+            seconds=backoff * 2 ** (delivery.attempts - 1)
+        )
+        log(f"Delivery {delivery.delivery_id} failed, retrying later:", delivery.error)
+    else:
+        delivery.status = "failed"
+        log(f"[orange_red1]Delivery {delivery.delivery_id} failed - reporting to admins...[/]")
+        mail_admins(
+            "ERROR: WooCommerce Webhook could not be processed!",
+            f"Delivery ID: {delivery.delivery_id}\nTopic: {delivery.topic}\n"
+            f"Attempts: {delivery.attempts}\nError: {delivery.error}\n"
+            f"Object: {str(delivery.payload)}",
+        )
+    delivery.save(update_fields=["attempts", "error", "status", "next_attempt_at"])
+    return retry
+
+
+def _process_deliveries(deliveries: list[WebhookDelivery], wcapi) -> dict:
+    """Claim, coalesce and process the pending deliveries of one object in order, stopping at one
+    that is retried later"""
+
+    counts = {"done": 0, "retrying": 0, "failed": 0, "coalesced": 0}
+    if not _claim(deliveries):
+        return counts
+
+    deliveries, superseded = _coalesce(deliveries)
+    WebhookDelivery.objects.filter(pk__in=[d.pk for d in superseded]).update(
+        status="coalesced", processed_at=timezone.now()
+    )
+    counts["coalesced"] = len(superseded)
+
+    try:
+        for delivery in deliveries:
+            try:
+                process_webhook(delivery.topic, delivery.payload, wcapi)
+            except Exception as e:
+                if _fail(delivery, e):
+                    counts["retrying"] += 1
+                    break
+                counts["failed"] += 1
+            else:
+                delivery.status = "done"
+                delivery.processed_at = timezone.now()
+                delivery.error = ""
+                delivery.save(update_fields=["status", "processed_at", "error"])
+                counts["done"] += 1
+    finally:
+        # The following deliveries wait for the retry (or the next run after an error)
+        WebhookDelivery.objects.filter(
+            pk__in=[d.pk for d in deliveries], status="processing"
+        ).update(status="pending")
+    return counts
+
+
+def _process_deliveries_in_thread(deliveries: list[WebhookDelivery], wcapi) -> dict:
+    try:
+        return _process_deliveries(deliveries, wcapi)
+    finally:
+        # Database connections are per thread and would stay open otherwise
+        connections.close_all()
+
+
+def process_webhook_inbox(wcapi=None, concurrency: int = None) -> dict:
+    """Process all due deliveries of the inbox
+
+    Can run in multiple workers at the same time. Returns the number of deliveries per outcome
+    (done, retrying, failed, coalesced).
+    """
+
+    now = timezone.now()
+    wcapi = wcapi or create_wc_api_object()
+    concurrency = concurrency or get_concurrency()
+
+    released = _release_stale_claims()
+    if released:
+        log(f"[orange_red1]{released} abandoned deliveries returned to the inbox.[/]")
+
+    # Objects with deliveries which are being processed by another worker
+    busy = {
+        (delivery.resource, delivery.object_id)
+        for delivery in WebhookDelivery.objects.filter(status="processing").only(
+            "topic", "object_id"
+        )
+    }
+
+    deliveries_by_object = {}
+    for delivery in WebhookDelivery.objects.filter(status="pending").order_by("received_at", "pk"):
+        key = (delivery.resource, delivery.object_id)
+        if key not in busy:
+            deliveries_by_object.setdefault(key, []).append(delivery)
+
+    # The deliveries of an object wait for the first one if it is scheduled for a retry or still
+    # in its coalescing window
+    groups = [
+        deliveries
+        for deliveries in deliveries_by_object.values()
+        if deliveries[0].next_attempt_at <= now
+    ]
+
+    if concurrency > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(
+                executor.map(lambda group: _process_deliveries_in_thread(group, wcapi), groups)
+            )
+    else:
+        results = [_process_deliveries(group, wcapi) for group in groups]
+
+    keep_days = settings.get_file_setting("KMUHELPER_WC_WEBHOOK_KEEP_DAYS", 7)
+    WebhookDelivery.objects.filter(
+        status__in=["done", "coalesced"], processed_at__lt=now - timedelta(days=keep_days)
+    ).delete()
+
+    return {
+        key: sum(result[key] for result in results)
+        for key in ("done", "retrying", "failed", "coalesced")
+    }
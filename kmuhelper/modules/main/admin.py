@@ -1,11 +1,16 @@
+import tempfile
+
 from django.contrib import admin, messages
+from django.contrib.admin.models import LogEntry, CHANGE
+from django.db import transaction
 from django.db.models import Count
+from django.http import FileResponse
 from django.urls import path, reverse
 from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy, ngettext
 
-from kmuhelper import constants
+from kmuhelper import constants, settings
 from kmuhelper.modules.integrations.woocommerce.api import (
     WCCustomersAPI,
     WCOrdersAPI,
@@ -27,9 +32,11 @@ from kmuhelper.modules.main.models import (
     Note,
     Product,
     PaymentReceiver,
+    StockMovement,
 )
-from kmuhelper.modules.main.utils import StockUtils
+from kmuhelper.modules.main.utils import OrderDefaults, StockUtils, OrderSumUtils
 from kmuhelper.modules.pdfgeneration.order import views as pdf_order_views
+from kmuhelper.modules.pdfgeneration.order.batch import export_order_pdfs
 from kmuhelper.overrides import (
     CustomModelAdmin,
     CustomTabularInline,
@@ -61,6 +68,7 @@ class ContactPersonAdmin(CustomModelAdmin):
             ContactPerson.objects.filter(is_default=True).exclude(pk=obj.pk).update(
                 is_default=False
             )
+            OrderDefaults.invalidate()
 
 
 class OrderAdminOrderItemInline(CustomTabularInline):
@@ -293,7 +301,7 @@ class OrderAdmin(CustomModelAdmin):
     date_hierarchy = "date"
 
     def get_list_display(self, request):
-        if is_connected():
+        if is_connected(request):
             ls = self.list_display.copy()
             ls.insert(1, "display_woocommerce_state")
             return ls
@@ -461,6 +469,61 @@ class OrderAdmin(CustomModelAdmin):
                 % errorcount,
             )
 
+    @admin.action(description=_("Summen neu berechnen"), permissions=["change"])
+    def recalculate_sums(self, request, queryset):
+        drifts = []
+        for result in OrderSumUtils.iter_recalculate(queryset):
+            drifts += result.drifts
+
+        if drifts:
+            messages.warning(
+                request,
+                ngettext(
+                    "Die Summe von %(count)d Bestellung war falsch und wurde korrigiert: %(ids)s",
+                    "Die Summen von %(count)d Bestellungen waren falsch und wurden korrigiert: %(ids)s",
+                    len(drifts),
+                )
+                % {"count": len(drifts), "ids": ", ".join(str(d.order_id) for d in drifts)},
+            )
+        else:
+            messages.success(request, _("Alle Summen waren bereits korrekt."))
+
+    def _export_pdfs(self, request, queryset, preset):
+        order_ids = list(queryset.values_list("pk", flat=True))
+
+        # Rendered during the request, larger exports have to use the management command
+        limit = settings.get_file_setting("KMUHELPER_PDF_BATCH_ADMIN_LIMIT", 200)
+        if len(order_ids) > limit:
+            messages.error(
+                request,
+                _(
+                    "Es können höchstens %(limit)d Bestellungen auf einmal exportiert werden. "
+                    "Verwenden Sie für grössere Exporte den Befehl 'kmuhelper-export-order-pdfs'."
+                )
+                % {"limit": limit},
+            )
+            return None
+
+        file = tempfile.TemporaryFile()
+        export_order_pdfs(order_ids, file, preset=preset)
+        file.seek(0)
+
+        LogEntry.objects.log_actions(
+            user_id=request.user.id,
+            queryset=queryset,
+            action_flag=CHANGE,
+            change_message=f'PDF aus Vorlage "{preset}" in Sammelexport erstellt.',
+        )
+        return FileResponse(file, as_attachment=True, filename=f"{preset}.pdf")
+
+    @admin.action(description=_("Rechnungen als PDF exportieren"), permissions=["view"])
+    def export_invoices(self, request, queryset):
+        return self._export_pdfs(request, queryset, "invoice")
+
+    @admin.action(description=_("Lieferscheine als PDF exportieren"), permissions=["view"])
+    def export_delivery_notes(self, request, queryset):
+        return self._export_pdfs(request, queryset, "delivery-note")
+
     @admin.action(
         description=_("Bestellungen von WooCommerce aktualisieren"),
         permissions=["change"],
@@ -468,7 +531,7 @@ class OrderAdmin(CustomModelAdmin):
     def wc_update(self, request, queryset):
         WCOrdersAPI().bulk_update_objects_from_api(queryset.all(), request)
 
-    actions = [mark_as_paid, wc_update]
+    actions = [mark_as_paid, recalculate_sums, export_invoices, export_delivery_notes, wc_update]
 
     # Save
 
@@ -485,6 +548,17 @@ class OrderAdmin(CustomModelAdmin):
 
         form.instance.second_save()
 
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            reserved = StockUtils.get_quantities_by_product(
+                Order.products.through.objects.filter(
+                    order__in=queryset, order__is_removed_from_stock=False
+                ),
+                "linked_product_id",
+            )
+            StockUtils.update_stock_counters(reserved=StockUtils.get_differences(reserved, {}))
+            super().delete_queryset(request, queryset)
+
     # Views
 
     def get_urls(self):
@@ -619,7 +693,7 @@ class CustomerAdmin(CustomModelAdmin):
     save_on_top = True
 
     def get_list_display(self, request):
-        if is_connected():
+        if is_connected(request):
             ls = self.list_display.copy()
             ls.insert(1, "display_woocommerce_state")
             return ls
@@ -864,6 +938,19 @@ class SupplyAdmin(CustomModelAdmin):
 
     actions = ["add_to_stock"]
 
+    # Delete
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            incoming = StockUtils.get_quantities_by_product(
+                Supply.products.through.objects.filter(
+                    supply__in=queryset, supply__is_added_to_stock=False
+                ),
+                "product_id",
+            )
+            StockUtils.update_stock_counters(incoming=StockUtils.get_differences(incoming, {}))
+            super().delete_queryset(request, queryset)
+
     # Views
 
     def get_urls(self):
@@ -1048,7 +1135,7 @@ class ProductAdminChildrenInline(CustomTabularInline):
     readonly_fields = ["pkfill", "display_woocommerce_state"]
 
     def get_fields(self, request, obj=None):
-        if is_connected():
+        if is_connected(request):
             ls = self.fields.copy()
             ls.insert(1, "display_woocommerce_state")
             return ls
@@ -1093,7 +1180,13 @@ class ProductAdmin(CustomModelAdmin):
         "linked_note__description",
     ]
 
-    readonly_fields = ["pkfill", "linked_note_html", "display_woocommerce_id"]
+    readonly_fields = [
+        "pkfill",
+        "linked_note_html",
+        "display_woocommerce_id",
+        "stock_reserved",
+        "stock_incoming",
+    ]
 
     autocomplete_fields = ("supplier",)
 
@@ -1104,7 +1197,7 @@ class ProductAdmin(CustomModelAdmin):
     list_select_related = ["linked_note"]
 
     def get_list_display(self, request):
-        if is_connected():
+        if is_connected(request):
             ls = self.list_display.copy()
             ls.insert(1, "display_woocommerce_state")
             return ls
@@ -1139,6 +1232,8 @@ class ProductAdmin(CustomModelAdmin):
                         "vat_rate",
                         "stock_current",
                         "stock_target",
+                        "stock_reserved",
+                        "stock_incoming",
                     ]
                 },
             ),
@@ -1184,9 +1279,7 @@ class ProductAdmin(CustomModelAdmin):
 
     @admin.action(description=_("Lagerbestand zurücksetzen"), permissions=["change"])
     def reset_stock(self, request, queryset):
-        for product in queryset.all():
-            product.stock_current = 0
-            product.save()
+        StockUtils.set_stock({pk: 0 for pk in queryset.values_list("pk", flat=True)}, "reset")
         count = queryset.count()
         messages.success(
             request,
@@ -1250,7 +1343,21 @@ class ProductAdmin(CustomModelAdmin):
     # Save
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            old_stock = 0
+            if change:
+                old_stock, obj.stock_reserved, obj.stock_incoming = (
+                    Product.objects.select_for_update()
+                    .values_list("stock_current", *Product.STOCK_COUNTER_FIELDS)
+                    .get(pk=obj.pk)
+                )
+                if "stock_current" not in form.changed_data:
+                    # Don't overwrite stock changes made since the form was loaded
+                    obj.stock_current = old_stock
+
+            super().save_model(request, obj, form, change)
+
+            StockUtils.record_stock_movements({obj.pk: obj.stock_current - old_stock}, "manual")
 
         # stock warnings
         if obj:
@@ -1304,6 +1411,35 @@ class ProductCategoryAdminProductInline(CustomStackedInline):
         return super().has_add_permission(request, obj)
 
 
+@admin.register(StockMovement)
+class StockMovementAdmin(CustomModelAdmin):
+    list_display = [
+        "pkfill",
+        "date",
+        "product",
+        "difference",
+        "reason",
+        "linked_order",
+        "linked_supply",
+    ]
+    list_filter = ["reason", "date"]
+    search_fields = ["product__article_number", "product__name"]
+
+    ordering = ("-date", "-pk")
+
+    date_hierarchy = "date"
+
+    list_select_related = ["product", "linked_order", "linked_supply"]
+
+    autocomplete_fields = ["product"]
+
+    # Permissions
+
+    NO_CHANGE = True
+    NO_ADD = True
+    NO_DELETE = True
+
+
 @admin.register(ProductCategory)
 class ProductCategoryAdmin(CustomModelAdmin):
     list_display = [
@@ -1328,7 +1464,7 @@ class ProductCategoryAdmin(CustomModelAdmin):
     autocomplete_fields = ("parent_category",)
 
     def get_list_display(self, request):
-        if is_connected():
+        if is_connected(request):
             ls = self.list_display.copy()
             ls.insert(1, "display_woocommerce_state")
             return ls
@@ -1428,6 +1564,7 @@ class PaymentReceiverAdmin(CustomModelAdmin):
             PaymentReceiver.objects.filter(is_default=True).exclude(pk=obj.pk).update(
                 is_default=False
             )
+            OrderDefaults.invalidate()
 
 
 modeladmins = [
@@ -1440,5 +1577,6 @@ modeladmins = [
     (Supply, SupplyAdmin),
     (Note, NoteAdmin),
     (Product, ProductAdmin),
+    (StockMovement, StockMovementAdmin),
     (PaymentReceiver, PaymentReceiverAdmin),
 ]
@@ -5,7 +5,7 @@ from random import randint
 import requests
 from django.contrib import admin
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.forms import ValidationError
 from django.urls import reverse
 from django.utils import timezone
@@ -23,7 +23,9 @@ from kmuhelper import settings, constants
 from kmuhelper.modules.emails.models import EMail, Attachment
 from kmuhelper.modules.integrations.woocommerce.mixins import WooCommerceModelMixin
 from kmuhelper.modules.main.mixins import AddressModelMixin
+from kmuhelper.modules.main.utils import OrderDefaults, OrderTotals, StockUtils
 from kmuhelper.modules.pdfgeneration import PDFOrder
+from kmuhelper.modules.pdfgeneration.logo import LogoCache
 from kmuhelper.overrides import CustomModel
 from kmuhelper.translations import langselect, I18N_HELP_TEXT, Language
 from kmuhelper.utils import runden, formatprice, modulo10rekursiv, faq
@@ -43,33 +45,12 @@ def default_delivery_title():
     return gettext("Lieferung vom %(date)s") % {"date": datestr}
 
 
-# noinspection DuplicatedCode
 def default_payment_recipient():
-    if (
-        PaymentReceiver.objects.exists()
-        and PaymentReceiver.objects.filter(is_default=True).exists()
-    ):
-        return PaymentReceiver.objects.filter(is_default=True).first().pk
-    # Fallback if there isn't a default payment receiver: Use the most recently used one
-    if Order.objects.exists():
-        newest_order = Order.objects.order_by("-date").first()
-        return newest_order.payment_receiver_id
-    if PaymentReceiver.objects.exists():
-        return PaymentReceiver.objects.first().pk
-    return None
-
-
-# noinspection DuplicatedCode
+    return OrderDefaults.get("payment_receiver")
+
+
 def default_contact_person():
-    if ContactPerson.objects.exists() and ContactPerson.objects.filter(is_default=True).exists():
-        return ContactPerson.objects.filter(is_default=True).first().pk
-    # Fallback if there isn't a default contact person: Use the most recently used one
-    if Order.objects.exists():
-        newest_order = Order.objects.order_by("-date").first()
-        return newest_order.contact_person_id
-    if ContactPerson.objects.exists():
-        return ContactPerson.objects.first().pk
-    return None
+    return OrderDefaults.get("contact_person")
 
 
 def default_order_key():
@@ -118,6 +99,15 @@ class ContactPerson(CustomModel):
     def __str__(self):
         return f"[{self.pk}] {self.name}"
 
+    def save(self, **kwargs):
+        super().save(**kwargs)
+        OrderDefaults.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        OrderDefaults.invalidate()
+        return result
+
     class Meta:
         verbose_name = _("Ansprechpartner")
         verbose_name_plural = _("Ansprechpartner")
@@ -199,13 +189,18 @@ class OrderFee(CustomModel):
             return f"[{self.pk}] {self.clean_name()} (#{self.linked_fee.pk})"
         return f"[{self.pk}] {self.clean_name()}"
 
-    def save(self, **kwargs):
-        if self.pk is None and self.linked_fee is not None:
-            # Copy data from linked fee
+    def copy_linked_fee_data(self):
+        """Copy data from the linked fee (when the fee is created)"""
+
+        if self.linked_fee is not None:
             self.name = self.linked_fee.name
             self.vat_rate = self.linked_fee.vat_rate
             # Don't override price if already here (required for WooCommerce import)
             self.price = self.price or self.linked_fee.price
+
+    def save(self, **kwargs):
+        if self.pk is None:
+            self.copy_linked_fee_data()
         super().save(**kwargs)
 
     class Meta:
@@ -315,9 +310,10 @@ class OrderItem(CustomModel):
             )
         return f"[{self.pk}] {self.quantity}x {self.clean_name()} (Art. {self.article_number})"
 
-    def save(self, **kwargs):
-        if self.pk is None and self.linked_product is not None:
-            # Copy data from linked product
+    def copy_linked_product_data(self):
+        """Copy data from the linked product (when the item is created)"""
+
+        if self.linked_product is not None:
             self.article_number = self.linked_product.article_number
             self.quantity_description = self.linked_product.quantity_description
             self.name = self.linked_product.name
@@ -326,7 +322,37 @@ class OrderItem(CustomModel):
             self.product_price = runden(
                 self.product_price or self.linked_product.get_current_price()
             )
-        super().save(**kwargs)
+
+    def save(self, **kwargs):
+        if self.pk is None:
+            self.copy_linked_product_data()
+
+        old_reserved = {}
+        if self.pk is not None and not self._state.adding:
+            old = OrderItem.objects.select_related("order").filter(pk=self.pk).first()
+            old_reserved = old.get_reserved_stock() if old else {}
+
+        with transaction.atomic():
+            super().save(**kwargs)
+            StockUtils.update_stock_counters(
+                reserved=StockUtils.get_differences(old_reserved, self.get_reserved_stock())
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockUtils.update_stock_counters(
+                reserved=StockUtils.get_differences(self.get_reserved_stock(), {})
+            )
+            return super().delete(*args, **kwargs)
+
+    def get_reserved_stock(self) -> dict[int, int]:
+        """Get the stock reserved by this item until the order is shipped
+
+        Format: { product_id: quantity }"""
+
+        if self.linked_product_id is None or self.order.is_removed_from_stock:
+            return {}
+        return {self.linked_product_id: self.quantity}
 
     class Meta:
         verbose_name = _("Bestellungsposten")
@@ -550,25 +576,88 @@ class Order(CustomModel, AddressModelMixin, WooCommerceModelMixin):
         for field in constants.ADDR_SHIPPING_FIELDS + constants.ADDR_BILLING_FIELDS:
             setattr(self, field, getattr(self.customer, field))
 
-    def second_save(self, **kwargs):
-        "This HAS to be called after all related models have been saved."
+    def second_save(self, totals: OrderTotals = None, **kwargs):
+        """This HAS to be called after all related models have been saved.
 
-        self.cached_sum = self.calc_total()
-        if self.is_shipped and (not self.is_removed_from_stock):
-            for i in self.products.through.objects.filter(order=self):
-                if i.linked_product is not None:
-                    i.linked_product.stock_current -= i.quantity
-                    i.linked_product.save()
-            self.is_removed_from_stock = True
+        The totals can be passed if they are already known (e.g. from bulk_create_lines)."""
 
-        super().save(**kwargs)
+        self.cached_sum = (totals or self.get_totals()).total
+
+        with transaction.atomic():
+            if self.is_shipped and (not self.is_removed_from_stock):
+                # Only the first of multiple concurrent calls can claim the stock removal
+                claimed = Order.objects.filter(pk=self.pk, is_removed_from_stock=False).update(
+                    is_removed_from_stock=True
+                )
+                if claimed:
+                    quantities = self.get_product_quantities()
+                    StockUtils.apply_stock_changes(
+                        {pk: -quantity for pk, quantity in quantities.items()},
+                        reason="order",
+                        linked_order=self,
+                    )
+                    StockUtils.update_stock_counters(
+                        reserved={pk: -quantity for pk, quantity in quantities.items()}
+                    )
+                self.is_removed_from_stock = True
+
+            super().save(**kwargs)
 
     def save(self, **kwargs):
+        is_new = self._state.adding
         if not self.pk and not self.woocommerceid and self.customer:
             self.import_customer_data()
 
         super().save(**kwargs)
 
+        if is_new:
+            OrderDefaults.invalidate(fallbacks_only=True)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self.is_removed_from_stock:
+                StockUtils.update_stock_counters(
+                    reserved=StockUtils.get_differences(self.get_product_quantities(), {})
+                )
+            result = super().delete(*args, **kwargs)
+        OrderDefaults.invalidate(fallbacks_only=True)
+        return result
+
+    def bulk_create_lines(self, items: list, fees: list) -> OrderTotals:
+        """Insert new items and fees of this order with one query each
+
+        Does the same as saving them one by one (copying the data of linked products and fees
+        and reserving the stock). Returns the totals of the given lines, which are the totals of
+        the order if it had no other lines before (e.g. when importing it)."""
+
+        for item in items:
+            item.order = self
+            item.copy_linked_product_data()
+        for fee in fees:
+            fee.order = self
+            fee.copy_linked_fee_data()
+
+        reserved = {}
+        for item in items:
+            for product_id, quantity in item.get_reserved_stock().items():
+                reserved[product_id] = reserved.get(product_id, 0) + quantity
+
+        with transaction.atomic():
+            OrderItem.objects.bulk_create(items)
+            OrderFee.objects.bulk_create(fees)
+            StockUtils.update_stock_counters(reserved=reserved)
+
+        return OrderTotals.from_lines(items, fees)
+
+    def get_product_quantities(self) -> dict[int, int]:
+        """Get the total quantity per linked product
+
+        Format: { product_id: quantity }"""
+
+        return StockUtils.get_quantities_by_product(
+            self.products.through.objects.filter(order=self), "linked_product_id"
+        )
+
     @admin.display(description=_("Trackinglink"), ordering="tracking_number")
     def tracking_link(self):
         return (
@@ -594,7 +683,7 @@ class Order(CustomModel, AddressModelMixin, WooCommerceModelMixin):
         c = b[0:2] + " " + b[2:7] + " " + b[7:12] + " " + b[12:17] + " " + b[17:22] + " " + b[22:27]
         return c
 
-    def get_qr_billing_information(self):
+    def get_qr_billing_information(self, totals: OrderTotals = None):
         """Returns the billing information for the QR-Invoice
 
         Definition 1:
@@ -611,7 +700,9 @@ class Order(CustomModel, AddressModelMixin, WooCommerceModelMixin):
             uid = self.payment_receiver.swiss_uid.split("-")[1].replace(".", "")
             output += f"/30/{uid}"
 
-        vat_dict = self.get_vat_dict()
+        if totals is None:
+            totals = self.get_totals()
+        vat_dict = totals.vat_dict
         var_str = ";".join(f"{rate}:{vat_dict[rate]}" for rate in vat_dict)
         output += f"/31/{date}/32/{var_str}"
 
@@ -640,46 +731,33 @@ class Order(CustomModel, AddressModelMixin, WooCommerceModelMixin):
         data.sort(key=lambda x: x["date"])
         return data
 
+    def get_totals(self) -> OrderTotals:
+        """Load all items and fees of this order once and calculate all totals from them"""
+
+        return OrderTotals.from_lines(
+            self.products.through.objects.filter(order=self),
+            self.fees.through.objects.filter(order=self),
+        )
+
     def get_vat_dict(self):
         """Get the VAT as a dictionary
 
         Format: { rate: total, rate2: total2 }"""
-        vat_dict = {}
-        for p in self.products.through.objects.filter(order=self):
-            if str(p.vat_rate) in vat_dict:
-                vat_dict[str(p.vat_rate)] += p.calc_subtotal()
-            else:
-                vat_dict[str(p.vat_rate)] = p.calc_subtotal()
-        for k in self.fees.through.objects.filter(order=self):
-            if str(k.vat_rate) in vat_dict:
-                vat_dict[str(k.vat_rate)] += k.calc_subtotal()
-            else:
-                vat_dict[str(k.vat_rate)] = k.calc_subtotal()
-        for s in vat_dict:
-            vat_dict[s] = runden(vat_dict[s])
-        return vat_dict
+        return self.get_totals().vat_dict
 
     def calc_total_without_vat(self):
-        total = 0
-        for i in self.products.through.objects.filter(order=self):
-            total += i.calc_subtotal()
-        for i in self.fees.through.objects.filter(order=self):
-            total += i.calc_subtotal()
-        return runden(total)
+        return self.get_totals().total_without_vat
 
     def calc_total_vat(self):
-        total_vat = 0
-        vat_dict = self.get_vat_dict()
-        for vat_rate in vat_dict:
-            total_vat += runden(float(vat_dict[vat_rate] * (float(vat_rate) / 100)))
-        return runden(total_vat)
+        return self.get_totals().total_vat
 
     def calc_total(self):
-        return runden(self.calc_total_without_vat() + self.calc_total_vat())
+        return self.get_totals().total
 
     @admin.display(description=_("Rechnungstotal"))
     def display_total_breakdown(self):
-        return f"{formatprice(self.calc_total_without_vat())} CHF + {formatprice(self.calc_total_vat())} CHF MwSt = {formatprice(self.calc_total())} CHF"
+        totals = self.get_totals()
+        return f"{formatprice(totals.total_without_vat)} CHF + {formatprice(totals.total_vat)} CHF MwSt = {formatprice(totals.total)} CHF"
 
     @admin.display(description=_("Total"), ordering="cached_sum")
     def display_cached_sum(self):
@@ -913,7 +991,9 @@ class Order(CustomModel, AddressModelMixin, WooCommerceModelMixin):
         )
         for lp in self.products.through.objects.filter(order=self):
             if lp.linked_product is not None:
-                new.products.add(lp.linked_product, through_defaults={"quantity": lp.quantity})
+                new.products.through.objects.create(
+                    supply=new, product=lp.linked_product, quantity=lp.quantity
+                )
         new.save()
         return new
 
@@ -1253,6 +1333,34 @@ class SupplyItem(CustomModel):
         default=1,
     )
 
+    def save(self, **kwargs):
+        old_incoming = {}
+        if self.pk is not None and not self._state.adding:
+            old = SupplyItem.objects.select_related("supply").filter(pk=self.pk).first()
+            old_incoming = old.get_incoming_stock() if old else {}
+
+        with transaction.atomic():
+            super().save(**kwargs)
+            StockUtils.update_stock_counters(
+                incoming=StockUtils.get_differences(old_incoming, self.get_incoming_stock())
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockUtils.update_stock_counters(
+                incoming=StockUtils.get_differences(self.get_incoming_stock(), {})
+            )
+            return super().delete(*args, **kwargs)
+
+    def get_incoming_stock(self) -> dict[int, int]:
+        """Get the stock incoming with this item until the supply is added to the stock
+
+        Format: { product_id: quantity }"""
+
+        if self.supply.is_added_to_stock:
+            return {}
+        return {self.product_id: self.quantity}
+
     @admin.display(description=_("Lieferungsposten"))
     def __str__(self):
         return f"[{self.pk}] {self.quantity}x {self.product}"
@@ -1303,15 +1411,42 @@ class Supply(CustomModel):
             "quantity__sum"
         ]
 
+    def get_product_quantities(self) -> dict[int, int]:
+        """Get the total quantity per product
+
+        Format: { product_id: quantity }"""
+
+        return StockUtils.get_quantities_by_product(
+            self.products.through.objects.filter(supply=self), "product_id"
+        )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self.is_added_to_stock:
+                StockUtils.update_stock_counters(
+                    incoming=StockUtils.get_differences(self.get_product_quantities(), {})
+                )
+            return super().delete(*args, **kwargs)
+
     def add_to_stock(self):
-        if not self.is_added_to_stock:
-            for i in self.products.through.objects.filter(supply=self):
-                i.product.stock_current += i.quantity
-                i.product.save()
+        if self.is_added_to_stock:
+            return False
+
+        with transaction.atomic():
+            # Only the first of multiple concurrent calls can claim adding the stock
+            claimed = Supply.objects.filter(pk=self.pk, is_added_to_stock=False).update(
+                is_added_to_stock=True
+            )
             self.is_added_to_stock = True
-            self.save()
-            return True
-        return False
+            if not claimed:
+                return False
+
+            quantities = self.get_product_quantities()
+            StockUtils.apply_stock_changes(quantities, reason="supply", linked_supply=self)
+            StockUtils.update_stock_counters(
+                incoming={pk: -quantity for pk, quantity in quantities.items()}
+            )
+        return True
 
     @admin.display(description=_("Lieferung"))
     def __str__(self):
@@ -1481,6 +1616,18 @@ class Product(CustomModel, WooCommerceModelMixin):
         verbose_name=_("Soll-Lagerbestand"),
         default=1,
     )
+    stock_reserved = models.IntegerField(
+        verbose_name=_("Reservierter Lagerbestand"),
+        default=0,
+        editable=False,
+        help_text=_("Menge in noch nicht versendeten Bestellungen"),
+    )
+    stock_incoming = models.IntegerField(
+        verbose_name=_("Eingehender Lagerbestand"),
+        default=0,
+        editable=False,
+        help_text=_("Menge in noch nicht eingelagerten Lieferungen"),
+    )
 
     note = models.TextField(
         verbose_name=_("Bemerkung"),
@@ -1606,6 +1753,22 @@ class Product(CustomModel, WooCommerceModelMixin):
     def __str__(self):
         return f"[{self.pk}] {self.article_number} - {self.clean_name()}"
 
+    # Only changed with F() expressions (see StockUtils.update_stock_counters), so that the
+    # values loaded with an instance never overwrite concurrent changes
+    STOCK_COUNTER_FIELDS = ("stock_reserved", "stock_incoming")
+
+    def save(self, save_stock_counters=False, **kwargs):
+        if not (self._state.adding or save_stock_counters or kwargs.get("force_insert")):
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields if not field.primary_key
+                ]
+            kwargs["update_fields"] = [
+                name for name in update_fields if name not in self.STOCK_COUNTER_FIELDS
+            ]
+        super().save(**kwargs)
+
     class Meta(WooCommerceModelMixin.Meta):
         verbose_name = _("Produkt")
         verbose_name_plural = _("Produkte")
@@ -1615,6 +1778,85 @@ class Product(CustomModel, WooCommerceModelMixin):
     ADMIN_ICON = "fa-solid fa-cubes"
 
 
+class StockMovement(CustomModel):
+    """Model representing a single change of the stock of a product (append-only)"""
+
+    product = models.ForeignKey(
+        to="Product",
+        verbose_name=_("Produkt"),
+        on_delete=models.CASCADE,
+        related_name="stock_movements",
+    )
+    date = models.DateTimeField(
+        verbose_name=_("Datum"),
+        default=timezone.now,
+    )
+    difference = models.IntegerField(
+        verbose_name=_("Veränderung"),
+    )
+    reason = models.CharField(
+        verbose_name=_("Grund"),
+        max_length=10,
+        choices=constants.STOCK_MOVEMENT_REASONS,
+    )
+    linked_order = models.ForeignKey(
+        to="Order",
+        verbose_name=_("Bestellung"),
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    linked_supply = models.ForeignKey(
+        to="Supply",
+        verbose_name=_("Lieferung"),
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+
+    @admin.display(description=_("Lagerbewegung"))
+    def __str__(self):
+        return f"[{self.pk}] {self.difference:+d}x {self.product}"
+
+    class Meta:
+        verbose_name = _("Lagerbewegung")
+        verbose_name_plural = _("Lagerbewegungen")
+        indexes = [models.Index(fields=["product", "date"])]
+
+    objects = models.Manager()
+
+    ADMIN_ICON = "fa-solid fa-arrow-right-arrow-left"
+
+
+class StockSnapshot(CustomModel):
+    """Model representing the stock of a product at a specific point in time"""
+
+    product = models.ForeignKey(
+        to="Product",
+        verbose_name=_("Produkt"),
+        on_delete=models.CASCADE,
+        related_name="stock_snapshots",
+    )
+    date = models.DateTimeField(
+        verbose_name=_("Datum"),
+        default=timezone.now,
+    )
+    stock = models.IntegerField(
+        verbose_name=_("Lagerbestand"),
+    )
+
+    @admin.display(description=_("Lagerbestand-Snapshot"))
+    def __str__(self):
+        return f"[{self.pk}] {self.product}: {self.stock} ({self.date})"
+
+    class Meta:
+        verbose_name = _("Lagerbestand-Snapshot")
+        verbose_name_plural = _("Lagerbestand-Snapshots")
+        indexes = [models.Index(fields=["product", "date"])]
+
+    objects = models.Manager()
+
+
 class ProductCategory(CustomModel, WooCommerceModelMixin):
     """Model representing a category for products"""
 
@@ -1948,9 +2190,9 @@ class PaymentReceiver(CustomModel):
             errors["swiss_uid"] = ValidationError(_("Die UID ist ungültig!"), code="invalid")
         if self.logourl:
             try:
-                response = requests.get(self.logourl)
-                response.raise_for_status()
-            except requests.RequestException as e:
+                # Also stores the logo in the cache for the PDF generation
+                LogoCache().download(self.logourl)
+            except OSError as e:
                 errors["logourl"] = ValidationError(
                     _("An dieser Adresse konnte kein Bild abgerufen werden! Fehler: %s") % str(e)
                 )
@@ -1958,6 +2200,15 @@ class PaymentReceiver(CustomModel):
         if errors:
             raise ValidationError(errors)
 
+    def save(self, **kwargs):
+        super().save(**kwargs)
+        OrderDefaults.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        OrderDefaults.invalidate()
+        return result
+
     class Meta:
         verbose_name = _("Zahlungsempfänger")
         verbose_name_plural = _("Zahlungsempfänger")
@@ -1,17 +1,93 @@
 import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 
 from django.contrib import messages
-from django.db.models import Sum, OuterRef, Subquery, Value
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Sum, When, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Floor, Round
+from django.db.models.lookups import Exact
 from django.http import HttpRequest
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext as _
 
+from kmuhelper import settings
+from kmuhelper.modules.settings.cache import VersionedCache
+from kmuhelper.utils import runden
+
 log = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class OrderTotals:
+    """Immutable breakdown of all totals of an order
+
+    Calculated in a single pass over the order's items and fees, which are kept
+    so that callers (e.g. the PDF generation) don't have to load them again."""
+
+    items: tuple
+    fees: tuple
+    vat_rates: tuple[tuple[str, float], ...]
+    subtotal_without_discount: float
+    discount: float
+    total_without_vat: float
+    total_vat: float
+    total: float
+
+    @property
+    def vat_dict(self) -> dict[str, float]:
+        """Subtotals per VAT rate
+
+        Format: { rate: total, rate2: total2 }"""
+
+        return dict(self.vat_rates)
+
+    @staticmethod
+    def calc_totals_from_vat_dict(vat_dict: dict[str, float]) -> tuple[float, float, float]:
+        """Calculate (total without VAT, total VAT, total) from the subtotals per VAT rate"""
+
+        total_without_vat = runden(sum(vat_dict.values()))
+        total_vat = runden(
+            sum(runden(float(vat_dict[rate] * (float(rate) / 100))) for rate in vat_dict)
+        )
+        return total_without_vat, total_vat, runden(total_without_vat + total_vat)
+
+    @classmethod
+    def from_lines(cls, items, fees) -> "OrderTotals":
+        """Calculate the totals from already loaded OrderItem and OrderFee objects"""
+
+        items = tuple(items)
+        fees = tuple(fees)
+
+        vat_dict = {}
+        subtotal_without_discount = 0
+        discount = 0
+        for line in items + fees:
+            rate = str(line.vat_rate)
+            vat_dict[rate] = vat_dict.get(rate, 0) + line.calc_subtotal()
+            subtotal_without_discount += line.calc_subtotal_without_discount()
+            discount += line.calc_discount()
+        for rate in vat_dict:
+            vat_dict[rate] = runden(vat_dict[rate])
+
+        total_without_vat, total_vat, total = cls.calc_totals_from_vat_dict(vat_dict)
+
+        return cls(
+            items=items,
+            fees=fees,
+            vat_rates=tuple(vat_dict.items()),
+            subtotal_without_discount=runden(subtotal_without_discount),
+            discount=runden(discount),
+            total_without_vat=total_without_vat,
+            total_vat=total_vat,
+            total=total,
+        )
+
+
 class StockUtils:
     @dataclass(frozen=True)
     class StockData:
@@ -44,10 +120,92 @@ class StockUtils:
 
     @staticmethod
     def get_stock_data(product_ids: list[int]) -> list[StockData]:
+        from kmuhelper.modules.main.models import Product
+
+        qs = Product.objects.filter(id__in=product_ids)
+
+        return list(
+            map(
+                lambda product: StockUtils.StockData(
+                    product=StockUtils.StockData.StockDataProduct(
+                        id=product.id,
+                        article_number=product.article_number,
+                        name=product.clean_name(),
+                    ),
+                    stock=StockUtils.StockData.StockDataStock(
+                        current=product.stock_current,
+                        going=product.stock_reserved,
+                        coming=product.stock_incoming,
+                        min=product.stock_target,
+                    ),
+                ),
+                qs,
+            )
+        )
+
+    @staticmethod
+    def get_quantities_by_product(items, product_field: str) -> dict[int, int]:
+        """Sum up the quantities of order or supply items per product
+
+        Format: { product_id: quantity }"""
+
+        return dict(
+            items.filter(**{f"{product_field}__isnull": False})
+            .values(product_field)
+            .annotate(total=Sum("quantity"))
+            .values_list(product_field, "total")
+            .order_by()
+        )
+
+    @staticmethod
+    def get_differences(old: dict[int, int], new: dict[int, int]) -> dict[int, int]:
+        """Format: { product_id: new - old }"""
+
+        differences = {pk: -quantity for pk, quantity in old.items()}
+        for pk, quantity in new.items():
+            differences[pk] = differences.get(pk, 0) + quantity
+        return differences
+
+    @staticmethod
+    def _add_to_products(field: str, changes: dict[int, int]) -> None:
+        """Add to an integer field of multiple products with one F() UPDATE per distinct value"""
+
+        from kmuhelper.modules.main.models import Product
+
+        products_by_difference = defaultdict(list)
+        for product_id, difference in changes.items():
+            if difference:
+                products_by_difference[difference].append(product_id)
+
+        for difference, product_ids in products_by_difference.items():
+            Product.objects.filter(pk__in=product_ids).update(**{field: F(field) + difference})
+
+    @staticmethod
+    def update_stock_counters(
+        reserved: dict[int, int] | None = None, incoming: dict[int, int] | None = None
+    ) -> None:
+        """Change the stock_reserved and stock_incoming counters of multiple products
+
+        Format: { product_id: difference }"""
+
+        with transaction.atomic():
+            StockUtils._add_to_products("stock_reserved", reserved or {})
+            StockUtils._add_to_products("stock_incoming", incoming or {})
+
+    @staticmethod
+    def rebuild_stock_counters(product_ids: list[int] | None = None) -> int:
+        """Recalculate the stock_reserved and stock_incoming counters from all open orders
+        and supplies and return the amount of updated products"""
+
         from kmuhelper.modules.main.models import Product, OrderItem, SupplyItem
 
-        qs = Product.objects.filter(id__in=product_ids).annotate(
-            total_going=Coalesce(
+        qs = (
+            Product.objects.all()
+            if product_ids is None
+            else Product.objects.filter(pk__in=product_ids)
+        )
+        return qs.update(
+            stock_reserved=Coalesce(
                 Subquery(
                     OrderItem.objects.filter(
                         order__is_removed_from_stock=False, linked_product_id=OuterRef("pk")
@@ -58,7 +216,7 @@ class StockUtils:
                 ),
                 Value(0),
             ),
-            total_coming=Coalesce(
+            stock_incoming=Coalesce(
                 Subquery(
                     SupplyItem.objects.filter(
                         supply__is_added_to_stock=False, product_id=OuterRef("pk")
@@ -71,25 +229,155 @@ class StockUtils:
             ),
         )
 
-        return list(
-            map(
-                lambda product: StockUtils.StockData(
-                    product=StockUtils.StockData.StockDataProduct(
-                        id=product.id,
-                        article_number=product.article_number,
-                        name=product.clean_name(),
-                    ),
-                    stock=StockUtils.StockData.StockDataStock(
-                        current=product.stock_current,
-                        going=product.total_going,
-                        coming=product.total_coming,
-                        min=product.stock_target,
-                    ),
+    @staticmethod
+    def record_stock_movements(
+        changes: dict[int, int], reason: str, linked_order=None, linked_supply=None
+    ) -> None:
+        """Add entries to the stock ledger without changing the current stock
+
+        Format: { product_id: difference }"""
+
+        from kmuhelper.modules.main.models import StockMovement
+
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(
+                    product_id=product_id,
+                    difference=difference,
+                    reason=reason,
+                    linked_order=linked_order,
+                    linked_supply=linked_supply,
+                )
+                for product_id, difference in changes.items()
+                if difference
+            ]
+        )
+
+    @staticmethod
+    def apply_stock_changes(
+        changes: dict[int, int], reason: str, linked_order=None, linked_supply=None
+    ) -> None:
+        """Change the current stock of multiple products and record the changes in the ledger
+
+        Format: { product_id: difference }
+
+        Uses one F() expression UPDATE per distinct difference instead of saving every
+        product, so that concurrent changes to the same product are never lost."""
+
+        with transaction.atomic():
+            StockUtils._add_to_products("stock_current", changes)
+            StockUtils.record_stock_movements(changes, reason, linked_order, linked_supply)
+
+    @staticmethod
+    def set_stock(stocks: dict[int, int], reason: str) -> None:
+        """Set the current stock of multiple products and record the differences in the ledger
+
+        Format: { product_id: new_stock }"""
+
+        from kmuhelper.modules.main.models import Product
+
+        with transaction.atomic():
+            current = dict(
+                Product.objects.select_for_update()
+                .filter(pk__in=stocks.keys())
+                .values_list("pk", "stock_current")
+            )
+            StockUtils.apply_stock_changes(
+                {pk: stocks[pk] - stock_current for pk, stock_current in current.items()}, reason
+            )
+
+    @staticmethod
+    def create_stock_snapshots() -> int:
+        """Save the current stock of all products as a snapshot and return the amount"""
+
+        from kmuhelper.modules.main.models import Product, StockSnapshot
+
+        with transaction.atomic():
+            now = timezone.now()
+            snapshots = StockSnapshot.objects.bulk_create(
+                [
+                    StockSnapshot(product_id=pk, stock=stock_current, date=now)
+                    for pk, stock_current in Product.objects.select_for_update().values_list(
+                        "pk", "stock_current"
+                    )
+                ]
+            )
+        return len(snapshots)
+
+    @staticmethod
+    def get_stock_at(product_ids: list[int], date: datetime) -> dict[int, int]:
+        """Get the stock of multiple products at a point in time with a single query
+
+        Format: { product_id: stock }
+
+        Starts at the latest snapshot before the date and adds all movements since then.
+        Products without such a snapshot are calculated back from their current stock."""
+
+        from kmuhelper.modules.main.models import Product, StockMovement, StockSnapshot
+
+        def moved(**filters):
+            return Coalesce(
+                Subquery(
+                    StockMovement.objects.filter(product_id=OuterRef("pk"), **filters)
+                    .values("product_id")
+                    .annotate(total=Sum("difference"))
+                    .values("total")
                 ),
-                qs,
+                Value(0),
+            )
+
+        snapshots = StockSnapshot.objects.filter(
+            product_id=OuterRef("pk"), date__lte=date
+        ).order_by("-date")
+
+        qs = (
+            Product.objects.filter(pk__in=product_ids)
+            .annotate(
+                snapshot_date=Subquery(snapshots.values("date")[:1]),
+                snapshot_stock=Subquery(snapshots.values("stock")[:1]),
+            )
+            .annotate(
+                moved_since_snapshot=moved(date__gt=OuterRef("snapshot_date"), date__lte=date),
+                moved_after_date=moved(date__gt=date),
+            )
+            .values_list(
+                "pk",
+                "stock_current",
+                "snapshot_stock",
+                "moved_since_snapshot",
+                "moved_after_date",
             )
         )
 
+        return {
+            pk: (
+                snapshot_stock + moved_since_snapshot
+                if snapshot_stock is not None
+                else stock_current - moved_after_date
+            )
+            for pk, stock_current, snapshot_stock, moved_since_snapshot, moved_after_date in qs
+        }
+
+    @staticmethod
+    def get_stock_velocity(product_ids: list[int], days: int = 30) -> dict[int, float]:
+        """Get the average amount of sold units per day over the last days
+
+        Format: { product_id: units_per_day }"""
+
+        from kmuhelper.modules.main.models import StockMovement
+
+        totals = dict(
+            StockMovement.objects.filter(
+                product_id__in=product_ids,
+                reason="order",
+                date__gte=timezone.now() - timedelta(days=days),
+            )
+            .values("product_id")
+            .annotate(total=Sum("difference"))
+            .values_list("product_id", "total")
+        )
+        return {pk: -totals.get(pk, 0) / days for pk in product_ids}
+
     @staticmethod
     def generate_admin_message(request: HttpRequest, dat: StockData):
         if not dat.stock.overbooked and not dat.stock.in_danger:
@@ -151,3 +439,191 @@ class StockUtils:
             success = email.send()
             return bool(success)
         return None
+
+
+class OrderSumUtils:
+    """Recalculate Order.cached_sum in bulk using database-side aggregation
+
+    The subtotal of every line is rounded to 0.05 in the database (like OrderItem.calc_subtotal
+    and OrderFee.calc_subtotal) and summed up per order and VAT rate. Only the final step
+    (VAT per rate and the total) is calculated in Python using OrderTotals."""
+
+    @dataclass(frozen=True)
+    class Drift:
+        order_id: int
+        cached_sum: float
+        calculated_sum: float
+
+    @dataclass(frozen=True)
+    class ChunkResult:
+        last_id: int
+        checked: int
+        drifts: tuple["OrderSumUtils.Drift", ...]
+
+    TOLERANCE = 0.001
+
+    @staticmethod
+    def _rounded_subtotal(expression):
+        """Round to 0.05 like runden(), which rounds exact halves to even (ROUND in SQL rounds
+        them away from zero)"""
+
+        steps = expression / Value(0.05)
+        return Case(
+            When(Exact(steps - Floor(steps), 0.5), then=Round(steps / Value(2.0)) * Value(2.0)),
+            default=Round(steps),
+            output_field=FloatField(),
+        ) * Value(0.05)
+
+    @staticmethod
+    def get_vat_dicts(order_ids: list[int]) -> dict[int, dict[str, float]]:
+        """Get the subtotals per VAT rate for multiple orders with two queries
+
+        Format: { order_id: { rate: total, rate2: total2 } }"""
+
+        from kmuhelper.modules.main.models import OrderItem, OrderFee
+
+        querysets = (
+            OrderItem.objects.filter(order_id__in=order_ids)
+            .values("order_id", "vat_rate")
+            .annotate(
+                subtotal=Sum(
+                    OrderSumUtils._rounded_subtotal(
+                        # Same order of operations as OrderItem.calc_subtotal
+                        F("product_price")
+                        * F("quantity")
+                        * ((100 - F("discount")) / 100)
+                    )
+                )
+            ),
+            OrderFee.objects.filter(order_id__in=order_ids)
+            .values("order_id", "vat_rate")
+            .annotate(
+                subtotal=Sum(
+                    OrderSumUtils._rounded_subtotal(F("price") * ((100 - F("discount")) / 100))
+                )
+            ),
+        )
+
+        vat_dicts = {order_id: {} for order_id in order_ids}
+        for qs in querysets:
+            for row in qs.order_by():
+                vat_dict = vat_dicts[row["order_id"]]
+                rate = str(row["vat_rate"])
+                vat_dict[rate] = vat_dict.get(rate, 0) + row["subtotal"]
+
+        for vat_dict in vat_dicts.values():
+            for rate in vat_dict:
+                vat_dict[rate] = runden(vat_dict[rate])
+        return vat_dicts
+
+    @staticmethod
+    def iter_recalculate(
+        queryset, chunk_size: int = 1000, start_after: int | None = None, save: bool = True
+    ):
+        """Recalculate the cached sum of all orders in the queryset, chunk by chunk
+
+        Orders are processed in ascending order of their id. After each chunk, a ChunkResult
+        is yielded. Its last_id can be passed as start_after to resume an interrupted run.
+        Only orders whose cached sum differs are updated (if save is True)."""
+
+        from kmuhelper.modules.main.models import Order
+
+        queryset = queryset.order_by("pk")
+        last_id = start_after
+
+        while True:
+            chunk = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+            rows = list(chunk.values_list("pk", "cached_sum")[:chunk_size])
+            if not rows:
+                return
+
+            vat_dicts = OrderSumUtils.get_vat_dicts([pk for pk, _ in rows])
+
+            drifts = []
+            for pk, cached_sum in rows:
+                total = OrderTotals.calc_totals_from_vat_dict(vat_dicts[pk])[2]
+                if abs(total - cached_sum) > OrderSumUtils.TOLERANCE:
+                    drifts.append(OrderSumUtils.Drift(pk, cached_sum, total))
+
+            if save and drifts:
+                # Note: Not using bulk_update because instantiating orders evaluates the
+                # (database dependent) field defaults for every single object
+                Order.objects.filter(pk__in=[d.order_id for d in drifts]).update(
+                    cached_sum=Case(
+                        *[When(pk=d.order_id, then=Value(d.calculated_sum)) for d in drifts],
+                        output_field=FloatField(),
+                    )
+                )
+
+            last_id = rows[-1][0]
+            yield OrderSumUtils.ChunkResult(
+                last_id=last_id, checked=len(rows), drifts=tuple(drifts)
+            )
+
+
+class OrderDefaults:
+    """Cached defaults for the payment receiver and contact person of new orders
+
+    Resolving a default takes a few queries, which would otherwise run for every new order (e.g.
+    for every order imported from WooCommerce). The resolved defaults are kept in a VersionedCache
+    (see kmuhelper.modules.settings.cache), which is invalidated in all processes when a payment
+    receiver or contact person is changed. If there is no default and the most recently used one
+    is taken instead, it is also removed when an order is created or deleted. As this happens
+    for every order, it is only done in the current process; the other processes keep it until
+    it expires.
+
+    File settings:
+    - KMUHELPER_ORDER_DEFAULTS_TIMEOUT: Seconds to keep the defaults (default: 300)
+    """
+
+    cache = VersionedCache("order-defaults-cache-version")
+
+    @staticmethod
+    def _get_timeout() -> int:
+        return settings.get_file_setting("KMUHELPER_ORDER_DEFAULTS_TIMEOUT", 300)
+
+    @staticmethod
+    def _resolve(field: str) -> tuple[int | None, bool, float]:
+        """Find the default for a foreign key of the order
+
+        Returns the primary key, whether it is only a fallback (not marked as default) and when
+        it was resolved"""
+
+        from kmuhelper.modules.main.models import Order
+
+        model = Order._meta.get_field(field).related_model
+        now = time.monotonic()
+
+        if not model.objects.exists():
+            # Also avoids querying columns that don't exist yet while migrating
+            return None, True, now
+        pk = model.objects.filter(is_default=True).values_list("pk", flat=True).first()
+        if pk is not None:
+            return pk, False, now
+        # Fallback if there isn't a default: Use the most recently used one
+        pk = Order.objects.order_by("-date").values_list(field, flat=True).first()
+        if pk is not None:
+            return pk, True, now
+        return model.objects.values_list("pk", flat=True).first(), True, now
+
+    @classmethod
+    def get(cls, field: str) -> int | None:
+        """Get the primary key of the default for a foreign key of the order
+        ("payment_receiver" or "contact_person")"""
+
+        cls.cache.discard(field, lambda value: time.monotonic() - value[2] > cls._get_timeout())
+        return cls.cache.get_or_load(field, lambda: cls._resolve(field))[0]
+
+    @classmethod
+    def invalidate(cls, fallbacks_only: bool = False) -> None:
+        """Remove the cached defaults
+
+        With fallbacks_only (used when orders are created or deleted), only the ones taken
+        from the most recent order are removed."""
+
+        if fallbacks_only:
+            for field in ("payment_receiver", "contact_person"):
+                cls.cache.discard(field, lambda value: value[1])
+            return
+
+        cls.cache.invalidate()
@@ -9,17 +9,31 @@ from reportlab.lib.pagesizes import A4
 from django.http import FileResponse
 from django.utils import translation
 
+from kmuhelper.modules.pdfgeneration import workers
+from kmuhelper.modules.pdfgeneration.cache import PDFCache
+
 _ = translation.gettext
 
 
 class PDFGenerator:
     def __init__(self, *args, **kwargs):
         self.elements = []
+        self.__content = None
+
+    def get_elements(self) -> list:
+        """Get the flowables of the document (only called if the PDF has to be built)"""
+
+        return self.elements
+
+    def get_cache_key(self) -> str | None:
+        """Get a key identifying the content of the document, or None to disable caching"""
+
+        return None
 
-    def _build_pdf(self):
-        self.__buffer = BytesIO()
-        self.__doc = SimpleDocTemplate(
-            self.__buffer,
+    def _build_pdf(self) -> bytes:
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
             rightMargin=10 * mm,
             leftMargin=10 * mm,
             topMargin=10 * mm,
@@ -29,13 +43,37 @@ class PDFGenerator:
             author="Rafael Urben (rafaelurben.ch)",
         )
 
-        self.__doc.build(self.elements)
-        self.__buffer.seek(0)
+        doc.build(self.get_elements())
+        return buffer.getvalue()
+
+    def get_pdf(self, use_cache=True):
+        if self.__content is None:
+            cache = PDFCache()
+            cache_key = self.get_cache_key() if use_cache else None
+
+            if cache_key is not None:
+                self.__content = cache.get(cache_key)
+            if self.__content is None:
+                if workers.is_enabled():
+                    self.__content = workers.render(self)
+                else:
+                    self.__content = self._build_pdf()
+                if cache_key is not None:
+                    cache.set(cache_key, self.__content)
+        return BytesIO(self.__content)
+
+    def get_pdf_nowait(self, wait=1.0):
+        """Like get_pdf, but returns None while the document is being rendered in the background
+
+        Only renders in the background if worker processes and the PDF cache are enabled, as the
+        result is passed on through the cache. Call again (e.g. in the next request) to get it."""
 
-    def get_pdf(self):
-        if not hasattr(self, "__buffer"):
-            self._build_pdf()
-        return self.__buffer
+        cache_key = self.get_cache_key()
+        if self.__content is None and workers.is_enabled() and cache_key and PDFCache().enabled:
+            self.__content = workers.get_or_submit(self, cache_key, wait=wait)
+            if self.__content is None:
+                return None
+        return self.get_pdf()
 
     def get_response(self, as_attachment=False, filename="document.pdf"):
         return FileResponse(self.get_pdf(), as_attachment=as_attachment, filename=filename)
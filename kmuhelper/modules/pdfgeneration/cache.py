@@ -0,0 +1,74 @@
+"""Size-bounded cache for rendered PDF documents"""
+
+from django.core.cache import caches
+
+from kmuhelper import settings
+
+
+class PDFCache:
+    """Stores rendered PDFs in a Django cache backend
+
+    An index of all cached documents and their sizes is kept in the cache too. Once the total
+    size exceeds the limit, the least recently used documents are evicted.
+
+    File settings:
+    - KMUHELPER_PDF_CACHE: Name of the cache to use (default: "default")
+    - KMUHELPER_PDF_CACHE_MAX_SIZE: Maximum total size in bytes (default: 50 MB, 0 to disable)
+    - KMUHELPER_PDF_CACHE_TIMEOUT: Seconds after which a document expires (default: 7 days)
+    """
+
+    KEY_PREFIX = "kmuhelper-pdf-"
+    INDEX_KEY = "kmuhelper-pdf-index"
+
+    def __init__(self):
+        self.cache = caches[settings.get_file_setting("KMUHELPER_PDF_CACHE", "default")]
+        self.max_size = settings.get_file_setting("KMUHELPER_PDF_CACHE_MAX_SIZE", 50 * 1024**2)
+        self.timeout = settings.get_file_setting("KMUHELPER_PDF_CACHE_TIMEOUT", 7 * 24 * 60 * 60)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _get_index(self) -> dict[str, int]:
+        """Get the cached documents and their sizes, least recently used first"""
+
+        return dict(self.cache.get(self.INDEX_KEY, []))
+
+    def _set_index(self, index: dict[str, int]):
+        self.cache.set(self.INDEX_KEY, list(index.items()), self.timeout)
+
+    def get(self, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+
+        content = self.cache.get(self.KEY_PREFIX + key)
+        if content is not None:
+            # Mark as most recently used
+            index = self._get_index()
+            index[key] = index.pop(key, len(content))
+            self._set_index(index)
+        return content
+
+    def set(self, key: str, content: bytes) -> bool:
+        """Store the document, returns False if the cache is disabled or the document too large"""
+
+        if not self.enabled or len(content) > self.max_size:
+            return False
+
+        index = self._get_index()
+        index.pop(key, None)
+        index[key] = len(content)
+
+        total_size = sum(index.values())
+        while total_size > self.max_size:
+            oldest = next(iter(index))
+            total_size -= index.pop(oldest)
+            self.cache.delete(self.KEY_PREFIX + oldest)
+
+        self.cache.set(self.KEY_PREFIX + key, content, self.timeout)
+        self._set_index(index)
+        return True
+
+    def clear(self):
+        self.cache.delete_many([self.KEY_PREFIX + key for key in self._get_index()])
+        self.cache.delete(self.INDEX_KEY)
@@ -0,0 +1,104 @@
+"""Local cache for logo images printed on generated PDFs"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from io import BytesIO
+
+import requests
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+from kmuhelper import settings
+
+logger = logging.getLogger(__name__)
+
+# Logos already read from disk in this process: { path: (mtime, content) }
+_loaded_logos = {}
+
+
+class LogoCache:
+    """Downloads logo images once and stores a version scaled down to the size of the header box
+
+    The files are named after a hash of the URL, so a changed URL is downloaded again. Files
+    older than the timeout are revalidated; if that fails, the old version is used.
+
+    File settings:
+    - KMUHELPER_LOGO_CACHE_DIR: Directory for the cached images (default: temporary directory)
+    - KMUHELPER_LOGO_CACHE_TIMEOUT: Seconds after which a logo is downloaded again (default: 1 day)
+    - KMUHELPER_LOGO_REQUEST_TIMEOUT: Timeout in seconds for downloading a logo (default: 5)
+    """
+
+    # 20mm (size of the logo on the PDF) at 300 DPI
+    MAX_SIZE_PX = 236
+
+    def __init__(self):
+        self.directory = settings.get_file_setting(
+            "KMUHELPER_LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kmuhelper-logos")
+        )
+        self.timeout = settings.get_file_setting("KMUHELPER_LOGO_CACHE_TIMEOUT", 24 * 60 * 60)
+        self.request_timeout = settings.get_file_setting("KMUHELPER_LOGO_REQUEST_TIMEOUT", 5)
+
+    def _get_path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + ".png")
+
+    def download(self, url: str) -> bytes:
+        """Download and scale the image and store it in the cache
+
+        Raises OSError if the image can't be downloaded or isn't a valid image
+        (requests.RequestException is a subclass of OSError)."""
+
+        response = requests.get(url, timeout=self.request_timeout)
+        response.raise_for_status()
+
+        try:
+            with Image.open(BytesIO(response.content)) as image:
+                image.thumbnail((self.MAX_SIZE_PX, self.MAX_SIZE_PX))
+                # PNG doesn't support all modes (e.g. CMYK)
+                if image.mode not in ("RGB", "RGBA", "L", "P"):
+                    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+                buffer = BytesIO()
+                image.save(buffer, format="PNG", optimize=True)
+        except Image.DecompressionBombError as e:
+            raise OSError(f"Image too large: {e}") from e
+        content = buffer.getvalue()
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._get_path(url)
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+            file.write(content)
+        os.replace(file.name, path)
+
+        _loaded_logos[path] = (os.path.getmtime(path), content)
+        return content
+
+    def get(self, url: str) -> bytes:
+        """Get the scaled image from the cache, downloading it if necessary
+
+        Raises OSError if the image isn't cached and can't be downloaded."""
+
+        path = self._get_path(url)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return self.download(url)
+
+        if time.time() - mtime > self.timeout:
+            try:
+                return self.download(url)
+            except OSError:
+                logger.warning(
+                    "[KMUHelper] Revalidating logo failed, using cached version: %s", url
+                )
+
+        cached = _loaded_logos.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as file:
+                cached = (mtime, file.read())
+            _loaded_logos[path] = cached
+        return cached[1]
+
+    def get_image_reader(self, url: str) -> ImageReader:
+        return ImageReader(BytesIO(self.get(url)))
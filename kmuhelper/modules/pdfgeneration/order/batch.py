@@ -0,0 +1,223 @@
+"""Export the PDFs of many orders at once"""
+
+import copy
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import django
+from django.utils import timezone
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from kmuhelper import settings
+from kmuhelper.modules.main.models import Order
+from kmuhelper.modules.pdfgeneration.order.generator import PDFOrder
+from kmuhelper.translations import Language
+
+
+def _render_order(order_id, preset, lang, is_print_version, directory) -> tuple[str, str]:
+    """Render the PDF of one order to a file, returns the path and the name for the document"""
+
+    order = Order.objects.select_related("payment_receiver", "contact_person").get(pk=order_id)
+    lang = lang or order.language
+    with Language(lang):
+        pdf = PDFOrder.from_preset(order, preset, lang=lang, is_print_version=is_print_version)
+        # Batch exports are rarely viewed again and would evict the documents of the cache
+        content = pdf.get_pdf(use_cache=False).getvalue()
+
+    path = os.path.join(directory, f"{order_id}.pdf")
+    with open(path, "wb") as file:
+        file.write(content)
+    return path, f"{str(order)} - {pdf.title}.pdf"
+
+
+class _PdfConcatenator:
+    """Writes the pages of many PDFs into one PDF, one document after the other
+
+    Unlike pypdf's PdfWriter, which keeps every page in memory until the end, the objects of each
+    document are written to the file right away. Only their offsets are kept for the
+    cross-reference table.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, file):
+        self.file = file
+        self.position = 0
+        # Offsets of the objects by id, the catalog and page tree are written at the end
+        self.offsets = [None, None]
+        self.page_ids = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.position += len(data)
+
+    def _write_object(self, object_id: int, obj):
+        self.offsets[object_id - 1] = self.position
+        buffer = BytesIO()
+        buffer.write(f"{object_id} 0 obj\n".encode())
+        obj.write_to_stream(buffer)
+        buffer.write(b"\nendobj\n")
+        self._write(buffer.getvalue())
+
+    def _new_id(self) -> int:
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    @staticmethod
+    def _get_references(obj):
+        if isinstance(obj, IndirectObject):
+            yield obj
+        elif isinstance(obj, DictionaryObject):
+            for value in obj.values():
+                yield from _PdfConcatenator._get_references(value)
+        elif isinstance(obj, ArrayObject):
+            for value in obj:
+                yield from _PdfConcatenator._get_references(value)
+
+    @staticmethod
+    def _renumber(obj, ids: dict):
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is None:  # Already refers to an object of this file
+                return obj
+            return IndirectObject(ids[obj.idnum, obj.generation], 0, None)
+        if isinstance(obj, DictionaryObject):
+            # Shallow copies keep the (still encoded) data of streams
+            clone = copy.copy(obj)
+            clone.update(
+                {key: _PdfConcatenator._renumber(value, ids) for key, value in obj.items()}
+            )
+            return clone
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(_PdfConcatenator._renumber(value, ids) for value in obj)
+        return obj
+
+    def append(self, path):
+        """Write all pages of the PDF and the objects they use"""
+
+        reader = PdfReader(path)
+        objects = {}
+        for page in reader.pages:
+            ref = page.indirect_reference
+            page = DictionaryObject(page)
+            page[NameObject("/Parent")] = IndirectObject(self.PAGES_ID, 0, None)
+            objects[ref.idnum, ref.generation] = page
+        page_keys = set(objects)
+
+        # Collect everything reachable from the pages
+        queue = list(objects.values())
+        while queue:
+            for ref in self._get_references(queue.pop()):
+                key = ref.idnum, ref.generation
+                if ref.pdf is not None and key not in objects:
+                    objects[key] = reader.get_object(ref)
+                    queue.append(objects[key])
+
+        ids = {key: self._new_id() for key in objects}
+        for key, obj in objects.items():
+            if key in page_keys:
+                self.page_ids.append(ids[key])
+            self._write_object(ids[key], self._renumber(obj, ids))
+
+    def finish(self):
+        """Write the page tree, the catalog and the cross-reference table"""
+
+        pages = DictionaryObject()
+        pages[NameObject("/Type")] = NameObject("/Pages")
+        pages[NameObject("/Kids")] = ArrayObject(
+            IndirectObject(page_id, 0, None) for page_id in self.page_ids
+        )
+        pages[NameObject("/Count")] = NumberObject(len(self.page_ids))
+        self._write_object(self.PAGES_ID, pages)
+
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = IndirectObject(self.PAGES_ID, 0, None)
+        self._write_object(self.CATALOG_ID, catalog)
+
+        xref_position = self.position
+        size = len(self.offsets) + 1
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{offset:010d} 00000 n \n" for offset in self.offsets]
+        lines.append(
+            f"trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\n"
+            f"startxref\n{xref_position}\n%%EOF\n"
+        )
+        self._write("".join(lines).encode())
+
+
+def export_order_pdfs(
+    order_ids,
+    file,
+    *,
+    preset="invoice",
+    lang=None,
+    is_print_version=True,
+    as_zip=False,
+    workers=None,
+) -> int:
+    """Render the PDFs of all orders and write them to `file` (a path or a binary file object)
+
+    The documents are rendered in a pool of worker processes, which write them to a temporary
+    directory instead of sending them back. They are then either merged into one PDF or written
+    into a ZIP file one by one, in the order of `order_ids`. Either way, each document is written
+    to `file` as soon as it is ready, so the memory needed does not grow with the number of orders.
+
+    File settings:
+    - KMUHELPER_PDF_BATCH_WORKERS: Number of worker processes (default: number of CPUs, 0 to render
+      in the current process)
+    """
+
+    order_ids = list(dict.fromkeys(order_ids))
+    if workers is None:
+        workers = settings.get_file_setting("KMUHELPER_PDF_BATCH_WORKERS", os.cpu_count() or 1)
+    workers = min(workers, len(order_ids))
+
+    # Same as when viewing a single PDF
+    Order.objects.filter(pk__in=order_ids, invoice_date__isnull=True).update(
+        invoice_date=timezone.now()
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        args = [(pk, preset, lang, is_print_version, directory) for pk in order_ids]
+
+        if workers > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                # Forking a (multithreaded) web server process is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                # New processes import this module, which requires Django to be set up
+                initializer=django.setup,
+            )
+            results = executor.map(_render_order, *zip(*args))
+        else:
+            executor = None
+            results = (_render_order(*arg) for arg in args)
+
+        try:
+            if as_zip:
+                with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                    for path, name in results:
+                        archive.write(path, name)
+                        os.remove(path)
+            else:
+                with (
+                    open(file, "wb") if isinstance(file, (str, os.PathLike)) else nullcontext(file)
+                ) as output:
+                    concatenator = _PdfConcatenator(output)
+                    for path, _name in results:
+                        concatenator.append(path)
+                        os.remove(path)
+                    concatenator.finish()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    return len(order_ids)
@@ -1,28 +1,32 @@
 """PDF creator for invoices and delivery notes"""
 
+import hashlib
 import logging
 
 from datetime import datetime
 
-from django.utils.translation import pgettext
+from django.utils.translation import gettext, pgettext
 from reportlab.lib.colors import black
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
 from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, TopPadder, Flowable
 
 from kmuhelper import settings
 from kmuhelper.modules.pdfgeneration.base import PDFGenerator
+from kmuhelper.modules.pdfgeneration.logo import LogoCache
 from kmuhelper.modules.pdfgeneration.swiss_qr_invoice import QRInvoiceFlowable
 from kmuhelper.translations import (
+    Language,
     autotranslate_quantity_description,
     autotranslate_fee_name,
     langselect,
 )
-from kmuhelper.utils import formatprice
+from kmuhelper.utils import formatprice, _package_version_local
 
 logger = logging.getLogger(__name__)
 
+_PACKAGE_VERSION = str(_package_version_local("django-kmuhelper"))
+
 style_default = ParagraphStyle("Normal", fontname="Helvetica")
 style_bold = ParagraphStyle("Bold", fontname="Helvetica-Bold")
 
@@ -33,7 +37,10 @@ class _PDFOrderPriceTable(Table):
     COLWIDTHS = [26 * mm, 80 * mm, 20 * mm, 20 * mm, 20 * mm, 20 * mm]
 
     @classmethod
-    def from_order(cls, order, lang="de", show_payment_conditions=None):
+    def from_order(cls, order, lang="de", show_payment_conditions=None, totals=None):
+        if totals is None:
+            totals = order.get_totals()
+
         data = [
             (
                 pgettext("Text on generated order PDF", "Art-Nr."),
@@ -49,7 +56,7 @@ class _PDFOrderPriceTable(Table):
 
         h_products = 0
 
-        for item in order.products.through.objects.filter(order=order):
+        for item in totals.items:
             subtotal_without_discount = item.calc_subtotal_without_discount()
             data.append(
                 (
@@ -87,7 +94,7 @@ class _PDFOrderPriceTable(Table):
 
         h_costs = 0
 
-        for item in order.fees.through.objects.filter(order=order):
+        for item in totals.fees:
             data.append(
                 (
                     "",
@@ -119,7 +126,7 @@ class _PDFOrderPriceTable(Table):
 
         h_vat = 0
 
-        vat_dict = dict(order.get_vat_dict())
+        vat_dict = totals.vat_dict
         for vat_rate in vat_dict:
             if float(vat_rate) == 0.0 and not settings.get_file_setting("PRINT_ZERO_VAT", False):
                 # Skip zero VAT if not explicitly enabled
@@ -231,7 +238,10 @@ class _PDFOrderProductTable(Table):
     COLWIDTHS = [36 * mm, 110 * mm, 20 * mm, 20 * mm]
 
     @classmethod
-    def from_order(cls, order, lang="de"):
+    def from_order(cls, order, lang="de", totals=None):
+        if totals is None:
+            totals = order.get_totals()
+
         data = [
             (
                 pgettext("Text on generated order PDF", "Art-Nr."),
@@ -245,7 +255,7 @@ class _PDFOrderProductTable(Table):
 
         # Products
 
-        for item in order.products.through.objects.filter(order=order):
+        for item in totals.items:
             data.append(
                 (
                     item.article_number,
@@ -440,9 +450,8 @@ class _PDFOrderHeader(Flowable):
         # Logo
         if recv.logourl:
             try:
-                image = ImageReader(
-                    recv.logourl
-                )  # this will raise OSError if image is not available
+                # this will raise OSError if image is not available
+                image = LogoCache().get_image_reader(recv.logourl)
                 c.drawImage(
                     image,
                     120 * mm,
@@ -551,31 +560,138 @@ class PDFOrder(PDFGenerator):
     ):
         super().__init__()
 
-        order.cached_sum = order.calc_total()
+        # Calculate all totals once and reuse them for all parts of the PDF
+        self.totals = order.get_totals()
+        order.cached_sum = self.totals.total
+
+        if show_payment_conditions is None and not is_delivery_note:
+            show_payment_conditions = settings.get_db_setting("print-payment-conditions", False)
+
+        self.order = order
+        self.title = str(title)
+        self.text = text
+        self.lang = lang or order.language
+        self.is_delivery_note = is_delivery_note
+        self.add_cut_lines = add_cut_lines
+        self.show_payment_conditions = show_payment_conditions
+
+    PRESETS = ("invoice", "delivery-note", "payment-reminder")
+
+    @classmethod
+    def from_preset(
+        cls, order, preset, *, lang=None, title=None, text=None, is_print_version=False
+    ):
+        """Create the PDF for one of the presets, raises ValueError for unknown presets
+
+        Note: The payment reminder temporarily changes the order's date and payment conditions
+        (without saving them)."""
 
         lang = lang or order.language
+        with Language(lang):
+            match preset:
+                case "invoice":
+                    return cls(
+                        order,
+                        title or gettext("Rechnung"),
+                        text=text,
+                        lang=lang,
+                        add_cut_lines=not is_print_version,
+                    )
+                case "delivery-note":
+                    return cls(
+                        order,
+                        title or gettext("Lieferschein"),
+                        text=text,
+                        lang=lang,
+                        is_delivery_note=True,
+                    )
+                case "payment-reminder":
+                    days_to_pay = 14
+                    text = text or gettext(
+                        "Geschätzter Kunde\n\nVermutlich ist Ihnen entgangen, diese Rechnung vom %(original_date)s innert "
+                        "der gewährten Frist zu begleichen.\nWir bitten Sie, dies innert %(days)d Tagen "
+                        "nachzuholen.\n\nSollte sich Ihre Zahlung mit diesem Schreiben überkreuzen, so betrachten Sie "
+                        "dieses bitte als gegenstandslos."
+                    ) % {
+                        "original_date": order.invoice_date.strftime("%d.%m.%Y"),
+                        "days": days_to_pay,
+                    }
+                    # Temporarily replace the order's date and payment conditions
+                    order.invoice_date = datetime.now().date()
+                    order.payment_conditions = f"0:{days_to_pay}"
+                    return cls(
+                        order,
+                        title or gettext("Zahlungserinnerung"),
+                        text=text,
+                        lang=lang,
+                        add_cut_lines=not is_print_version,
+                        show_payment_conditions=False,
+                    )
+        raise ValueError(f"Invalid preset: {preset}")
+
+    def get_cache_key(self):
+        """Hash of all data printed on the document"""
+
+        def fields(obj):
+            if obj is None:
+                return None
+            return [(f.attname, getattr(obj, f.attname)) for f in obj._meta.concrete_fields]
+
+        order = self.order
+        data = [
+            _PACKAGE_VERSION,
+            datetime.now().date(),
+            settings.get_file_setting("PRINT_ZERO_VAT", False),
+            self.title,
+            self.text,
+            self.lang,
+            self.is_delivery_note,
+            self.add_cut_lines,
+            self.show_payment_conditions,
+            fields(order),
+            fields(order.payment_receiver),
+            fields(order.contact_person),
+            [fields(item) for item in self.totals.items],
+            [fields(fee) for fee in self.totals.fees],
+        ]
+        return "order-" + hashlib.sha256(repr(data).encode()).hexdigest()
+
+    def get_elements(self):
+        order = self.order
+        totals = self.totals
+        lang = self.lang
 
         # Header
-        self.elements = [
-            _PDFOrderHeader.from_order(order, title=title, is_delivery_note=is_delivery_note),
+        elements = [
+            _PDFOrderHeader.from_order(
+                order, title=self.title, is_delivery_note=self.is_delivery_note
+            ),
             Spacer(1, 48 * mm),
         ]
 
         # Custom text
-        if text:
-            self.elements += [
-                Paragraph(text.replace("\n", "\n<br />")),
+        if self.text:
+            elements += [
+                Paragraph(self.text.replace("\n", "\n<br />")),
                 Spacer(1, 10 * mm),
             ]
 
         # Main body
-        if is_delivery_note:
-            self.elements += [_PDFOrderProductTable.from_order(order, lang=lang)]
+        if self.is_delivery_note:
+            elements += [_PDFOrderProductTable.from_order(order, lang=lang, totals=totals)]
         else:
-            self.elements += [
+            elements += [
                 _PDFOrderPriceTable.from_order(
-                    order, lang=lang, show_payment_conditions=show_payment_conditions
+                    order,
+                    lang=lang,
+                    show_payment_conditions=self.show_payment_conditions,
+                    totals=totals,
                 ),
                 Spacer(1, 65 * mm),
-                TopPadder(QRInvoiceFlowable.from_order(order, add_cut_lines=add_cut_lines)),
+                TopPadder(
+                    QRInvoiceFlowable.from_order(
+                        order, add_cut_lines=self.add_cut_lines, totals=totals
+                    )
+                ),
             ]
+        return elements
@@ -1,21 +1,19 @@
-from datetime import datetime
-
 from django.contrib.admin.models import LogEntry, CHANGE
 from django.contrib.auth.decorators import login_required
+from django.http import FileResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy, reverse
-from django.utils import translation, timezone
+from django.utils import timezone
 
 from kmuhelper import constants
 from kmuhelper.decorators import require_object, require_all_kmuhelper_perms
 from kmuhelper.modules.main.models import Order
 from kmuhelper.modules.pdfgeneration.order.forms import PDFOrderForm
 from kmuhelper.modules.pdfgeneration.order.generator import PDFOrder
+from kmuhelper.modules.pdfgeneration.workers import PDFWorkerError
 from kmuhelper.translations import Language
 from kmuhelper.utils import render_error
 
-_ = translation.gettext
-
 # Views
 
 
@@ -46,47 +44,34 @@ def order_view_pdf(request, obj):
         order.invoice_date = timezone.now()
         order.save()
 
+    if preset not in PDFOrder.PRESETS:
+        return render_error(request, status=400, message="Ungültige Vorlage: " + str(preset))
+
     with Language(lang):
-        match preset:
-            case "invoice":
-                title = title or _("Rechnung")
-                pdf = PDFOrder(
-                    order,
-                    title,
-                    text=text,
-                    lang=lang,
-                    add_cut_lines=not is_print_version,
-                )
-            case "delivery-note":
-                title = title or _("Lieferschein")
-                pdf = PDFOrder(order, title, text=text, lang=lang, is_delivery_note=True)
-            case "payment-reminder":
-                days_to_pay = 14
-                title = title or _("Zahlungserinnerung")
-                text = text or _(
-                    "Geschätzter Kunde\n\nVermutlich ist Ihnen entgangen, diese Rechnung vom %(original_date)s innert "
-                    "der gewährten Frist zu begleichen.\nWir bitten Sie, dies innert %(days)d Tagen "
-                    "nachzuholen.\n\nSollte sich Ihre Zahlung mit diesem Schreiben überkreuzen, so betrachten Sie "
-                    "dieses bitte als gegenstandslos."
-                ) % {
-                    "original_date": order.invoice_date.strftime("%d.%m.%Y"),
-                    "days": days_to_pay,
-                }
-                # Temporarily replace the order's date and payment conditions
-                order.invoice_date = datetime.now().date()
-                order.payment_conditions = f"0:{days_to_pay}"
-                pdf = PDFOrder(
-                    order,
-                    title,
-                    text=text,
-                    lang=lang,
-                    add_cut_lines=not is_print_version,
-                    show_payment_conditions=False,
-                )
-            case _:
-                return render_error(
-                    request, status=400, message="Ungültige Vorlage: " + str(preset)
-                )
+        pdf = PDFOrder.from_preset(
+            order, preset, lang=lang, title=title, text=text, is_print_version=is_print_version
+        )
+        title = pdf.title
+        text = pdf.text
+
+        try:
+            content = pdf.get_pdf_nowait()
+        except PDFWorkerError as e:
+            return render_error(request, status=500, message=str(e))
+
+        if content is None:
+            # Still rendering in a worker process: reload this page until it's done
+            return render(
+                request,
+                "admin/kmuhelper/order/pdf_wait.html",
+                {
+                    "title": title,
+                    "refresh_seconds": 2,
+                    "has_permission": True,
+                    "original": order,
+                },
+                status=202,
+            )
 
         # Log the action
         LogEntry.objects.log_actions(
@@ -101,7 +86,7 @@ def order_view_pdf(request, obj):
         )
 
         filename = f"{str(order)} - {title}.pdf"
-        return pdf.get_response(as_attachment=is_download, filename=filename)
+        return FileResponse(content, as_attachment=is_download, filename=filename)
 
 
 @login_required(login_url=reverse_lazy("admin:login"))
@@ -40,12 +40,12 @@ class QRInvoiceFlowable(Flowable):
         self.add_cut_info: bool = add_cut_info
 
     @classmethod
-    def from_order(cls, order, add_cut_lines=True) -> "QRInvoiceFlowable":
+    def from_order(cls, order, add_cut_lines=True, totals=None) -> "QRInvoiceFlowable":
         return cls(
             total=order.cached_sum,
             address=order.addr_billing,
             payment_receiver=order.payment_receiver,
-            billing_information=order.get_qr_billing_information(),
+            billing_information=order.get_qr_billing_information(totals=totals),
             qr_reference_number=order.get_qr_reference_number(),
             unstructured_message=order.get_unstructured_message(),
             add_cut_info=add_cut_lines,
@@ -0,0 +1,378 @@
+"""Optional rendering of PDFs in a bounded pool of worker processes
+
+Rendering a large document with ReportLab blocks a web worker for seconds. If enabled, documents
+are rendered in separate processes with a timeout and a memory limit instead.
+
+File settings:
+- KMUHELPER_PDF_WORKERS: Number of worker processes (default: 0 = render in the current process)
+- KMUHELPER_PDF_WORKER_TIMEOUT: Seconds after which rendering a document is aborted (default: 60)
+  The worker stops by itself on Unix. A process which doesn't is killed KILL_DELAY seconds later,
+  which stops the whole pool; the other documents in it are then rendered again in a new one.
+- KMUHELPER_PDF_WORKER_MEMORY_LIMIT: Maximum memory of a worker process in bytes, Unix only
+  (default: 1 GB, 0 for no limit)
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.utils import translation
+
+from kmuhelper import settings
+from kmuhelper.modules.pdfgeneration.cache import PDFCache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+STATUS_KEY_PREFIX = "kmuhelper-pdf-status-"
+STATUS_PENDING = "pending"
+# The document is too large for the PDF cache (see _keep_result)
+STATUS_TOO_LARGE = "too-large"
+
+# Seconds after the timeout until a worker which did not stop by itself is killed
+KILL_DELAY = 5
+# How often a document is rendered again if its pool was killed because of another document
+RETRIES = 1
+
+_lock = threading.Lock()
+_pool = None
+_task_ids = itertools.count()
+# Documents which are too large for the PDF cache, until they are picked up:
+# { cache key: (time.monotonic() when they expire, content) }
+_results = {}
+_results_lock = threading.Lock()
+
+
+class PDFWorkerError(Exception):
+    """Rendering a document in a worker process failed or took too long"""
+
+
+class _RenderTimeout(Exception):
+    """Raised in the worker process if rendering takes too long"""
+
+
+def is_enabled() -> bool:
+    # Worker processes (including the ones of the batch export) render everything themselves
+    return (
+        settings.get_file_setting("KMUHELPER_PDF_WORKERS", 0) > 0
+        and multiprocessing.parent_process() is None
+    )
+
+
+def _get_timeout() -> float:
+    return settings.get_file_setting("KMUHELPER_PDF_WORKER_TIMEOUT", 60)
+
+
+def _on_alarm(signum, frame):
+    raise _RenderTimeout()
+
+
+def _build(start_file, generator, language, memory_limit, timeout) -> bytes:
+    """Executed in the worker process"""
+
+    # Tells the watchdog which process renders the document and since when
+    try:
+        with open(start_file, "w") as file:
+            file.write(str(os.getpid()))
+    except OSError:  # The pool is being killed
+        pass
+
+    if memory_limit and resource is not None:
+        hard_limit = resource.getrlimit(resource.RLIMIT_AS)[1]
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard_limit))
+
+    # Stop by ourselves if possible (Unix only), which keeps the process usable for the next one
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with translation.override(language):
+            return generator._build_pdf()
+    finally:
+        if hasattr(signal, "SIGALRM"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class _Pool:
+    """Worker processes, which write a file when they start rendering a document"""
+
+    def __init__(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=settings.get_file_setting("KMUHELPER_PDF_WORKERS"),
+            # Forking a (multithreaded) web server process is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
+            # New processes have to set up Django before they can import the generators
+            initializer=django.setup,
+        )
+        self.directory = tempfile.mkdtemp(prefix="kmuhelper-pdf-workers-")
+        self.killed = False
+
+    def _get_start_file(self, task_id) -> str:
+        return os.path.join(self.directory, str(task_id))
+
+    def submit(self, task_id, *args):
+        future = self.executor.submit(_build, self._get_start_file(task_id), *args)
+        future.add_done_callback(lambda f: self._remove_start_file(task_id))
+        return future
+
+    def _remove_start_file(self, task_id):
+        try:
+            os.remove(self._get_start_file(task_id))
+        except FileNotFoundError:
+            pass
+
+    def get_start(self, task_id) -> tuple[int, float] | None:
+        """Get the process rendering the document and the time it started, if it did"""
+
+        path = self._get_start_file(task_id)
+        try:
+            with open(path) as file:
+                return int(file.read()), os.path.getmtime(path)
+        except (OSError, ValueError):  # Not started yet or still being written
+            return None
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def kill(self, pid):
+        """Kill a stuck process, which makes the executor stop all other processes too
+
+        All other documents of the pool fail with BrokenProcessPool and are rendered again."""
+
+        self.killed = True
+        try:
+            os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        except OSError:  # Already gone
+            pass
+        self.executor.shutdown(wait=False)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _get_pool() -> _Pool:
+    global _pool
+
+    with _lock:
+        if _pool is None:
+            _pool = _Pool()
+        return _pool
+
+
+def _discard_pool(pool):
+    """Make sure no more documents are sent to this pool"""
+
+    global _pool
+
+    with _lock:
+        if _pool is pool:
+            _pool = None
+
+
+def shutdown():
+    """Stop the worker processes, e.g. to apply changed settings"""
+
+    global _pool
+
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def _watch(pool, task_id, future, result, timeout, delay):
+    """Kill the process of the document if it is still rendering some time after the timeout
+
+    Normally, the worker stops rendering by itself after the timeout. This is the fallback if it
+    can't, e.g. because it is stuck in C code or on Windows."""
+
+    def check():
+        if future.done() or pool.killed:
+            return
+
+        start = pool.get_start(task_id)
+        if start is None:
+            # Still waiting for a free worker
+            _watch(pool, task_id, future, result, timeout, 1)
+            return
+        remaining = start[1] + timeout + KILL_DELAY - time.time()
+        if remaining > 0:
+            _watch(pool, task_id, future, result, timeout, remaining)
+            return
+
+        result.kmuhelper_timed_out = True
+        logger.error("[KMUHelper PDF generation] Rendering took more than %s seconds!", timeout)
+        _discard_pool(pool)
+        pool.kill(start[0])
+
+    timer = threading.Timer(delay, check)
+    timer.daemon = True
+    timer.start()
+    future.add_done_callback(lambda f: timer.cancel())
+
+
+def _submit(result, args, retries):
+    pool = _get_pool()
+    task_id = next(_task_ids)
+    try:
+        future = pool.submit(task_id, *args)
+    except (BrokenProcessPool, RuntimeError):
+        # Broken or shut down in the meantime
+        _discard_pool(pool)
+        if not retries:
+            raise
+        _submit(result, args, retries - 1)
+        return
+
+    timeout = args[-1]
+    _watch(pool, task_id, future, result, timeout, timeout + KILL_DELAY)
+    future.add_done_callback(lambda f: _set_result(f, pool, result, args, retries))
+
+
+def _set_result(future, pool, result, args, retries):
+    try:
+        content = future.result()
+    except BrokenProcessPool as e:
+        # All processes were stopped, maybe because of another document
+        _discard_pool(pool)
+        if retries and not getattr(result, "kmuhelper_timed_out", False):
+            logger.warning("[KMUHelper PDF generation] Worker stopped, rendering again...")
+            try:
+                _submit(result, args, retries - 1)
+            except Exception as error:
+                result.set_exception(error)
+        else:
+            result.set_exception(e)
+    except _RenderTimeout as e:
+        result.kmuhelper_timed_out = True
+        logger.error("[KMUHelper PDF generation] Rendering took more than %s seconds!", args[-1])
+        result.set_exception(e)
+    except BaseException as e:
+        result.set_exception(e)
+    else:
+        result.set_result(content)
+
+
+def submit(generator):
+    """Render the document in a worker process, returns a future of the content"""
+
+    result = Future()
+    result.set_running_or_notify_cancel()
+    args = (
+        generator,
+        translation.get_language(),
+        settings.get_file_setting("KMUHELPER_PDF_WORKER_MEMORY_LIMIT", 1024**3),
+        _get_timeout(),
+    )
+    _submit(result, args, RETRIES)
+    return result
+
+
+def _get_error_message(future, exception) -> str:
+    if getattr(future, "kmuhelper_timed_out", False) or isinstance(exception, _RenderTimeout):
+        return f"Die Generierung des PDFs hat mehr als {_get_timeout()} Sekunden gedauert."
+    if isinstance(exception, MemoryError):
+        return "Für die Generierung des PDFs wurde zu viel Speicher benötigt."
+    return f"Die Generierung des PDFs ist fehlgeschlagen: {exception!r}"
+
+
+def render(generator) -> bytes:
+    """Render the document in a worker process and wait for it, raises PDFWorkerError on failure"""
+
+    future = submit(generator)
+    try:
+        return future.result()
+    except Exception as e:
+        raise PDFWorkerError(_get_error_message(future, e)) from e
+
+
+def _keep_result(cache_key, content):
+    """Keep a document in the memory of this process until the waiting request picks it up"""
+
+    now = time.monotonic()
+    with _results_lock:
+        for key, (expires_at, _) in list(_results.items()):
+            if expires_at < now:
+                del _results[key]
+        _results[cache_key] = (now + _get_timeout() * 5, content)
+
+
+def _pop_result(cache_key) -> bytes | None:
+    with _results_lock:
+        expires_at, content = _results.pop(cache_key, (0, None))
+    return content if expires_at >= time.monotonic() else None
+
+
+def _store_result(cache_key, future):
+    cache = PDFCache()
+    status_key = STATUS_KEY_PREFIX + cache_key
+
+    try:
+        content = future.result()
+    except Exception as e:
+        logger.error("[KMUHelper PDF generation] Rendering failed!", exc_info=e)
+        cache.cache.set(status_key, _get_error_message(future, e), 60)
+        return
+
+    if cache.set(cache_key, content):
+        cache.cache.delete(status_key)
+    else:
+        _keep_result(cache_key, content)
+        cache.cache.set(status_key, STATUS_TOO_LARGE, _get_timeout() * 5)
+
+
+def get_or_submit(generator, cache_key, wait=1.0) -> bytes | None:
+    """Get the document from the PDF cache or start rendering it in the background
+
+    Returns None while the document is being rendered. The result is stored in the PDF cache,
+    so with a cache shared between processes, any web worker can return it later. Documents too
+    large for the cache are kept in the memory of the rendering process until they are picked up;
+    other processes render them again and wait for them.
+    Raises PDFWorkerError if rendering failed."""
+
+    cache = PDFCache()
+    status_key = STATUS_KEY_PREFIX + cache_key
+
+    content = cache.get(cache_key)
+    if content is None:
+        content = _pop_result(cache_key)
+    if content is not None:
+        return content
+
+    status = cache.cache.get(status_key)
+    if status is None:
+        # Expires in case the process storing the result dies
+        if not cache.cache.add(status_key, STATUS_PENDING, _get_timeout() * 5):
+            # Submitted by another request at the same time
+            return None
+
+        done = threading.Event()
+        future = submit(generator)
+        future.add_done_callback(lambda f: (_store_result(cache_key, f), done.set()))
+        if not done.wait(wait):
+            return None
+
+        content = cache.get(cache_key)
+        if content is None:
+            content = _pop_result(cache_key)
+        status = cache.cache.get(status_key)
+
+    if content is None and status == STATUS_TOO_LARGE:
+        # Rendered in another process, without a way to pass it on
+        return render(generator)
+    if content is None and status not in (None, STATUS_PENDING):
+        cache.cache.delete(status_key)
+        raise PDFWorkerError(status)
+    return content
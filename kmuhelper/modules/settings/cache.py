@@ -0,0 +1,134 @@
+"""Process-local caches, which are cleared in all processes when their version changes"""
+
+import threading
+import time
+import uuid
+
+from django.conf import settings as djangoconfig
+from django.db import connection, transaction
+
+
+class VersionedCache:
+    """Keeps values in the memory of the process as long as the version in the database is the same
+
+    The version is stored in a hidden setting, so that all processes and servers see changes
+    without any shared cache. Each process compares its version with it at most once per interval
+    and drops its values if it has changed.
+
+    The version is changed in the same transaction as the cached data. If the transaction is
+    rolled back, the old version is restored with the data. Until the transaction is committed or
+    rolled back, the current thread reads the values from the database instead of caching them.
+    Without the hidden setting (e.g. before it has been created by the migrations), nothing is
+    cached.
+
+    File settings:
+    - KMUHELPER_SETTINGS_CACHE_INTERVAL: Seconds between version checks (default: 1)
+    """
+
+    def __init__(self, version_setting: str):
+        self.version_setting = version_setting
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self._values = {}
+        # Version written by an uncommitted transaction of the thread
+        self._local = threading.local()
+
+    def _read_version(self) -> str | None:
+        from kmuhelper.modules.settings.models import SettingHidden
+
+        return (
+            SettingHidden.objects.filter(id=self.version_setting)
+            .values_list("content_char", flat=True)
+            .first()
+        )
+
+    def _check_version(self):
+        interval = getattr(djangoconfig, "KMUHELPER_SETTINGS_CACHE_INTERVAL", 1)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+
+        version = self._read_version()
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._values = {}
+            self._checked_at = now
+
+    def _is_paused(self) -> bool:
+        """Whether the thread has changed the version in a transaction which is still open"""
+
+        pending = getattr(self._local, "pending_version", None)
+        if pending is None:
+            return False
+        if connection.in_atomic_block and self._read_version() == pending:
+            return True
+        # Rolled back (otherwise, clear would have been called on commit)
+        self._local.pending_version = None
+        return False
+
+    def get_or_load(self, key, load):
+        """Get the value for the key, load() is called if it isn't cached"""
+
+        if self._is_paused():
+            return load()
+
+        self._check_version()
+        version = self._version
+        if version is None:
+            return load()
+
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+        value = load()
+        with self._lock:
+            # Don't keep values loaded before the version has changed
+            if self._version == version:
+                self._values[key] = value
+        return value
+
+    def discard(self, key, condition=None):
+        """Remove a value from the cache of the current process (if condition(value) is true)"""
+
+        with self._lock:
+            if key in self._values and (condition is None or condition(self._values[key])):
+                del self._values[key]
+
+    def invalidate(self):
+        """Mark the values as changed in all processes (once the transaction is committed)"""
+
+        from kmuhelper.modules.settings.models import SettingHidden
+
+        version = uuid.uuid4().hex
+        SettingHidden.objects.filter(id=self.version_setting).update(content_char=version)
+        if connection.in_atomic_block:
+            self._local.pending_version = version
+        with self._lock:
+            self._version = None
+            self._checked_at = None
+            self._values = {}
+        transaction.on_commit(self.clear)
+
+    def clear(self):
+        """Reset the cache of the current process"""
+
+        self._local.pending_version = None
+        with self._lock:
+            self._version = None
+            self._checked_at = None
+            self._values = {}
+
+
+class SettingsCache(VersionedCache):
+    """Keeps all rows of the settings models in memory, loaded with one query per model"""
+
+    def get(self, model, settingid):
+        """Get the setting object with the given id, or None if it doesn't exist"""
+
+        rows = self.get_or_load(model, lambda: {obj.id: obj for obj in model.objects.all()})
+        return rows.get(settingid)
+
+
+settings_cache = SettingsCache("settings-cache-version")
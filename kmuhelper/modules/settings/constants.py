@@ -97,4 +97,9 @@ SECRET_SETTINGS = {
     "wc-consumer_key": {"typ": "char"},
     "wc-consumer_secret": {"typ": "char"},
     "wc-url": {"typ": "url"},
+    "wc-sync-cursors": {"typ": "json"},
+    # Changed whenever a setting is saved (see kmuhelper.modules.settings.cache)
+    "settings-cache-version": {"typ": "char"},
+    # Changed whenever a payment receiver or contact person is saved (see OrderDefaults)
+    "order-defaults-cache-version": {"typ": "char"},
 }
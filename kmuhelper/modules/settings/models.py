@@ -6,6 +6,7 @@ from django.db import models
 from django.templatetags.static import static
 from django.utils.html import mark_safe, urlize
 from django.utils.translation import gettext_lazy
+from kmuhelper.modules.settings.cache import settings_cache
 from kmuhelper.modules.settings.constants import SETTINGS
 from kmuhelper.overrides import CustomModel
 
@@ -108,6 +109,15 @@ class SettingBase(CustomModel):
         if hasattr(self, f"content_{self.typ}"):
             return setattr(self, f"content_{self.typ}", var)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        settings_cache.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        settings_cache.invalidate()
+        return result
+
     class Meta:
         abstract = True
 
@@ -1,8 +1,11 @@
 """Methods to get settings form different places"""
 
+import copy
+
 from django.conf import settings as djangoconfig
 from django.core.exceptions import ObjectDoesNotExist
 
+from kmuhelper.modules.settings.cache import settings_cache
 from kmuhelper.modules.settings.models import Setting, SettingHidden
 from kmuhelper.modules.settings.constants import SETTINGS, SECRET_SETTINGS
 
@@ -29,24 +32,24 @@ def has_file_setting(name):
 
 
 def get_db_setting(settingid, default=None):
-    """Get a setting from the 'Setting' model"""
+    """Get a setting from the 'Setting' model (cached)"""
 
-    try:
-        setting = Setting.objects.get(id=settingid)
-        if setting.typ in ["char", "text"] and setting.content == "":
-            return default
-        return setting.content
-    except ObjectDoesNotExist:
+    setting = settings_cache.get(Setting, settingid)
+    if setting is None:
         return default
+    if setting.typ in ["char", "text"] and setting.content == "":
+        return default
+    # The cached object is shared, so mutable content must not be modified by the caller
+    return copy.deepcopy(setting.content) if setting.typ == "json" else setting.content
 
 
 def get_secret_db_setting(settingid, default=None):
-    """Get a setting from the 'SettingHidden' model"""
+    """Get a setting from the 'SettingHidden' model (cached)"""
 
-    try:
-        return SettingHidden.objects.get(id=settingid).content
-    except ObjectDoesNotExist:
+    setting = settings_cache.get(SettingHidden, settingid)
+    if setting is None:
         return default
+    return copy.deepcopy(setting.content) if setting.typ == "json" else setting.content
 
 
 # Set db
@@ -102,7 +102,7 @@ class CustomModelAdmin(admin.ModelAdmin):
         if "wc_update" in actions:
             from kmuhelper.modules.integrations.woocommerce.utils import is_connected
 
-            if not is_connected():
+            if not is_connected(request):
                 del actions["wc_update"]
         return actions
 
@@ -14,9 +14,9 @@ register = template.Library()
 ##########
 
 
-@register.simple_tag(name="kmuhelper_woocommerce_connected")
-def kmuhelper_woocommerce_connected():
-    return is_woocommerce_connected()
+@register.simple_tag(name="kmuhelper_woocommerce_connected", takes_context=True)
+def kmuhelper_woocommerce_connected(context):
+    return is_woocommerce_connected(context.get("request"))
 
 
 @register.simple_tag(name="kmuhelper_has_module_permission", takes_context=True)
@@ -2,7 +2,11 @@
 Tests for the order model and corresponding orderitem and orderfee models
 """
 
-from django.test import TestCase
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
 
 from kmuhelper.constants import VAT_RATE_DEFAULT
 from kmuhelper.modules.main.models import (
@@ -11,7 +15,9 @@ from kmuhelper.modules.main.models import (
     OrderFee,
     ContactPerson,
     PaymentReceiver,
+    Product,
 )
+from kmuhelper.modules.main.utils import OrderDefaults, OrderSumUtils
 from kmuhelper.utils import runden
 
 
@@ -73,6 +79,173 @@ class OrderTest(TestCase):
 
         self.assertEqual(total_expected, total_calculated)
 
+    def test_order_totals__breakdown(self):
+        obj = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+
+        obj.products.through.objects.bulk_create(
+            [
+                OrderItem(product_price=10.5, quantity=1, vat_rate=8.1, order=obj),
+                OrderItem(product_price=5.05, quantity=2, discount=10, vat_rate=2.6, order=obj),
+            ]
+        )
+
+        obj.fees.through.objects.bulk_create(
+            [
+                OrderFee(price=9.95, vat_rate=8.1, order=obj),
+            ]
+        )
+
+        with self.assertNumQueries(2):
+            totals = obj.get_totals()
+
+        self.assertEqual(len(totals.items), 2)
+        self.assertEqual(len(totals.fees), 1)
+        self.assertEqual(
+            totals.vat_dict, {"8.1": runden(10.5 + 9.95), "2.6": runden(5.05 * 2 * 0.9)}
+        )
+        self.assertEqual(list(totals.vat_dict), ["8.1", "2.6"])
+        self.assertEqual(totals.discount, -runden(5.05 * 2 * 0.1))
+        self.assertEqual(totals.total_without_vat, obj.calc_total_without_vat())
+        self.assertEqual(totals.total_vat, obj.calc_total_vat())
+        self.assertEqual(totals.total, obj.calc_total())
+        self.assertEqual(totals.total, runden(totals.total_without_vat + totals.total_vat))
+
+    def test_order_totals__empty(self):
+        obj = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+
+        totals = obj.get_totals()
+
+        self.assertEqual(totals.vat_dict, {})
+        self.assertEqual(totals.total, 0)
+
+    # Cached sum recalculation
+
+    def _create_order_with_lines(self):
+        obj = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+        obj.products.through.objects.bulk_create(
+            [
+                OrderItem(product_price=10.5, quantity=3, vat_rate=8.1, order=obj),
+                OrderItem(product_price=5.05, quantity=2, discount=15, vat_rate=2.6, order=obj),
+            ]
+        )
+        obj.fees.through.objects.bulk_create(
+            [
+                OrderFee(price=9.95, vat_rate=8.1, order=obj),
+                OrderFee(price=-3.3, vat_rate=0.0, order=obj),
+            ]
+        )
+        return obj
+
+    def test_order_sum_utils__vat_dicts(self):
+        orders = [self._create_order_with_lines() for _ in range(3)]
+        empty = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+
+        with self.assertNumQueries(2):
+            vat_dicts = OrderSumUtils.get_vat_dicts([o.pk for o in orders] + [empty.pk])
+
+        for order in orders:
+            self.assertEqual(vat_dicts[order.pk], order.get_vat_dict())
+        self.assertEqual(vat_dicts[empty.pk], {})
+
+    def test_order_sum_utils__halves(self):
+        obj = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+        # Subtotals which are exact halves of 0.05 are rounded to even like in runden()
+        obj.products.through.objects.bulk_create(
+            [
+                OrderItem(product_price=0.125, quantity=1, vat_rate=8.1, order=obj),
+                OrderItem(product_price=0.225, quantity=1, vat_rate=2.6, order=obj),
+                OrderItem(product_price=0.375, quantity=1, vat_rate=2.6, order=obj),
+            ]
+        )
+        obj.fees.through.objects.bulk_create([OrderFee(price=10.125, vat_rate=0.0, order=obj)])
+
+        self.assertEqual(OrderSumUtils.get_vat_dicts([obj.pk])[obj.pk], obj.get_vat_dict())
+        Order.objects.filter(pk=obj.pk).update(cached_sum=obj.calc_total())
+        results = list(OrderSumUtils.iter_recalculate(Order.objects.filter(pk=obj.pk)))
+        self.assertEqual(results[0].drifts, ())
+
+    def test_order_sum_utils__recalculate(self):
+        orders = [self._create_order_with_lines() for _ in range(5)]
+        Order.objects.filter(pk=orders[0].pk).update(cached_sum=orders[0].calc_total())
+        Order.objects.filter(pk=orders[3].pk).update(cached_sum=orders[3].calc_total())
+
+        results = list(
+            OrderSumUtils.iter_recalculate(Order.objects.all(), chunk_size=2, save=False)
+        )
+        self.assertEqual([r.checked for r in results], [2, 2, 1])
+        self.assertEqual(
+            [d.order_id for r in results for d in r.drifts],
+            [orders[1].pk, orders[2].pk, orders[4].pk],
+        )
+
+        resumed = list(
+            OrderSumUtils.iter_recalculate(Order.objects.all(), start_after=results[0].last_id)
+        )
+        self.assertEqual(sum(r.checked for r in resumed), 3)
+        for order in orders:
+            order.refresh_from_db()
+            if order.pk == orders[1].pk:
+                self.assertEqual(order.cached_sum, 0)
+            else:
+                self.assertEqual(order.cached_sum, order.calc_total())
+
+    def test_order_sum_utils__command(self):
+        orders = [self._create_order_with_lines() for _ in range(2)]
+
+        out = StringIO()
+        call_command("kmuhelper-recalculate-order-sums", "--check", stdout=out)
+        self.assertIn("2 orders checked, 2 differing sums found", out.getvalue())
+        self.assertEqual(Order.objects.get(pk=orders[0].pk).cached_sum, 0)
+
+        call_command("kmuhelper-recalculate-order-sums", stdout=StringIO())
+        for order in orders:
+            order.refresh_from_db()
+            self.assertEqual(order.cached_sum, order.calc_total())
+
+    # Bulk creation of lines
+
+    def test_bulk_create_lines(self):
+        product = Product.objects.create(
+            article_number="A-1", name="Produkt", selling_price=4.5, vat_rate=2.6
+        )
+        order = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+        )
+
+        items = [OrderItem(linked_product=product, quantity=2) for _ in range(50)]
+        items.append(OrderItem(name="Ohne Produkt", product_price=10, quantity=1, vat_rate=8.1))
+        fees = [OrderFee(name="Versand", price=9.5, vat_rate=8.1)]
+
+        # 2 INSERTs and 1 UPDATE of the stock counters, plus 2 savepoints with their releases
+        with self.assertNumQueries(7):
+            totals = order.bulk_create_lines(items, fees)
+
+        self.assertEqual(order.products.through.objects.filter(order=order).count(), 51)
+        item = order.products.through.objects.filter(order=order).first()
+        self.assertEqual(
+            (item.article_number, item.product_price, item.vat_rate), ("A-1", 4.5, 2.6)
+        )
+        self.assertEqual(totals, order.get_totals())
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_reserved, 100)
+
     # Order item discount
 
     def test_order_item__discount(self):
@@ -82,3 +255,65 @@ class OrderTest(TestCase):
         price_calculated = item.calc_subtotal()
 
         self.assertEqual(price_expected, price_calculated)
+
+
+# The version of the cache is only checked once, so that the number of queries doesn't vary
+@override_settings(KMUHELPER_SETTINGS_CACHE_INTERVAL=60)
+class OrderDefaultsTest(TestCase):
+    def setUp(self):
+        OrderDefaults.cache.clear()
+        self.addCleanup(OrderDefaults.cache.clear)
+
+        self.contact_person = ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        self.payment_receiver = PaymentReceiver.objects.create()
+        # Creating them inside the test transaction pauses the cache until it is committed
+        OrderDefaults.cache.clear()
+
+    def test_defaults_are_cached(self):
+        self.assertEqual(Order().payment_receiver_id, self.payment_receiver.pk)
+        self.assertEqual(Order().contact_person_id, self.contact_person.pk)
+
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                Order()
+
+    def test_default_change_invalidates(self):
+        Order.objects.create()
+
+        other = ContactPerson.objects.create(name="Y Y", phone="y", email="y@y", is_default=True)
+        self.assertEqual(Order().contact_person_id, other.pk)
+
+    def test_fallback_most_recent_order(self):
+        other = PaymentReceiver.objects.create()
+        OrderDefaults.cache.clear()
+
+        self.assertEqual(Order().payment_receiver_id, self.payment_receiver.pk)
+        Order.objects.create(payment_receiver=other)
+        self.assertEqual(Order().payment_receiver_id, other.pk)
+
+    def test_orders_keep_marked_defaults(self):
+        self.payment_receiver.is_default = True
+        self.payment_receiver.save()
+        OrderDefaults.cache.clear()
+
+        Order.objects.create()
+        with self.assertNumQueries(0):
+            self.assertEqual(OrderDefaults.get("payment_receiver"), self.payment_receiver.pk)
+        # The contact person is taken from the most recent order, so it is resolved again
+        with self.assertNumQueries(3):
+            self.assertEqual(OrderDefaults.get("contact_person"), self.contact_person.pk)
+
+    def test_rollback(self):
+        Order()
+
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            other = ContactPerson.objects.create(
+                name="Y Y", phone="y", email="y@y", is_default=True
+            )
+            self.assertEqual(Order().contact_person_id, other.pk)
+            1 / 0
+
+        self.assertEqual(Order().contact_person_id, self.contact_person.pk)
+        # Cached again after the rollback
+        with self.assertNumQueries(0):
+            self.assertEqual(Order().contact_person_id, self.contact_person.pk)
@@ -0,0 +1,248 @@
+"""
+Tests for the stock changes caused by orders and supplies
+"""
+
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from kmuhelper.modules.main.models import (
+    Order,
+    OrderItem,
+    ContactPerson,
+    PaymentReceiver,
+    Product,
+    StockMovement,
+    StockSnapshot,
+    Supply,
+    SupplyItem,
+)
+from kmuhelper.modules.main.utils import StockUtils
+
+
+class StockTest(TestCase):
+    def setUp(self):
+        self.contact_person = ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        self.payment_receiver = PaymentReceiver.objects.create()
+        self.product_a = Product.objects.create(name="A", stock_current=10)
+        self.product_b = Product.objects.create(name="B", stock_current=5)
+
+    def _create_order(self, **kwargs):
+        order = Order.objects.create(
+            contact_person=self.contact_person,
+            payment_receiver=self.payment_receiver,
+            **kwargs,
+        )
+        for product, quantity in [
+            (self.product_a, 2),
+            (self.product_a, 1),
+            (self.product_b, 3),
+            (None, 7),
+        ]:
+            OrderItem.objects.create(linked_product=product, quantity=quantity, order=order)
+        return order
+
+    def _assert_counters(self, counters_a, counters_b):
+        """Counters as (reserved, incoming)"""
+        for product, counters in [(self.product_a, counters_a), (self.product_b, counters_b)]:
+            product.refresh_from_db()
+            self.assertEqual((product.stock_reserved, product.stock_incoming), counters)
+
+    def _assert_stock(self, stock_a, stock_b):
+        self.product_a.refresh_from_db()
+        self.product_b.refresh_from_db()
+        self.assertEqual(self.product_a.stock_current, stock_a)
+        self.assertEqual(self.product_b.stock_current, stock_b)
+
+    def test_order_not_shipped(self):
+        order = self._create_order()
+        order.second_save()
+
+        self.assertFalse(Order.objects.get(pk=order.pk).is_removed_from_stock)
+        self._assert_stock(10, 5)
+
+    def test_order_shipped(self):
+        order = self._create_order(is_shipped=True)
+        order.second_save()
+
+        self.assertTrue(Order.objects.get(pk=order.pk).is_removed_from_stock)
+        self._assert_stock(7, 2)
+
+        # Saving again must not remove the products from the stock again
+        order.second_save()
+        self._assert_stock(7, 2)
+
+    def test_order_shipped_concurrently(self):
+        order = self._create_order(is_shipped=True)
+        stale_copy = Order.objects.get(pk=order.pk)
+
+        order.second_save()
+        stale_copy.second_save()
+
+        self._assert_stock(7, 2)
+
+    def test_supply_add_to_stock(self):
+        supply = Supply.objects.create(name="Supply")
+        SupplyItem.objects.bulk_create(
+            [
+                SupplyItem(supply=supply, product=self.product_a, quantity=4),
+                SupplyItem(supply=supply, product=self.product_b, quantity=4),
+            ]
+        )
+        stale_copy = Supply.objects.get(pk=supply.pk)
+
+        self.assertTrue(supply.add_to_stock())
+        self.assertFalse(supply.add_to_stock())
+        self.assertFalse(stale_copy.add_to_stock())
+
+        self.assertTrue(Supply.objects.get(pk=supply.pk).is_added_to_stock)
+        self._assert_stock(14, 9)
+
+    # Ledger
+
+    def test_ledger_movements(self):
+        order = self._create_order(is_shipped=True)
+        order.second_save()
+        StockUtils.set_stock({self.product_a.pk: 0, self.product_b.pk: 2}, "reset")
+
+        self._assert_stock(0, 2)
+        self.assertEqual(
+            list(
+                StockMovement.objects.order_by("pk").values_list(
+                    "product_id", "difference", "reason", "linked_order_id"
+                )
+            ),
+            [
+                (self.product_a.pk, -3, "order", order.pk),
+                (self.product_b.pk, -3, "order", order.pk),
+                (self.product_a.pk, -7, "reset", None),
+            ],
+        )
+
+    def test_ledger_stock_at(self):
+        start = timezone.now()
+        StockUtils.apply_stock_changes({self.product_a.pk: 5}, "manual")
+        StockMovement.objects.update(date=start + timedelta(days=1))
+
+        # Without snapshots, the stock is calculated back from the current stock
+        stock = StockUtils.get_stock_at([self.product_a.pk, self.product_b.pk], start)
+        self.assertEqual(stock, {self.product_a.pk: 10, self.product_b.pk: 5})
+
+        out = StringIO()
+        call_command("kmuhelper-stock-snapshot", stdout=out)
+        self.assertIn("2 products", out.getvalue())
+        StockSnapshot.objects.update(date=start + timedelta(days=2))
+
+        StockUtils.apply_stock_changes({self.product_a.pk: -4, self.product_b.pk: 1}, "manual")
+        StockMovement.objects.exclude(date=start + timedelta(days=1)).update(
+            date=start + timedelta(days=3)
+        )
+
+        for days, expected in [(0, (10, 5)), (1, (15, 5)), (2, (15, 5)), (3, (11, 6))]:
+            stock = StockUtils.get_stock_at(
+                [self.product_a.pk, self.product_b.pk], start + timedelta(days=days)
+            )
+            self.assertEqual(stock, dict(zip([self.product_a.pk, self.product_b.pk], expected)))
+
+    def test_ledger_velocity(self):
+        for _ in range(2):
+            order = self._create_order(is_shipped=True)
+            order.second_save()
+
+        velocity = StockUtils.get_stock_velocity([self.product_a.pk, self.product_b.pk], days=3)
+        self.assertEqual(velocity, {self.product_a.pk: 2.0, self.product_b.pk: 2.0})
+
+    # Counters
+
+    def test_counters_order(self):
+        order = self._create_order()
+        self._assert_counters((3, 0), (3, 0))
+
+        item = OrderItem.objects.get(order=order, linked_product=self.product_b)
+        item.quantity = 5
+        item.save()
+        self._assert_counters((3, 0), (5, 0))
+
+        item.linked_product = self.product_a
+        item.save()
+        self._assert_counters((8, 0), (0, 0))
+
+        item.delete()
+        self._assert_counters((3, 0), (0, 0))
+
+        order.is_shipped = True
+        order.second_save()
+        self._assert_counters((0, 0), (0, 0))
+
+        # Items of shipped orders don't reserve anything
+        OrderItem.objects.create(linked_product=self.product_b, quantity=1, order=order)
+        self._assert_counters((0, 0), (0, 0))
+
+        self._create_order().delete()
+        self._assert_counters((0, 0), (0, 0))
+
+    def test_counters_not_overwritten_by_stale_product(self):
+        # Loaded by the admin change form before the order was changed
+        product = Product.objects.get(pk=self.product_a.pk)
+        self._create_order()
+
+        product.name = "Changed"
+        request = RequestFactory().post("/")
+        request.user = User.objects.create_superuser("admin")
+        request._messages = CookieStorage(request)
+        admin.site._registry[Product].save_model(
+            request, product, SimpleNamespace(changed_data=["name"]), change=True
+        )
+        self.assertEqual((product.stock_reserved, product.stock_incoming), (3, 0))
+        self._assert_counters((3, 0), (3, 0))
+
+        # Also when saved outside of the admin
+        stale = Product.objects.get(pk=self.product_b.pk)
+        OrderItem.objects.get(linked_product=self.product_b).delete()
+        stale.save()
+        self._assert_counters((3, 0), (0, 0))
+        self.assertEqual(Product.objects.get(pk=self.product_a.pk).name, "Changed")
+
+    def test_counters_supply(self):
+        supply = Supply.objects.create(name="Supply")
+        item = SupplyItem.objects.create(supply=supply, product=self.product_a, quantity=4)
+        SupplyItem.objects.create(supply=supply, product=self.product_b, quantity=2)
+        self._assert_counters((0, 4), (0, 2))
+
+        item.quantity = 6
+        item.save()
+        self._assert_counters((0, 6), (0, 2))
+
+        supply.add_to_stock()
+        self._assert_counters((0, 0), (0, 0))
+        self._assert_stock(16, 7)
+
+        other = Supply.objects.create(name="Other")
+        SupplyItem.objects.create(supply=other, product=self.product_a, quantity=1)
+        self._assert_counters((0, 1), (0, 0))
+        other.delete()
+        self._assert_counters((0, 0), (0, 0))
+
+    def test_counters_stock_data_and_rebuild(self):
+        self._create_order()
+        supply = Supply.objects.create(name="Supply")
+        SupplyItem.objects.create(supply=supply, product=self.product_a, quantity=4)
+
+        Product.objects.update(stock_reserved=100, stock_incoming=100)
+        out = StringIO()
+        call_command("kmuhelper-rebuild-stock-counters", stdout=out)
+        self.assertIn("2 products", out.getvalue())
+        self._assert_counters((3, 4), (3, 0))
+
+        with self.assertNumQueries(1):
+            stock_data = StockUtils.get_stock_data([self.product_a.pk, self.product_b.pk])
+        stock = {dat.product.id: dat.stock for dat in stock_data}
+        self.assertEqual((stock[self.product_a.pk].going, stock[self.product_a.pk].coming), (3, 4))
+        self.assertEqual((stock[self.product_b.pk].going, stock[self.product_b.pk].coming), (3, 0))
@@ -0,0 +1,178 @@
+"""
+Benchmarks for the PDF generation with large synthetic orders
+
+Not part of the normal test run, as rendering the large orders takes a while. Run with:
+
+    python -m django test kmuhelper_tests.t_modules.benchmark_pdfgeneration
+        (with DJANGO_SETTINGS_MODULE=kmuhelper_tests.settings)
+
+Measurements without a baseline are saved as new baselines (JSON, not committed as they depend on
+the machine). Later runs fail if the wall time or peak memory exceed a baseline by more than the
+threshold or if more SQL queries are made.
+
+Environment variables:
+- KMUHELPER_BENCHMARK_BASELINES: Path of the baselines file (default: next to this file)
+- KMUHELPER_BENCHMARK_THRESHOLD: Allowed factor for time and memory (default: 1.3)
+- KMUHELPER_BENCHMARK_UPDATE: Set to 1 to save the current measurements as new baselines
+"""
+
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from reportlab.pdfgen.canvas import Canvas
+
+from kmuhelper.modules.main.models import ContactPerson, PaymentReceiver, Order, OrderItem
+from kmuhelper.modules.pdfgeneration import PDFOrder
+from kmuhelper.modules.pdfgeneration.order.generator import _PDFOrderPriceTable
+from kmuhelper.modules.pdfgeneration.swiss_qr_invoice import QRInvoiceFlowable
+
+SIZES = [10, 100, 1000, 5000]
+VAT_RATES = [8.1, 2.6, 3.8, 0.0]
+
+BASELINES_PATH = Path(
+    os.environ.get(
+        "KMUHELPER_BENCHMARK_BASELINES",
+        Path(__file__).with_name("benchmark_pdfgeneration.json"),
+    )
+)
+THRESHOLD = float(os.environ.get("KMUHELPER_BENCHMARK_THRESHOLD", "1.3"))
+UPDATE = os.environ.get("KMUHELPER_BENCHMARK_UPDATE") == "1"
+
+# Differences below these are considered noise
+MIN_TIME_DIFFERENCE = 0.05  # seconds
+MIN_MEMORY_DIFFERENCE = 1024**2  # bytes
+
+
+def _draw_qr_invoice(order):
+    flowable = QRInvoiceFlowable.from_order(order)
+    flowable.drawOn(Canvas(BytesIO()), 0, 0)
+
+
+OPERATIONS = {
+    "pdforder": lambda order: PDFOrder(order, "Rechnung").get_pdf(),
+    "price_table": lambda order: _PDFOrderPriceTable.from_order(order, lang="de"),
+    "qr_invoice": _draw_qr_invoice,
+}
+
+
+@override_settings(KMUHELPER_PDF_CACHE_MAX_SIZE=0, KMUHELPER_PDF_WORKERS=0)
+class PDFGenerationBenchmark(TestCase):
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        contact_person = ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        payment_receiver = PaymentReceiver.objects.create()
+
+        cls.order_ids = {}
+        for size in SIZES:
+            order = Order.objects.create(
+                contact_person=contact_person,
+                payment_receiver=payment_receiver,
+                payment_purpose="Benchmark",
+                invoice_date=datetime.date(2026, 1, 1),
+            )
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=order,
+                        article_number=f"ART-{i}",
+                        name=f"Produkt {i}",
+                        quantity=i % 7 + 1,
+                        product_price=round(1 + i * 0.37, 2),
+                        vat_rate=VAT_RATES[i % len(VAT_RATES)],
+                        discount=10 if i % 3 == 0 else 0,
+                        note=f"Bemerkung zu Produkt {i}" if i % 5 == 0 else "",
+                    )
+                    for i in range(size)
+                ]
+            )
+            order.fees.through.objects.bulk_create(
+                [
+                    order.fees.through(order=order, name="Versand", price=9.5, vat_rate=8.1),
+                    order.fees.through(order=order, name="Rabatt", price=-5, vat_rate=2.6),
+                ]
+            )
+            cls.order_ids[size] = order.pk
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+        for name, result in cls.results.items():
+            print(
+                f"{name:>20}: {result['time']:8.3f} s, {result['memory'] / 1024**2:8.2f} MB, "
+                f"{result['queries']:3d} queries",
+                file=sys.stderr,
+            )
+
+        baselines = cls._load_baselines()
+        if UPDATE or not cls.results.keys() <= baselines.keys():
+            BASELINES_PATH.write_text(json.dumps({**baselines, **cls.results}, indent=2) + "\n")
+            print(f"Saved baselines to {BASELINES_PATH}", file=sys.stderr)
+
+    @staticmethod
+    def _load_baselines() -> dict:
+        if BASELINES_PATH.exists():
+            return json.loads(BASELINES_PATH.read_text())
+        return {}
+
+    def _measure(self, operation, size) -> dict:
+        """Run the operation on a freshly loaded order and measure it"""
+
+        def run():
+            operation(Order.objects.get(pk=self.order_ids[size]))
+
+        # Best of a few runs, as the first one includes e.g. loading fonts
+        times = []
+        for _ in range(1 if size >= 1000 else 3):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        with CaptureQueriesContext(connection) as queries:
+            tracemalloc.start()
+            try:
+                run()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        return {"time": min(times), "memory": peak_memory, "queries": len(queries)}
+
+    def _check(self, result, baseline):
+        self.assertLessEqual(result["queries"], baseline["queries"], "SQL queries regressed")
+        for key, min_difference in [
+            ("time", MIN_TIME_DIFFERENCE),
+            ("memory", MIN_MEMORY_DIFFERENCE),
+        ]:
+            limit = max(baseline[key] * THRESHOLD, baseline[key] + min_difference)
+            self.assertLessEqual(result[key], limit, f"{key} regressed (baseline: {baseline[key]})")
+
+    def _benchmark(self, operation_name):
+        baselines = self._load_baselines()
+        for size in SIZES:
+            name = f"{operation_name}-{size}"
+            with self.subTest(name):
+                result = self._measure(OPERATIONS[operation_name], size)
+                self.results[name] = result
+                if name in baselines and not UPDATE:
+                    self._check(result, baselines[name])
+
+    def test_pdforder(self):
+        self._benchmark("pdforder")
+
+    def test_price_table(self):
+        self._benchmark("price_table")
+
+    def test_qr_invoice(self):
+        self._benchmark("qr_invoice")
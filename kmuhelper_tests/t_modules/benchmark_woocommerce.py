@@ -0,0 +1,190 @@
+"""
+Benchmarks for the WooCommerce sync against a local stand-in of the REST API (fake_woocommerce)
+
+Not part of the normal test run, as the sync of the generated shop takes a while. Run with:
+
+    python -m django test kmuhelper_tests.t_modules.benchmark_woocommerce
+        (with DJANGO_SETTINGS_MODULE=kmuhelper_tests.settings)
+
+Every step of the sync (categories, products with variations, customers, orders, resync without
+changes and bulk update) reports its throughput (objects per second) as well as the HTTP requests
+and SQL queries per object. Measurements without a baseline are saved as new baselines (JSON, not
+committed as they depend on the machine). Later runs fail if the throughput falls below a
+baseline by more than the threshold or if more HTTP requests or SQL queries are made.
+
+Environment variables:
+- KMUHELPER_BENCHMARK_BASELINES: Path of the baselines file (default: next to this file)
+- KMUHELPER_BENCHMARK_THRESHOLD: Allowed factor for the throughput (default: 1.3)
+- KMUHELPER_BENCHMARK_UPDATE: Set to 1 to save the current measurements as new baselines
+- KMUHELPER_BENCHMARK_WC_LATENCY: Simulated latency of the shop in seconds (default: 0.005)
+- KMUHELPER_BENCHMARK_WC_ERROR_RATE: Share of failing requests (default: 0, as the retries
+  make the number of requests vary)
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from kmuhelper.modules.integrations.woocommerce.api import (
+    WCCustomersAPI,
+    WCOrdersAPI,
+    WCProductCategoriesAPI,
+    WCProductsAPI,
+)
+from kmuhelper.modules.integrations.woocommerce.api._transport import (
+    WCSessionAPI,
+    close_session,
+)
+from kmuhelper.modules.main.models import ContactPerson, PaymentReceiver, Product
+from kmuhelper.modules.main.utils import OrderDefaults
+from kmuhelper_tests.t_modules.fake_woocommerce import FakeWooCommerceData, FakeWooCommerceServer
+
+SIZES = {
+    "categories": 50,
+    "products": 500,
+    "variations_per_product": 4,
+    "customers": 200,
+    "orders": 200,
+}
+
+BASELINES_PATH = Path(
+    os.environ.get(
+        "KMUHELPER_BENCHMARK_BASELINES",
+        Path(__file__).with_name("benchmark_woocommerce.json"),
+    )
+)
+THRESHOLD = float(os.environ.get("KMUHELPER_BENCHMARK_THRESHOLD", "1.3"))
+UPDATE = os.environ.get("KMUHELPER_BENCHMARK_UPDATE") == "1"
+LATENCY = float(os.environ.get("KMUHELPER_BENCHMARK_WC_LATENCY", "0.005"))
+ERROR_RATE = float(os.environ.get("KMUHELPER_BENCHMARK_WC_ERROR_RATE", "0"))
+
+# Differences below this are considered noise (a single run over HTTP varies more than rendering)
+MIN_TIME_DIFFERENCE = 0.25  # seconds
+
+
+@override_settings(KMUHELPER_WC_RETRY_BACKOFF=0)
+class WooCommerceSyncBenchmark(TestCase):
+    results = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.data = FakeWooCommerceData.generate(**SIZES)
+        cls.server = FakeWooCommerceServer(cls.data, latency=LATENCY, error_rate=ERROR_RATE)
+        cls.server.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        super().tearDownClass()
+
+        for name, result in cls.results.items():
+            print(
+                f"{name:>20}: {result['objects']:5d} objects, {result['time']:7.3f} s, "
+                f"{result['objects'] / result['time']:8.1f} objects/s, "
+                f"{result['requests'] / result['objects']:6.3f} requests/object, "
+                f"{result['queries'] / result['objects']:6.2f} queries/object",
+                file=sys.stderr,
+            )
+
+        baselines = cls._load_baselines()
+        if UPDATE or not cls.results.keys() <= baselines.keys():
+            BASELINES_PATH.write_text(json.dumps({**baselines, **cls.results}, indent=2) + "\n")
+            print(f"Saved baselines to {BASELINES_PATH}", file=sys.stderr)
+
+    def setUp(self):
+        # The session is created with the current retry settings
+        close_session()
+        self.addCleanup(close_session)
+        self.wcapi = WCSessionAPI(self.server.url, "ck_benchmark", "cs_benchmark")
+
+    @staticmethod
+    def _load_baselines() -> dict:
+        if BASELINES_PATH.exists():
+            return json.loads(BASELINES_PATH.read_text())
+        return {}
+
+    def _measure(self, name, operation, objects: int):
+        """Run the operation once, measure it and compare it with the baseline"""
+
+        requests_before = self.server.request_count
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            operation()
+            duration = time.perf_counter() - start
+
+        result = {
+            "objects": objects,
+            "time": duration,
+            "requests": self.server.request_count - requests_before,
+            "queries": len(queries),
+        }
+        self.results[name] = result
+
+        baseline = self._load_baselines().get(name)
+        if baseline is not None and not UPDATE:
+            with self.subTest(name):
+                self._check(result, baseline)
+
+    def _check(self, result, baseline):
+        self.assertEqual(result["objects"], baseline["objects"], "Different data, update baselines")
+        self.assertLessEqual(result["requests"], baseline["requests"], "HTTP requests regressed")
+        self.assertLessEqual(result["queries"], baseline["queries"], "SQL queries regressed")
+        limit = max(baseline["time"] * THRESHOLD, baseline["time"] + MIN_TIME_DIFFERENCE)
+        self.assertLessEqual(
+            result["time"], limit, f"time regressed (baseline: {baseline['time']})"
+        )
+
+    def test_sync(self):
+        data = self.data
+        products = len(data.products) + len(data.all_variations)
+
+        self._measure(
+            "categories",
+            lambda: WCProductCategoriesAPI(self.wcapi).import_all_objects_from_api(),
+            len(data.categories),
+        )
+        self._measure(
+            "products",
+            lambda: WCProductsAPI(self.wcapi).sync_objects_from_api(),
+            products,
+        )
+        self.assertEqual(Product.objects.count(), products)
+
+        self._measure(
+            "customers",
+            lambda: WCCustomersAPI(self.wcapi).sync_objects_from_api(),
+            len(data.customers),
+        )
+
+        ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        PaymentReceiver.objects.create()
+        # Creating them inside the test transaction pauses the cache of the defaults
+        OrderDefaults.cache.clear()
+        self._measure(
+            "orders",
+            lambda: WCOrdersAPI(self.wcapi).sync_objects_from_api(),
+            len(data.orders),
+        )
+
+        # Nothing changed in the shop since the first sync
+        self._measure(
+            "products_resync",
+            lambda: self.assertEqual(
+                WCProductsAPI(self.wcapi).sync_objects_from_api(full=True), (0, 0)
+            ),
+            len(data.products),
+        )
+        self._measure(
+            "products_update",
+            lambda: WCProductsAPI(self.wcapi).bulk_update_objects_from_api(
+                Product.objects.filter(parent=None)
+            ),
+            len(data.products),
+        )
@@ -0,0 +1,343 @@
+"""
+Local stand-in for the WooCommerce REST API (wc/v3) serving generated data over HTTP
+
+Used by the WooCommerce benchmark and tests to measure and check the sync without a real shop:
+
+    data = FakeWooCommerceData.generate(products=100, variations_per_product=5, orders=50)
+    with FakeWooCommerceServer(data, latency=0.01, error_rate=0.05) as server:
+        wcapi = WCSessionAPI(server.url, "ck_fake", "cs_fake")
+
+Supported endpoints: products, products/<id>, products/<id>/variations, products/categories,
+customers, customers/<id>, orders and orders/<id> with the list parameters page, per_page,
+include, exclude, modified_after, orderby and order. Lists have the headers X-WP-Total and
+X-WP-TotalPages. Authentication is not checked.
+"""
+
+import datetime
+import http.server
+import json
+import math
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+START = datetime.datetime(2026, 1, 1)
+
+# Error codes of WooCommerce for objects which don't exist
+INVALID_ID_CODES = {
+    "products": "woocommerce_rest_product_invalid_id",
+    "customers": "woocommerce_rest_invalid_id",
+    "orders": "woocommerce_rest_shop_order_invalid_id",
+}
+
+
+def _modified(i: int) -> str:
+    return (START + datetime.timedelta(seconds=i)).isoformat()
+
+
+def _address(i: int) -> dict:
+    return {
+        "first_name": f"Vorname {i}",
+        "last_name": f"Nachname {i}",
+        "company": "",
+        "address_1": f"Strasse {i}",
+        "address_2": "",
+        "city": "Bern",
+        "state": "BE",
+        "postcode": "3000",
+        "country": "CH",
+        "email": f"kunde{i}@example.com",
+        "phone": "",
+    }
+
+
+class FakeWooCommerceData:
+    """Objects served by the fake server, by endpoint"""
+
+    def __init__(self):
+        self.categories = []
+        self.products = []
+        self.variations = {}  # by parent id
+        self.customers = []
+        self.orders = []
+
+    @property
+    def all_variations(self) -> list[dict]:
+        return [v for variations in self.variations.values() for v in variations]
+
+    @classmethod
+    def generate(
+        cls,
+        categories: int = 20,
+        products: int = 100,
+        variations_per_product: int = 0,
+        customers: int = 50,
+        orders: int = 50,
+        items_per_order: int = 3,
+    ) -> "FakeWooCommerceData":
+        """Generate deterministic data (every fourth product is variable if there are variations)"""
+
+        data = cls()
+        next_id = iter(range(1, 10**9))
+
+        for i in range(categories):
+            parent = data.categories[(i - 1) // 2]["id"] if i else 0
+            data.categories.append(
+                {
+                    "id": next(next_id),
+                    "name": f"Kategorie {i}",
+                    "description": "",
+                    "image": None,
+                    "parent": parent,
+                }
+            )
+
+        product_ids = []
+        for i in range(products):
+            wc_id = next(next_id)
+            is_variable = variations_per_product and i % 4 == 0
+            variations = []
+            for j in range(variations_per_product if is_variable else 0):
+                variation_id = next(next_id)
+                variations.append(
+                    {
+                        **cls._product_data(variation_id, f"Produkt {i} - Farbe {j}"),
+                        "type": "variation",
+                        "parent_id": wc_id,
+                        "attributes": [{"name": "Farbe", "option": f"Farbe {j}"}],
+                        "categories": [],
+                    }
+                )
+            data.products.append(
+                {
+                    **cls._product_data(wc_id, f"Produkt {i}"),
+                    "type": "variable" if is_variable else "simple",
+                    "parent_id": 0,
+                    "variations": [v["id"] for v in variations],
+                    "categories": (
+                        [{"id": data.categories[i % categories]["id"]}] if categories else []
+                    ),
+                }
+            )
+            if variations:
+                data.variations[wc_id] = variations
+                product_ids += [(wc_id, v["id"]) for v in variations]
+            else:
+                product_ids.append((wc_id, 0))
+
+        for i in range(customers):
+            data.customers.append(
+                {
+                    "id": next(next_id),
+                    "email": f"kunde{i}@example.com",
+                    "first_name": f"Vorname {i}",
+                    "last_name": f"Nachname {i}",
+                    "username": f"kunde{i}",
+                    "avatar_url": "",
+                    "billing": _address(i),
+                    "shipping": _address(i),
+                    "date_modified_gmt": _modified(i),
+                }
+            )
+
+        for i in range(orders):
+            line_items = []
+            for j in range(items_per_order if product_ids else 0):
+                product_id, variation_id = product_ids[(i * items_per_order + j) % len(product_ids)]
+                line_items.append(
+                    {
+                        "product_id": product_id,
+                        "variation_id": variation_id,
+                        "quantity": j + 1,
+                        "subtotal": f"{10 * (j + 1):.2f}",
+                        "name": f"Produkt {product_id}",
+                        "sku": "",
+                    }
+                )
+            data.orders.append(
+                {
+                    "id": next(next_id),
+                    "status": "processing",
+                    "payment_method": "bacs",
+                    "date_paid": None,
+                    "customer_note": "",
+                    "order_key": f"wc_order_{i}",
+                    "customer_id": data.customers[i % customers]["id"] if customers else 0,
+                    "billing": _address(i),
+                    "shipping": _address(i),
+                    "date_created_gmt": _modified(i),
+                    "date_modified_gmt": _modified(i),
+                    "line_items": line_items,
+                    "shipping_lines": [
+                        {"method_title": "Versand", "total": "9.50", "total_tax": "0.77"}
+                    ],
+                    "fee_lines": [],
+                    "coupon_lines": [],
+                }
+            )
+        return data
+
+    @staticmethod
+    def _product_data(wc_id: int, name: str) -> dict:
+        return {
+            "id": wc_id,
+            "sku": f"SKU-{wc_id}",
+            "name": name,
+            "attributes": [],
+            "short_description": "",
+            "description": f"Beschreibung von {name}",
+            "images": [],
+            "price": "10.00",
+            "regular_price": "10.00",
+            "sale_price": "",
+            "date_on_sale_from": None,
+            "date_on_sale_from_gmt": None,
+            "date_on_sale_to": None,
+            "date_on_sale_to_gmt": None,
+            "manage_stock": True,
+            "stock_quantity": 10,
+            "date_modified_gmt": _modified(wc_id),
+        }
+
+
+def _variation_list_data(wc_variation: dict) -> dict:
+    """Variations as returned by the variations endpoint (without name, type and images)"""
+
+    data = {k: v for k, v in wc_variation.items() if k not in ("name", "type", "images")}
+    return {**data, "image": None}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    server: "FakeWooCommerceServer"
+
+    def do_GET(self):
+        self.server.count_request()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.should_fail():
+            self._send({"code": "fake_error", "message": "Injected error"}, status=503)
+            return
+
+        url = urlsplit(self.path)
+        match = re.fullmatch(r"/wp-json/wc/v3/(.+)", url.path)
+        if match is None:
+            self._send({"code": "rest_no_route"}, status=404)
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self._route(match.group(1), params)
+
+    def _route(self, endpoint: str, params: dict):
+        data = self.server.data
+
+        if endpoint == "products/categories":
+            return self._send_list(data.categories, params)
+        if match := re.fullmatch(r"products/(\d+)/variations", endpoint):
+            variations = data.variations.get(int(match.group(1)), [])
+            return self._send_list([_variation_list_data(v) for v in variations], params)
+
+        resources = {
+            "products": data.products,
+            "customers": data.customers,
+            "orders": data.orders,
+        }
+        if endpoint in resources:
+            return self._send_list(resources[endpoint], params)
+
+        match = re.fullmatch(r"(products|customers|orders)/(\d+)", endpoint)
+        if match:
+            objects = resources[match.group(1)]
+            if match.group(1) == "products":
+                objects = objects + data.all_variations
+            for wc_obj in objects:
+                if wc_obj["id"] == int(match.group(2)):
+                    return self._send(wc_obj)
+            return self._send({"code": INVALID_ID_CODES[match.group(1)]}, status=404)
+
+        self._send({"code": "rest_no_route"}, status=404)
+
+    def _send_list(self, objects: list[dict], params: dict):
+        if "include" in params:
+            ids = {int(i) for i in params["include"].split(",") if i}
+            objects = [o for o in objects if o["id"] in ids]
+        if "exclude" in params:
+            ids = {int(i) for i in params["exclude"].split(",") if i}
+            objects = [o for o in objects if o["id"] not in ids]
+        if "modified_after" in params:
+            objects = [o for o in objects if o["date_modified_gmt"] > params["modified_after"]]
+        orderby = params.get("orderby")
+        if orderby in ("id", "modified"):
+            key = "id" if orderby == "id" else "date_modified_gmt"
+            objects = sorted(objects, key=lambda o: o[key], reverse=params.get("order") == "desc")
+
+        per_page = int(params.get("per_page", 10))
+        page = int(params.get("page", 1))
+        self._send(
+            objects[(page - 1) * per_page : page * per_page],
+            headers={
+                "X-WP-Total": str(len(objects)),
+                "X-WP-TotalPages": str(max(math.ceil(len(objects) / per_page), 1)),
+            },
+        )
+
+    def _send(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeWooCommerceServer(http.server.ThreadingHTTPServer):
+    """HTTP server on a free local port, running in a background thread while in a with block
+
+    latency: seconds to wait before every response
+    error_rate: share of requests answered with 503 (deterministic with the seed)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data: FakeWooCommerceData, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            self.error_count += fail
+            return fail
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -1,13 +1,31 @@
 import datetime
+import os
+import signal
+import tempfile
+import time
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+import requests
+from PIL import Image
+from pypdf import PdfReader
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.contrib.admin.models import LogEntry, CHANGE
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from reportlab import rl_config
 
-from kmuhelper.modules.main.models import ContactPerson, PaymentReceiver, Order
+from kmuhelper.modules.main.models import ContactPerson, PaymentReceiver, Order, OrderItem
+from kmuhelper.modules.pdfgeneration import PDFOrder, workers
+from kmuhelper.modules.pdfgeneration.base import PDFGenerator
+from kmuhelper.modules.pdfgeneration.cache import PDFCache
+from kmuhelper.modules.pdfgeneration.logo import LogoCache
+from kmuhelper.modules.pdfgeneration.order.batch import export_order_pdfs
 from kmuhelper.modules.pdfgeneration.swiss_qr_invoice import QRInvoiceFlowable
 
 EXPECTED_PAYLOAD = """SPC
@@ -70,6 +88,8 @@ class OrderPdfGenerationTest(TestCase):
 
         rl_config.trustedHosts = ["localhost", "raw.githubusercontent.com"]
 
+        PDFCache().clear()
+
 
 class QRInvoiceFlowableTest(OrderPdfGenerationTest):
     def testQrPayload(self):
@@ -102,6 +122,354 @@ class QRInvoiceFlowableTest(OrderPdfGenerationTest):
         )
 
 
+class PDFCacheTest(OrderPdfGenerationTest):
+    def test_get_pdf_builds_once(self):
+        pdf = PDFOrder(self.order, "Rechnung")
+        with mock.patch.object(PDFOrder, "_build_pdf", return_value=b"%PDF") as build:
+            self.assertEqual(pdf.get_pdf().read(), b"%PDF")
+            self.assertEqual(pdf.get_pdf().read(), b"%PDF")
+            self.assertEqual(PDFOrder(self.order, "Rechnung").get_pdf().read(), b"%PDF")
+        build.assert_called_once()
+
+    def test_cache_key_changes_with_content(self):
+        def key(**kwargs):
+            return PDFOrder(self.order, kwargs.pop("title", "Rechnung"), **kwargs).get_cache_key()
+
+        original = key()
+        self.assertEqual(original, key())
+        self.assertNotEqual(original, key(title="Lieferschein"))
+        self.assertNotEqual(original, key(text="Text"))
+        self.assertNotEqual(original, key(lang="fr"))
+        self.assertNotEqual(original, key(is_delivery_note=True))
+        self.assertNotEqual(original, key(add_cut_lines=False))
+
+        OrderItem.objects.create(order=self.order, product_price=10, quantity=1)
+        with_item = key()
+        self.assertNotEqual(original, with_item)
+
+        self.payment_receiver.display_name = "Other"
+        self.payment_receiver.save()
+        self.order.refresh_from_db()
+        self.assertNotEqual(with_item, key())
+
+    @override_settings(KMUHELPER_PDF_CACHE_MAX_SIZE=10)
+    def test_size_bounded_eviction(self):
+        cache = PDFCache()
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbb")
+        self.assertEqual(cache.get("a"), b"aaaa")  # a is now the most recently used
+
+        cache.set("c", b"cccc")
+        self.assertEqual(cache.get("a"), b"aaaa")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), b"cccc")
+
+        cache.set("too-large", b"x" * 11)
+        self.assertIsNone(cache.get("too-large"))
+
+    @override_settings(KMUHELPER_PDF_CACHE_MAX_SIZE=0)
+    def test_disabled(self):
+        cache = PDFCache()
+        cache.set("a", b"aaaa")
+        self.assertIsNone(cache.get("a"))
+
+
+class LogoCacheTest(TestCase):
+    URL = "https://example.com/logo.png"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        overrider = override_settings(KMUHELPER_LOGO_CACHE_DIR=self.directory.name)
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+
+        buffer = BytesIO()
+        Image.new("RGB", (1000, 500), "red").save(buffer, format="PNG")
+        self.response = mock.Mock(content=buffer.getvalue())
+
+    def test_downloads_once_and_scales(self):
+        with mock.patch("requests.get", return_value=self.response) as get:
+            content = LogoCache().get(self.URL)
+            self.assertEqual(LogoCache().get(self.URL), content)
+            LogoCache().get_image_reader(self.URL)
+
+        get.assert_called_once_with(self.URL, timeout=5)
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual(image.size, (LogoCache.MAX_SIZE_PX, LogoCache.MAX_SIZE_PX // 2))
+
+    def test_other_modes_and_large_images(self):
+        buffer = BytesIO()
+        Image.new("CMYK", (100, 100), "red").save(buffer, format="JPEG")
+        with mock.patch("requests.get", return_value=mock.Mock(content=buffer.getvalue())):
+            content = LogoCache().get(self.URL)
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual(image.mode, "RGB")
+
+        with (
+            mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000),
+            mock.patch("requests.get", return_value=self.response),
+            self.assertRaises(OSError),
+        ):
+            LogoCache().download(self.URL)
+
+    def test_changed_url_and_revalidation(self):
+        with mock.patch("requests.get", return_value=self.response) as get:
+            LogoCache().get(self.URL)
+            LogoCache().get(self.URL + "?v=2")
+            self.assertEqual(get.call_count, 2)
+
+            with override_settings(KMUHELPER_LOGO_CACHE_TIMEOUT=-1):
+                LogoCache().get(self.URL)
+            self.assertEqual(get.call_count, 3)
+
+        # Stale logos are still used if they can't be downloaded again
+        with (
+            override_settings(KMUHELPER_LOGO_CACHE_TIMEOUT=-1),
+            mock.patch("requests.get", side_effect=requests.ConnectionError),
+            self.assertLogs("kmuhelper.modules.pdfgeneration.logo", "WARNING"),
+        ):
+            self.assertTrue(LogoCache().get(self.URL))
+
+    def test_payment_receiver_clean(self):
+        receiver = PaymentReceiver(logourl=self.URL)
+
+        with mock.patch("requests.get", return_value=mock.Mock(content=b"no image")):
+            with self.assertRaises(ValidationError) as cm:
+                receiver.clean()
+            self.assertIn("logourl", cm.exception.message_dict)
+
+        with (
+            override_settings(KMUHELPER_LOGO_REQUEST_TIMEOUT=2),
+            mock.patch("requests.get", return_value=self.response) as get,
+        ):
+            try:
+                receiver.clean()
+            except ValidationError as e:
+                self.assertNotIn("logourl", e.message_dict)
+        get.assert_called_once_with(self.URL, timeout=2)
+
+        # The logo is now cached for the PDF generation
+        with mock.patch("requests.get") as get:
+            LogoCache().get(self.URL)
+        get.assert_not_called()
+
+
+@override_settings(KMUHELPER_PDF_BATCH_WORKERS=0)
+class BatchExportTest(OrderPdfGenerationTest):
+    def setUp(self):
+        super().setUp()
+        self.payment_receiver.logourl = ""
+        self.payment_receiver.save()
+        self.other_order = Order.objects.create(
+            contact_person=self.contact_person, payment_receiver=self.payment_receiver
+        )
+
+    def test_merged_pdf(self):
+        file = BytesIO()
+        count = export_order_pdfs([self.order.pk, self.other_order.pk, self.order.pk], file)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(len(PdfReader(file).pages), 2)
+        # The invoice date is set like when viewing a single PDF
+        self.other_order.refresh_from_db()
+        self.assertIsNotNone(self.other_order.invoice_date)
+
+    def test_merged_pdf_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.pdf")
+            export_order_pdfs([self.order.pk, self.other_order.pk], path, preset="delivery-note")
+
+            reader = PdfReader(path)
+            self.assertEqual(len(reader.pages), 2)
+            self.assertIn(str(self.order.pkfill(9)), reader.pages[0].extract_text())
+            self.assertIn(str(self.other_order.pkfill(9)), reader.pages[1].extract_text())
+
+    def test_not_cached(self):
+        export_order_pdfs([self.order.pk], BytesIO())
+
+        self.assertEqual(PDFCache()._get_index(), {})
+
+    def test_zip(self):
+        file = BytesIO()
+        export_order_pdfs(
+            [self.order.pk, self.other_order.pk], file, preset="delivery-note", as_zip=True
+        )
+
+        with zipfile.ZipFile(file) as archive:
+            names = archive.namelist()
+            self.assertEqual(len(names), 2)
+            self.assertTrue(names[0].startswith(f"{self.order} - "))
+            self.assertTrue(names[1].startswith(f"{self.other_order} - "))
+            self.assertTrue(archive.read(names[0]).startswith(b"%PDF"))
+
+    def test_admin_action(self):
+        response = self.client.post(
+            reverse("admin:kmuhelper_order_changelist"),
+            {
+                "action": "export_delivery_notes",
+                "_selected_action": [self.order.pk, self.other_order.pk],
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(len(PdfReader(BytesIO(b"".join(response.streaming_content))).pages), 2)
+        self.assertEqual(LogEntry.objects.filter(action_flag=CHANGE).count(), 2)
+
+    @override_settings(KMUHELPER_PDF_BATCH_ADMIN_LIMIT=1)
+    def test_admin_action_limit(self):
+        response = self.client.post(
+            reverse("admin:kmuhelper_order_changelist"),
+            {
+                "action": "export_delivery_notes",
+                "_selected_action": [self.order.pk, self.other_order.pk],
+            },
+            follow=True,
+        )
+
+        self.assertContains(response, "höchstens 1 Bestellungen")
+        self.assertFalse(LogEntry.objects.filter(action_flag=CHANGE).exists())
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.zip")
+            out = StringIO()
+            call_command(
+                "kmuhelper-export-order-pdfs",
+                path,
+                "--zip",
+                "--ids",
+                str(self.order.pk),
+                stdout=out,
+            )
+
+            self.assertIn("Exported 1 documents", out.getvalue())
+            with zipfile.ZipFile(path) as archive:
+                self.assertEqual(len(archive.namelist()), 1)
+
+
+class _SlowPDF(PDFGenerator):
+    def _build_pdf(self):
+        time.sleep(30)
+
+
+class _StuckPDF(PDFGenerator):
+    def _build_pdf(self):
+        # Like code stuck in C, which doesn't notice the timeout
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        time.sleep(30)
+
+
+class _HugePDF(PDFGenerator):
+    def _build_pdf(self):
+        return bytes(2 * 1024**3)
+
+
+@override_settings(KMUHELPER_PDF_WORKERS=1)
+class PDFWorkerTest(OrderPdfGenerationTest):
+    def setUp(self):
+        super().setUp()
+        self.payment_receiver.logourl = ""
+        self.payment_receiver.save()
+        self.addCleanup(workers.shutdown)
+
+    def test_render_in_worker(self):
+        with mock.patch.object(PDFOrder, "_build_pdf") as build:
+            content = PDFOrder(self.order, "Rechnung").get_pdf().getvalue()
+
+        build.assert_not_called()
+        self.assertTrue(content.startswith(b"%PDF"))
+
+    def test_get_pdf_nowait(self):
+        self.assertIsNone(PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0))
+
+        # Polling doesn't start rendering again
+        with mock.patch.object(workers, "submit") as submit:
+            self.assertIsNone(PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0))
+        submit.assert_not_called()
+
+        for _ in range(60):
+            content = PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0)
+            if content is not None:
+                break
+            time.sleep(0.5)
+        self.assertTrue(content.getvalue().startswith(b"%PDF"))
+
+    def test_submitted_once(self):
+        # Another request has claimed the document between the check and the claim
+        with (
+            mock.patch("django.core.cache.backends.locmem.LocMemCache.add", return_value=False),
+            mock.patch.object(workers, "submit") as submit,
+        ):
+            self.assertIsNone(PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0))
+        submit.assert_not_called()
+
+    @override_settings(KMUHELPER_PDF_CACHE_MAX_SIZE=100)
+    def test_get_pdf_nowait_too_large_for_cache(self):
+        for _ in range(60):
+            content = PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0)
+            if content is not None:
+                break
+            time.sleep(0.5)
+        self.assertTrue(content.getvalue().startswith(b"%PDF"))
+        self.assertFalse(workers._results)
+
+        # Requests in other processes render it again and wait for it
+        content = PDFOrder(self.order, "Rechnung").get_pdf_nowait(wait=0)
+        self.assertTrue(content.getvalue().startswith(b"%PDF"))
+
+    def test_view_polls(self):
+        LogEntry.objects.all().delete()
+        url = reverse("admin:kmuhelper_order_pdf", args=[self.order.id]) + "?preset=invoice"
+
+        for _ in range(60):
+            response = self.client.get(url)
+            if response.status_code != 202:
+                break
+            self.assertTemplateUsed(response, "admin/kmuhelper/order/pdf_wait.html")
+            time.sleep(0.5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        # Only logged once the PDF is delivered
+        self.assertEqual(LogEntry.objects.count(), 1)
+
+    @override_settings(KMUHELPER_PDF_WORKER_TIMEOUT=1)
+    def test_timeout(self):
+        with (
+            self.assertLogs("kmuhelper.modules.pdfgeneration.workers", "ERROR"),
+            self.assertRaisesMessage(workers.PDFWorkerError, "1 Sekunden"),
+        ):
+            _SlowPDF().get_pdf()
+
+        # The worker stopped by itself and renders the next document
+        with override_settings(KMUHELPER_PDF_WORKER_TIMEOUT=60):
+            content = PDFOrder(self.order, "Rechnung").get_pdf().getvalue()
+        self.assertTrue(content.startswith(b"%PDF"))
+
+    @override_settings(KMUHELPER_PDF_WORKER_TIMEOUT=1)
+    @mock.patch.object(workers, "KILL_DELAY", 0)
+    def test_stuck_worker(self):
+        with self.assertLogs("kmuhelper.modules.pdfgeneration.workers", "ERROR"):
+            stuck = workers.submit(_StuckPDF())
+            with override_settings(KMUHELPER_PDF_WORKER_TIMEOUT=60):
+                other = workers.submit(PDFOrder(self.order, "Rechnung"))
+
+            with self.assertRaises(Exception) as cm:
+                stuck.result(timeout=60)
+        self.assertIn("1 Sekunden", workers._get_error_message(stuck, cm.exception))
+
+        # The other document was waiting in the killed pool and is rendered again
+        self.assertTrue(other.result(timeout=120).startswith(b"%PDF"))
+
+    @override_settings(KMUHELPER_PDF_WORKER_MEMORY_LIMIT=512 * 1024**2)
+    def test_memory_limit(self):
+        with self.assertRaisesMessage(workers.PDFWorkerError, "Speicher"):
+            _HugePDF().get_pdf()
+
+
 class OrderCreatePdfFormTest(OrderPdfGenerationTest):
     """Test kmuhelper.modules.pdfgeneration.order.views.order_create_pdf_form"""
 
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from kmuhelper import settings
+from kmuhelper.modules.settings.cache import settings_cache
+from kmuhelper.modules.settings.models import Setting, SettingHidden
+
+
+class SettingsCacheTest(TestCase):
+    def setUp(self):
+        settings_cache.clear()
+        self.addCleanup(settings_cache.clear)
+
+    def test_reads_are_cached(self):
+        # The version and one query per model
+        with self.assertNumQueries(3):
+            settings.get_db_setting("email-signature")
+            settings.get_secret_db_setting("wc-consumer_key")
+
+        with self.assertNumQueries(0):
+            self.assertFalse(settings.get_db_setting("print-payment-conditions"))
+            self.assertEqual(settings.get_db_setting("default-payment-conditions", "x"), "x")
+            self.assertIsNone(settings.get_db_setting("does-not-exist"))
+            self.assertEqual(settings.get_secret_db_setting("does-not-exist", 1), 1)
+
+    def test_save_invalidates(self):
+        self.assertIsNone(settings.get_db_setting("email-signature"))
+
+        self.assertTrue(settings.set_db_setting("email-signature", "Grüsse"))
+        self.assertEqual(settings.get_db_setting("email-signature"), "Grüsse")
+
+        settings.set_secret_db_setting("wc-consumer_key", "key")
+        self.assertEqual(settings.get_secret_db_setting("wc-consumer_key"), "key")
+
+    @override_settings(KMUHELPER_SETTINGS_CACHE_INTERVAL=0)
+    def test_version_change_from_other_process(self):
+        settings.get_db_setting("email-signature")
+
+        # Simulate a change saved and committed by another process
+        Setting.objects.filter(id="email-signature").update(content_text="Anders")
+        # Only the version is checked
+        with self.assertNumQueries(1):
+            self.assertIsNone(settings.get_db_setting("email-signature"))
+
+        SettingHidden.objects.filter(id=settings_cache.version_setting).update(content_char="other")
+        self.assertEqual(settings.get_db_setting("email-signature"), "Anders")
+
+    def test_rollback(self):
+        self.assertIsNone(settings.get_db_setting("email-signature"))
+
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            settings.set_db_setting("email-signature", "Nicht gespeichert")
+            # Uncommitted values are read from the database, but not cached
+            self.assertEqual(settings.get_db_setting("email-signature"), "Nicht gespeichert")
+            1 / 0
+
+        self.assertIsNone(settings.get_db_setting("email-signature"))
+        # Cached again after the rollback
+        with self.assertNumQueries(0):
+            self.assertIsNone(settings.get_db_setting("email-signature"))
+
+    def test_deleted_setting(self):
+        settings.get_secret_db_setting("wc-url")
+        SettingHidden.objects.get(id="wc-url").delete()
+        self.assertEqual(settings.get_secret_db_setting("wc-url", "default"), "default")
@@ -0,0 +1,835 @@
+import datetime
+import http.server
+import json
+import math
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from kmuhelper import settings
+from kmuhelper.modules.integrations.woocommerce.api import (
+    WCCustomersAPI,
+    WCOrdersAPI,
+    WCProductCategoriesAPI,
+    WCProductsAPI,
+)
+from kmuhelper.modules.integrations.woocommerce.api._base import get_sync_cursors
+from kmuhelper.modules.integrations.woocommerce.api._transport import (
+    WCSessionAPI,
+    close_session,
+)
+from kmuhelper.modules.integrations.woocommerce import jobs
+from kmuhelper.modules.integrations.woocommerce.jobs import (
+    run_import_job,
+    run_waiting_import_jobs,
+)
+from kmuhelper.modules.integrations.woocommerce.models import ImportJob, WebhookDelivery
+from kmuhelper.modules.integrations.woocommerce.utils import base64_hmac_sha256
+from kmuhelper.modules.integrations.woocommerce.webhooks import _claim, process_webhook_inbox
+from kmuhelper.modules.main.models import (
+    ContactPerson,
+    Customer,
+    Order,
+    OrderItem,
+    PaymentReceiver,
+    Product,
+    ProductCategory,
+)
+from kmuhelper.modules.main.utils import OrderDefaults
+from kmuhelper.modules.settings.cache import settings_cache
+from kmuhelper_tests.t_modules.fake_woocommerce import FakeWooCommerceData, FakeWooCommerceServer
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AssertionError(f"Status code {self.status_code}")
+
+
+class FakeWCAPI:
+    """Minimal WooCommerce REST API serving lists of objects per resource
+
+    Like in WooCommerce, objects in the trash are not listed, but can be requested by id."""
+
+    INVALID_ID_CODES = {
+        "products": "woocommerce_rest_product_invalid_id",
+        "products/categories": "woocommerce_rest_term_invalid",
+        "customers": "woocommerce_rest_invalid_id",
+        "orders": "woocommerce_rest_shop_order_invalid_id",
+    }
+
+    def __init__(self, products=None, **resources):
+        self.resources = {"products": products or [], **resources}
+        self.requests = []
+
+    @property
+    def products(self):
+        return self.resources["products"]
+
+    def get(self, endpoint, params=None):
+        params = params or {}
+        self.requests.append((endpoint, params))
+
+        resource, _, object_id = endpoint.rpartition("/")
+        if resource in self.resources and object_id.isdigit():
+            for o in self.resources[resource]:
+                if o["id"] == int(object_id):
+                    return FakeResponse(o)
+            return FakeResponse({"code": self.INVALID_ID_CODES[resource]}, status_code=404)
+
+        objects = [
+            o
+            for o in self.resources[endpoint]
+            if o.get("type") != "variation" and o.get("status") != "trash"
+        ]
+        if "include" in params:
+            ids = {int(i) for i in params["include"].split(",")}
+            objects = [o for o in objects if o["id"] in ids]
+        if "exclude" in params:
+            ids = {int(i) for i in params["exclude"].split(",")}
+            objects = [o for o in objects if o["id"] not in ids]
+        if "modified_after" in params:
+            objects = [o for o in objects if o["date_modified_gmt"] > params["modified_after"]]
+        if params.get("orderby") == "modified":
+            objects = sorted(objects, key=lambda o: o["date_modified_gmt"])
+
+        per_page = params.get("per_page", 10)
+        page = params.get("page", 1)
+        return FakeResponse(
+            objects[(page - 1) * per_page : page * per_page],
+            headers={"X-WP-TotalPages": str(max(math.ceil(len(objects) / per_page), 1))},
+        )
+
+
+def wc_product(wc_id, modified, **data):
+    return {
+        "id": wc_id,
+        "type": "simple",
+        "sku": f"SKU-{wc_id}",
+        "name": f"Product {wc_id}",
+        "attributes": [],
+        "short_description": "",
+        "description": "",
+        "images": [],
+        "price": "10.00",
+        "regular_price": "10.00",
+        "sale_price": "",
+        "date_on_sale_from": None,
+        "date_on_sale_from_gmt": None,
+        "date_on_sale_to": None,
+        "date_on_sale_to_gmt": None,
+        "manage_stock": False,
+        "stock_quantity": None,
+        "categories": [],
+        "date_modified_gmt": modified,
+        **data,
+    }
+
+
+def wc_variation(wc_id, **data):
+    """Variation as returned by the variations endpoint (without name, type and images)"""
+
+    return {
+        "id": wc_id,
+        "sku": f"SKU-{wc_id}",
+        "attributes": [{"name": "Farbe", "option": f"Farbe {wc_id}"}],
+        "description": "",
+        "regular_price": "5.00",
+        "sale_price": "",
+        "date_on_sale_from_gmt": None,
+        "date_on_sale_to_gmt": None,
+        "image": None,
+        "manage_stock": True,
+        "stock_quantity": 3,
+        **data,
+    }
+
+
+def wc_category(wc_id, parent=0, **data):
+    return {
+        "id": wc_id,
+        "name": f"Kategorie {wc_id}",
+        "description": "",
+        "image": None,
+        "parent": parent,
+        **data,
+    }
+
+
+def wc_address(**data):
+    return {
+        "first_name": "Max",
+        "last_name": "Muster",
+        "company": "",
+        "address_1": "Strasse 1",
+        "address_2": "",
+        "city": "Bern",
+        "state": "BE",
+        "postcode": "3000",
+        "country": "CH",
+        "email": "max@example.com",
+        "phone": "",
+        **data,
+    }
+
+
+def wc_customer(wc_id, **data):
+    return {
+        "id": wc_id,
+        "email": f"customer{wc_id}@example.com",
+        "first_name": "Max",
+        "last_name": "Muster",
+        "username": f"customer{wc_id}",
+        "avatar_url": "",
+        "billing": wc_address(),
+        "shipping": wc_address(),
+        **data,
+    }
+
+
+def wc_order(wc_id, modified, customer_id=0, line_items=(), **data):
+    return {
+        "id": wc_id,
+        "status": "processing",
+        "payment_method": "bacs",
+        "date_paid": None,
+        "customer_note": "",
+        "order_key": f"wc_order_{wc_id}",
+        "customer_id": customer_id,
+        "billing": wc_address(),
+        "shipping": wc_address(),
+        "date_created_gmt": "2026-01-01T00:00:00",
+        "date_modified_gmt": modified,
+        "line_items": [
+            {
+                "product_id": product_id,
+                "variation_id": variation_id,
+                "quantity": 2,
+                "subtotal": "20.00",
+                "name": f"Product {product_id}",
+                "sku": "",
+            }
+            for product_id, variation_id in line_items
+        ],
+        "shipping_lines": [],
+        "fee_lines": [],
+        "coupon_lines": [],
+        **data,
+    }
+
+
+class WooCommerceAdminTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="<PASSWORD>", is_staff=True, is_superuser=True
+        )
+        self.client.force_login(self.user)
+        settings.set_secret_db_setting("wc-url", "https://shop.example.com")
+
+    def test_connection_resolved_once_per_changelist(self):
+        contact_person = ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        payment_receiver = PaymentReceiver.objects.create()
+        for i in range(20):
+            Order.objects.create(
+                contact_person=contact_person, payment_receiver=payment_receiver, woocommerceid=i
+            )
+
+        with mock.patch.object(
+            settings, "get_secret_db_setting", wraps=settings.get_secret_db_setting
+        ) as get_secret_db_setting:
+            response = self.client.get("/admin/kmuhelper/order/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "column-display_woocommerce_state")
+        self.assertContains(response, 'value="wc_update"')
+        self.assertEqual(get_secret_db_setting.call_count, 1)
+
+
+class WooCommerceSyncTest(TestCase):
+    def setUp(self):
+        start = datetime.datetime(2026, 1, 1)
+        self.wcapi = FakeWCAPI(
+            [
+                wc_product(i, (start + datetime.timedelta(minutes=i)).isoformat())
+                for i in range(1, 151)
+            ]
+        )
+
+    def test_import_all_skips_known_objects(self):
+        WCProductsAPI(self.wcapi).sync_objects_from_api()
+        self.wcapi.products.append(wc_product(200, "2026-01-02T00:00:00"))
+
+        self.wcapi.requests.clear()
+        self.assertEqual(WCProductsAPI(self.wcapi).import_all_objects_from_api(), 1)
+        self.assertTrue(all("exclude" not in params for _, params in self.wcapi.requests))
+
+    def test_incremental_sync(self):
+        # Storing the cursor doesn't invalidate the settings cache
+        with mock.patch.object(settings_cache, "invalidate") as invalidate:
+            self.assertEqual(WCProductsAPI(self.wcapi).sync_objects_from_api(), (150, 0))
+        invalidate.assert_not_called()
+        self.assertEqual(len(self.wcapi.requests), 2)  # per_page=100
+        self.assertEqual(
+            get_sync_cursors(),
+            {"products": "2026-01-01T02:30:00"},
+        )
+
+        self.wcapi.products[0] = wc_product(1, "2026-01-02T00:00:00", name="Changed")
+        self.wcapi.products.append(wc_product(151, "2026-01-02T00:00:01"))
+        self.wcapi.requests.clear()
+
+        # The last product of the previous sync is downloaded again because of the overlap, but
+        # not written as it is unchanged
+        self.assertEqual(WCProductsAPI(self.wcapi).sync_objects_from_api(), (1, 1))
+        self.assertEqual(len(self.wcapi.requests), 1)
+        self.assertEqual(self.wcapi.requests[0][1]["modified_after"], "2026-01-01T02:29:59")
+        self.assertEqual(Product.objects.get(woocommerceid=1).name, "Changed")
+
+        self.assertEqual(WCProductsAPI(self.wcapi).sync_objects_from_api(full=True), (0, 0))
+
+    @override_settings(KMUHELPER_WC_PER_PAGE=20)
+    def test_incremental_sync_same_second(self):
+        # More objects modified within the same second than fit on a page
+        self.wcapi.products[:] = [wc_product(i, "2026-01-01T00:00:00") for i in range(1, 51)]
+
+        self.assertEqual(WCProductsAPI(self.wcapi).sync_objects_from_api(), (50, 0))
+        self.assertEqual(len(self.wcapi.requests), 3)
+        self.assertEqual(self.wcapi.requests[2][1]["exclude"], ",".join(map(str, range(1, 41))))
+
+    def test_bulk_update(self):
+        WCProductsAPI(self.wcapi).sync_objects_from_api()
+        Product.objects.create(name="Not linked")
+
+        self.wcapi.products[0] = wc_product(1, "2026-01-02T00:00:00", name="Changed")
+        del self.wcapi.products[1:11]
+        self.wcapi.products[2] = wc_product(13, "2026-01-02T00:00:00", status="trash")
+        self.wcapi.requests.clear()
+
+        counts = WCProductsAPI(self.wcapi).bulk_update_objects_from_api(Product.objects.all())
+        self.assertEqual(counts, (140, 1, 10))
+        # Objects missing in the lists are checked one by one
+        self.assertEqual(len(self.wcapi.requests), 2 + 11)
+        self.assertEqual(Product.objects.get(woocommerceid=1).name, "Changed")
+        self.assertFalse(Product.objects.get(woocommerceid=13).woocommerce_deleted)
+        self.assertEqual(
+            set(Product.objects.filter(woocommerce_deleted=True).values_list("name", flat=True)),
+            {f"Product {i}" for i in range(2, 12)},
+        )
+
+    def test_bulk_update_without_response(self):
+        WCProductsAPI(self.wcapi).sync_objects_from_api()
+        get = self.wcapi.get
+
+        def get_without_single_objects(endpoint, params=None):
+            if endpoint != "products":
+                return FakeResponse({"code": "internal_server_error"}, status_code=500)
+            return get(endpoint, params)
+
+        del self.wcapi.products[:10]
+        with mock.patch.object(self.wcapi, "get", get_without_single_objects):
+            counts = WCProductsAPI(self.wcapi).bulk_update_objects_from_api(Product.objects.all())
+
+        # Not marked as deleted, as the shop didn't confirm that they don't exist
+        self.assertEqual(counts, (140, 0, 10))
+        self.assertFalse(Product.objects.filter(woocommerce_deleted=True).exists())
+
+    def test_category_import_in_bulk(self):
+        # Children before their parents: 1 <- 2 <- 3..52, and 53 below the existing 100
+        categories = [wc_category(i, parent=2) for i in range(3, 53)]
+        categories += [wc_category(53, parent=100), wc_category(2, parent=1), wc_category(1)]
+        self.wcapi.resources["products/categories"] = categories
+        ProductCategory.objects.create(woocommerceid=100, name="Bekannt")
+        ProductCategory.objects.create(woocommerceid=2, name="Alt")
+
+        with self.assertNumQueries(6):
+            created = WCProductCategoriesAPI(self.wcapi).import_all_objects_from_api()
+        self.assertEqual(created, 52)
+        self.assertEqual(len(self.wcapi.requests), 1)
+
+        by_wc_id = {c.woocommerceid: c for c in ProductCategory.objects.all()}
+        self.assertIsNone(by_wc_id[1].parent_category)
+        self.assertEqual(by_wc_id[3].parent_category, by_wc_id[2])
+        self.assertEqual(by_wc_id[53].parent_category, by_wc_id[100])
+        # Known categories are only updated by the sync
+        self.assertEqual(by_wc_id[2].name, "Alt")
+        self.assertIsNone(by_wc_id[2].parent_category)
+
+        # Only the known category is updated, the imported ones are unchanged
+        self.assertEqual(WCProductCategoriesAPI(self.wcapi).sync_objects_from_api(), (0, 1))
+        category = ProductCategory.objects.get(woocommerceid=2)
+        self.assertEqual(
+            (category.name, category.parent_category.woocommerceid), ("Kategorie 2", 1)
+        )
+
+    def test_unchanged_objects_are_skipped(self):
+        self.wcapi.resources["products/categories"] = [wc_category(1), wc_category(2)]
+        WCProductCategoriesAPI(self.wcapi).sync_objects_from_api()
+        wc_obj = wc_product(1, "2026-01-01T00:00:00", categories=[{"id": 1}, {"id": 2}])
+        product = WCProductsAPI(self.wcapi).create_object_from_data(wc_obj)
+        links = set(product.categories.through.objects.values_list("pk", flat=True))
+        api = WCProductsAPI(self.wcapi)
+
+        # Only the modification date changed
+        with self.assertNumQueries(0):
+            wc_obj["date_modified_gmt"] = "2026-01-02T00:00:00"
+            self.assertFalse(api.update_object_if_changed(product, wc_obj))
+
+        wc_obj["name"] = "Changed"
+        wc_obj["categories"] = [{"id": 2}]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(api.update_object_if_changed(product, wc_obj))
+        update = next(
+            q["sql"] for q in queries if q["sql"].startswith('UPDATE "kmuhelper_product"')
+        )
+        self.assertIn('"name"', update)
+        self.assertNotIn('"description"', update)
+
+        # The link to the remaining category was kept
+        remaining = set(product.categories.through.objects.values_list("pk", flat=True))
+        self.assertEqual(len(remaining), 1)
+        self.assertLess(remaining, links)
+
+        # Objects marked as deleted are always updated (e.g. when restored)
+        product.woocommerce_deleted = True
+        self.assertTrue(api.update_object_if_changed(product, wc_obj))
+        product.refresh_from_db()
+        self.assertFalse(product.woocommerce_deleted)
+
+    def test_variation_sync(self):
+        variation_ids = list(range(11, 261))
+        self.wcapi.resources["products/1/variations"] = [wc_variation(i) for i in variation_ids]
+        wc_parent = wc_product(1, "2026-01-01T00:00:00", type="variable", variations=variation_ids)
+
+        parent = Product.objects.create(woocommerceid=1)
+        Product.objects.create(woocommerceid=11, parent=parent, name="Bekannt")
+        Product.objects.create(woocommerceid=12, parent=parent, woocommerce_deleted=True)
+        Product.objects.create(woocommerceid=999, parent=parent)
+
+        with CaptureQueriesContext(connection) as queries:
+            WCProductsAPI(self.wcapi).update_object_from_data(parent, wc_parent)
+
+        # Only the new and the deleted variations are downloaded, in pages of 100
+        self.assertEqual(len(self.wcapi.requests), 3)
+        self.assertEqual(self.wcapi.requests[0][0], "products/1/variations")
+        self.assertTrue(self.wcapi.requests[0][1]["include"].startswith("12,13,"))
+        self.assertLess(len(queries), 20)
+
+        self.assertEqual(parent.children.filter(woocommerce_deleted=False).count(), 250)
+        self.assertTrue(Product.objects.get(woocommerceid=999).woocommerce_deleted)
+        self.assertEqual(Product.objects.get(woocommerceid=11).name, "Bekannt")
+        variation = Product.objects.get(woocommerceid=13)
+        self.assertEqual(
+            (variation.name, variation.selling_price, variation.stock_current),
+            ("Product 1 - Farbe 13", 5.0, 3),
+        )
+        self.assertEqual(variation.stock_movements.get().difference, 3)
+
+        # All variations are updated on the creation event
+        self.wcapi.requests.clear()
+        WCProductsAPI(self.wcapi).update_object_from_data(parent, wc_parent, is_create_event=True)
+        self.assertEqual(len(self.wcapi.requests), 3)
+        self.assertNotIn("include", self.wcapi.requests[0][1])
+        self.assertEqual(Product.objects.get(woocommerceid=11).name, "Product 1 - Farbe 11")
+
+    @override_settings(KMUHELPER_WC_PER_PAGE=10, KMUHELPER_WC_CONCURRENCY=3)
+    def test_concurrent_download(self):
+        self.assertEqual(WCProductsAPI(self.wcapi).import_all_objects_from_api(), 150)
+        self.assertEqual(len(self.wcapi.requests), 15)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("woocommerceid", flat=True)),
+            list(range(1, 151)),
+        )
+
+    def test_order_import_prefetches_dependencies(self):
+        self.wcapi.resources["products"] = [
+            wc_product(i, "2026-01-01T00:00:00", type="variable" if i == 1 else "simple")
+            for i in range(1, 5)
+        ] + [wc_product(5, "2026-01-01T00:00:00", type="variation", parent_id=1)]
+        self.wcapi.resources["customers"] = [wc_customer(7)]
+        self.wcapi.resources["orders"] = [
+            wc_order(1, "2026-01-01T00:00:00", line_items=[(1, 0), (3, 0)]),
+            wc_order(2, "2026-01-01T00:00:01", customer_id=7, line_items=[(4, 0), (1, 5)]),
+            wc_order(3, "2026-01-01T00:00:02", customer_id=7, line_items=[(2, 0), (3, 0)]),
+        ]
+        Product.objects.create(woocommerceid=1, name="Known")
+        Product.objects.create(woocommerceid=2, name="Known")
+        ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        PaymentReceiver.objects.create()
+        # Creating them inside the test transaction pauses the cache of the defaults
+        OrderDefaults.cache.clear()
+
+        self.assertEqual(WCOrdersAPI(self.wcapi).sync_objects_from_api(), (3, 0))
+
+        self.assertEqual(
+            [endpoint for endpoint, params in self.wcapi.requests],
+            ["orders", "products", "products/5", "customers"],
+        )
+        self.assertEqual(self.wcapi.requests[1][1]["include"], "3,4,5")
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertEqual(Product.objects.get(woocommerceid=5).parent.woocommerceid, 1)
+        self.assertEqual(Customer.objects.get().orders.count(), 2)
+        self.assertEqual(
+            sorted(
+                OrderItem.objects.filter(order__woocommerceid=2).values_list(
+                    "linked_product__woocommerceid", flat=True
+                )
+            ),
+            [4, 5],
+        )
+
+
+class WooCommerceWebhookTest(TestCase):
+    def setUp(self):
+        settings.set_secret_db_setting("wc-url", "https://shop.example.com")
+        settings.set_db_setting("wc-webhook-secret", "secret")
+        self.wcapi = FakeWCAPI()
+
+        # Process new deliveries immediately unless a test overrides it
+        window = override_settings(KMUHELPER_WC_WEBHOOK_COALESCE_WINDOW=0)
+        window.enable()
+        self.addCleanup(window.disable)
+
+    def post_webhook(self, topic, wc_obj, delivery_id, signature=None):
+        body = json.dumps(wc_obj).encode()
+        return self.client.post(
+            "/kmuhelper/integrations/woocommerce/webhooks",
+            body,
+            content_type="application/json",
+            headers={
+                "x-wc-webhook-topic": topic,
+                "x-wc-webhook-source": "https://shop.example.com/",
+                "x-wc-webhook-delivery-id": delivery_id,
+                "x-wc-webhook-signature": signature or base64_hmac_sha256(b"secret", body).decode(),
+            },
+        )
+
+    def test_webhook_is_queued(self):
+        response = self.post_webhook("customer.created", wc_customer(7), "1")
+        self.assertEqual(response.status_code, 202)
+        # Redelivery with the same ID
+        response = self.post_webhook("customer.created", wc_customer(7), "1")
+        self.assertEqual(response.status_code, 202)
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.topic, delivery.object_id), ("customer.created", 7))
+        self.assertFalse(Customer.objects.exists())
+
+        response = self.post_webhook("customer.created", wc_customer(8), "2", signature="wrong")
+        self.assertEqual(response.status_code, 403)
+        response = self.post_webhook("coupon.created", {"id": 1}, "3")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+
+    @override_settings(KMUHELPER_WC_WEBHOOK_RETRIES=1, ADMINS=["admin@example.com"])
+    def test_inbox_order_and_retries(self):
+        self.post_webhook("customer.updated", {"id": 7, "email": "broken"}, "1")
+        self.post_webhook("customer.created", wc_customer(7, first_name="Later"), "2")
+        self.post_webhook("customer.created", wc_customer(8), "3")
+
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 1, "retrying": 1, "failed": 0, "coalesced": 0})
+        self.assertEqual(Customer.objects.get().woocommerceid, 8)
+        # The delivery after the failed one waits for its retry
+        self.assertEqual(WebhookDelivery.objects.get(delivery_id="2").status, "pending")
+
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 0, "retrying": 0, "failed": 0, "coalesced": 0})
+
+        WebhookDelivery.objects.filter(delivery_id="1").update(next_attempt_at=timezone.now())
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 1, "retrying": 0, "failed": 1, "coalesced": 0})
+
+        failed = WebhookDelivery.objects.get(delivery_id="1")
+        self.assertEqual((failed.status, failed.attempts), ("failed", 2))
+        self.assertIn("KeyError", failed.error)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Customer.objects.get(woocommerceid=7).first_name, "Later")
+
+    def test_coalescing(self):
+        Customer.objects.create(woocommerceid=7)
+        with override_settings(KMUHELPER_WC_WEBHOOK_COALESCE_WINDOW=60):
+            for delivery_id, name, modified in [
+                ("1", "A", "2026-01-01T00:00:01"),
+                ("2", "C", "2026-01-01T00:00:03"),
+                ("3", "B", "2026-01-01T00:00:02"),
+            ]:
+                wc_obj = wc_customer(7, first_name=name, date_modified_gmt=modified)
+                self.post_webhook("customer.updated", wc_obj, delivery_id)
+            self.post_webhook("customer.deleted", {"id": 7}, "4")
+            self.post_webhook("customer.updated", wc_customer(7, first_name="D"), "5")
+
+        # Still in the coalescing window
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 0, "retrying": 0, "failed": 0, "coalesced": 0})
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        with mock.patch.object(WCCustomersAPI, "update_object_from_data") as update:
+            counts = process_webhook_inbox(self.wcapi, concurrency=1)
+
+        self.assertEqual(counts, {"done": 3, "retrying": 0, "failed": 0, "coalesced": 2})
+        self.assertEqual([call.args[1]["first_name"] for call in update.call_args_list], ["C", "D"])
+        self.assertEqual(
+            set(
+                WebhookDelivery.objects.filter(status="coalesced").values_list(
+                    "delivery_id", flat=True
+                )
+            ),
+            {"1", "3"},
+        )
+
+    def test_claims(self):
+        self.post_webhook("customer.created", wc_customer(7), "1")
+        self.post_webhook("customer.created", wc_customer(8), "2")
+        self.post_webhook("customer.updated", wc_customer(8, first_name="Later"), "3")
+
+        # Only all pending deliveries of an object or none are claimed
+        deliveries = list(WebhookDelivery.objects.filter(object_id=8).order_by("pk"))
+        WebhookDelivery.objects.filter(delivery_id="3").update(status="failed")
+        self.assertFalse(_claim(deliveries))
+        self.assertEqual(WebhookDelivery.objects.get(delivery_id="2").status, "pending")
+        WebhookDelivery.objects.filter(delivery_id="3").update(status="pending")
+
+        # Another worker is processing a delivery of customer 8
+        WebhookDelivery.objects.filter(delivery_id="2").update(
+            status="processing", claimed_at=timezone.now()
+        )
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 1, "retrying": 0, "failed": 0, "coalesced": 0})
+        self.assertEqual(WebhookDelivery.objects.get(delivery_id="3").status, "pending")
+
+        # The other worker has stopped
+        WebhookDelivery.objects.filter(delivery_id="2").update(
+            claimed_at=timezone.now() - datetime.timedelta(seconds=601)
+        )
+        counts = process_webhook_inbox(self.wcapi, concurrency=1)
+        self.assertEqual(counts, {"done": 2, "retrying": 0, "failed": 0, "coalesced": 0})
+        self.assertEqual(Customer.objects.get(woocommerceid=8).first_name, "Later")
+
+    def test_downloads_outside_of_transaction(self):
+        self.wcapi.resources["products/1/variations"] = [wc_variation(11), wc_variation(12)]
+        self.wcapi.resources["products/categories"] = [wc_category(5)]
+        self.wcapi.resources["customers"] = [wc_customer(7)]
+        self.wcapi.products.append(wc_product(3, "2026-01-01T00:00:00"))
+        ContactPerson.objects.create(name="X X", phone="x", email="x@x")
+        PaymentReceiver.objects.create()
+        OrderDefaults.cache.clear()
+
+        wc_parent = wc_product(
+            1, "2026-01-01T00:00:00", type="variable", variations=[11, 12], categories=[{"id": 5}]
+        )
+        self.post_webhook("product.created", wc_parent, "1")
+        wc_obj = wc_order(2, "2026-01-01T00:00:00", customer_id=7, line_items=[(1, 12), (3, 0)])
+        self.post_webhook("order.created", wc_obj, "2")
+
+        depth = len(connection.atomic_blocks)
+        depths = []
+        get = self.wcapi.get
+
+        def get_and_record(endpoint, params=None):
+            depths.append(len(connection.atomic_blocks))
+            return get(endpoint, params)
+
+        with mock.patch.object(self.wcapi, "get", get_and_record):
+            counts = process_webhook_inbox(self.wcapi, concurrency=1)
+
+        self.assertEqual(counts, {"done": 2, "retrying": 0, "failed": 0, "coalesced": 0})
+        # Variations, category, customer and product
+        self.assertEqual(len(depths), 4)
+        # Not within a transaction opened by the processing (concurrent downloads are in threads)
+        self.assertLessEqual(max(depths), depth)
+        self.assertEqual(Product.objects.get(woocommerceid=1).categories.get().woocommerceid, 5)
+        self.assertEqual(Product.objects.filter(parent__woocommerceid=1).count(), 2)
+        self.assertEqual(Order.objects.get(woocommerceid=2).products.count(), 2)
+
+
+class WooCommerceImportJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="<PASSWORD>", is_staff=True, is_superuser=True
+        )
+        self.client.force_login(self.user)
+        settings.set_secret_db_setting("wc-url", "https://shop.example.com")
+        self.wcapi = FakeWCAPI([wc_product(i, "2026-01-01T00:00:00") for i in range(1, 4)])
+
+    def test_import_view_starts_job(self):
+        for _ in range(2):
+            response = self.client.get("/kmuhelper/integrations/woocommerce/import/products")
+            job = ImportJob.objects.get()
+            self.assertRedirects(response, f"/admin/kmuhelper/importjob/{job.pk}/change/")
+
+        # The running import is shown instead of starting a second one
+        self.assertEqual(job.status, "pending")
+        self.assertEqual(job.created_by, self.user)
+        self.assertContains(self.client.get(response.url), f"/import/jobs/{job.pk}/progress")
+
+    def test_run_job(self):
+        job = ImportJob.objects.create(resource="products")
+
+        self.assertTrue(run_import_job(job.pk, self.wcapi))
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.done, job.total, job.imported, job.runs), ("done", 3, 3, 3, 1)
+        )
+        self.assertEqual(Product.objects.count(), 3)
+
+        # Finished jobs are not run again
+        self.assertFalse(run_import_job(job.pk, self.wcapi))
+
+        response = self.client.get(
+            f"/kmuhelper/integrations/woocommerce/import/jobs/{job.pk}/progress"
+        )
+        self.assertEqual(response.json()["status"], "done")
+        self.assertEqual(response.json()["imported"], 3)
+
+    def test_interrupted_job_is_resumed(self):
+        Product.objects.create(woocommerceid=1, name="Imported before the interruption")
+        now = timezone.now()
+        job = ImportJob.objects.create(
+            resource="products",
+            status="running",
+            started_at=now - datetime.timedelta(seconds=10),
+            heartbeat_at=now,
+            done=5,
+            total=20,
+            imported=1,
+        )
+
+        progress = job.get_progress()
+        self.assertAlmostEqual(progress["rate"], 0.5, places=1)
+        self.assertAlmostEqual(progress["eta"], 30, delta=1)
+
+        # Still running elsewhere
+        self.assertEqual(jobs.get_active_job("products"), job)
+        self.assertEqual(run_waiting_import_jobs(self.wcapi), 0)
+
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=now - datetime.timedelta(hours=1))
+        job.refresh_from_db()
+        self.assertTrue(job.is_interrupted)
+        self.assertIsNone(jobs.get_active_job("products"))
+
+        self.assertEqual(run_waiting_import_jobs(self.wcapi), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.total, job.imported), ("done", 2, 2, 3))
+        self.assertEqual(Product.objects.count(), 3)
+
+
+class WooCommerceTransportTest(TestCase):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            server = self.server
+            server.paths.append(self.path)
+            server.connections.add(self.client_address)
+            if server.failures:
+                server.failures -= 1
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps([{"id": 1}]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.Handler)
+        self.server.protocol_version = "HTTP/1.1"
+        self.Handler.protocol_version = "HTTP/1.1"
+        self.server.paths = []
+        self.server.connections = set()
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        close_session()
+        self.addCleanup(close_session)
+
+        host, port = self.server.server_address
+        self.wcapi = WCSessionAPI(f"http://{host}:{port}", "ck_key", "cs_secret")
+
+    @override_settings(KMUHELPER_WC_RETRY_BACKOFF=0)
+    def test_retry_and_keep_alive(self):
+        self.server.failures = 2
+
+        response = self.wcapi.get("products", params={"per_page": 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"id": 1}])
+
+        self.wcapi.get("products")
+        self.assertEqual(len(self.server.paths), 4)
+        self.assertTrue(self.server.paths[0].startswith("/wp-json/wc/v3/products?per_page=100"))
+        self.assertIn("oauth_signature=", self.server.paths[0])
+        # All requests were sent over the same connection
+        self.assertEqual(len(self.server.connections), 1)
+
+    @override_settings(KMUHELPER_WC_RETRIES=1, KMUHELPER_WC_RETRY_BACKOFF=0)
+    def test_retries_exhausted(self):
+        self.server.failures = 5
+
+        self.assertEqual(self.wcapi.get("products").status_code, 503)
+        self.assertEqual(len(self.server.paths), 2)
+
+    @override_settings(
+        KMUHELPER_WC_PER_PAGE=20, KMUHELPER_WC_RETRIES=10, KMUHELPER_WC_RETRY_BACKOFF=0
+    )
+    def test_sync_with_fake_shop(self):
+        data = FakeWooCommerceData.generate(
+            categories=5, products=40, variations_per_product=2, customers=0, orders=0
+        )
+        with FakeWooCommerceServer(data, error_rate=0.2, seed=1) as server:
+            wcapi = WCSessionAPI(server.url, "ck_key", "cs_secret")
+            WCProductCategoriesAPI(wcapi).import_all_objects_from_api()
+            self.assertEqual(WCProductsAPI(wcapi).sync_objects_from_api(), (40, 0))
+
+        self.assertGreater(server.error_count, 0)
+        self.assertEqual(ProductCategory.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 40 + 10 * 2)
+        self.assertEqual(Product.objects.exclude(parent=None).count(), 20)
+        self.assertEqual(Product.objects.filter(categories__isnull=False).count(), 40)
+
+    @override_settings(KMUHELPER_WC_PER_PAGE=10)
+    def test_sync_with_changes_during_download(self):
+        data = FakeWooCommerceData.generate(categories=0, products=40, customers=0, orders=0)
+        with FakeWooCommerceServer(data) as server:
+            wcapi = WCSessionAPI(server.url, "ck_key", "cs_secret")
+            get = wcapi.get
+
+            def get_and_change(endpoint, params=None):
+                response = get(endpoint, params=params)
+                if "modified_after" not in params:
+                    # An already downloaded product is changed after the first page
+                    data.products[0] = {
+                        **data.products[0],
+                        "name": "Changed",
+                        "date_modified_gmt": "2026-01-02T00:00:00",
+                    }
+                return response
+
+            with mock.patch.object(wcapi, "get", get_and_change):
+                self.assertEqual(WCProductsAPI(wcapi).sync_objects_from_api(), (40, 0))
+
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Product.objects.get(woocommerceid=1).name, "Changed")
+        self.assertEqual(
+            get_sync_cursors(),
+            {"products": "2026-01-02T00:00:00"},
+        )
@@ -23,6 +23,7 @@ from kmuhelper.modules.main.models import (
     PaymentReceiver,
     Product,
     ProductCategory,
+    StockMovement,
     Supplier,
     Supply,
 )
@@ -150,6 +151,11 @@ class AdminURLTests(TestCase):
         self._test_model_admins("product", obj.pk)
         self._test_model_admins("app_stock", obj.pk)
 
+    def test_model_admin_stock_movement(self):
+        product = Product.objects.create()
+        obj = StockMovement.objects.create(product=product, difference=5, reason="manual")
+        self._test_model_admins("stockmovement", obj.pk, check_add=False, check_delete=False)
+
     def test_model_admin_product_category(self):
         obj = ProductCategory.objects.create()
         self._test_model_admins("productcategory", obj.pk)